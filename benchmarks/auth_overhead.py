@@ -0,0 +1,71 @@
+"""
+Measure the authentication overhead per request of get_current_user.
+
+Signs a token with a throwaway secret and times local verification on a cache
+miss and on a cache hit. With --remote-token, also times Supabase verifying a
+real access token, which is what every request used to pay for.
+
+    python benchmarks/auth_overhead.py [--iterations 2000] [--remote-token TOKEN]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("SUPABASE_JWT_SECRET", "benchmark-secret-benchmark-secret")
+
+from jose import jwt
+
+from webapp import auth
+
+
+def make_token(index: int) -> str:
+    now = int(time.time())
+    claims = {"sub": f"user-{index}", "aud": "authenticated", "role": "authenticated", "iat": now, "exp": now + 3600}
+    return jwt.encode(claims, os.environ["SUPABASE_JWT_SECRET"], algorithm="HS256")
+
+
+def summarize(name: str, samples: list):
+    samples = sorted(samples)
+    p50 = samples[len(samples) // 2] * 1e6
+    p99 = samples[int(len(samples) * 0.99) - 1] * 1e6
+    print(f"{name:<24} mean {statistics.mean(samples) * 1e6:9.1f}us  p50 {p50:9.1f}us  p99 {p99:9.1f}us")
+
+
+async def time_calls(tokens: list) -> list:
+    samples = []
+    for token in tokens:
+        start = time.perf_counter()
+        await auth.get_current_user(f"Bearer {token}")
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def run(iterations: int, remote_token: str):
+    tokens = [make_token(index) for index in range(iterations)]
+    auth.token_cache.clear()
+    summarize("local, cache miss", await time_calls(tokens))
+    summarize("local, cache hit", await time_calls(tokens))
+
+    if remote_token:
+        samples = []
+        for _ in range(min(iterations, 50)):
+            start = time.perf_counter()
+            await auth.verify_token_remotely(remote_token)
+            samples.append(time.perf_counter() - start)
+        summarize("remote (Supabase)", samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--remote-token", default="", help="A real access token, to time remote verification")
+    args = parser.parse_args()
+    asyncio.run(run(args.iterations, args.remote_token))
+
+
+if __name__ == "__main__":
+    main()
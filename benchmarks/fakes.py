@@ -0,0 +1,449 @@
+"""
+Local stand-ins for the services the app calls, for benchmarks.
+
+- FakeSupabase: PostgREST tables held in memory, plus storage uploads
+- FakeOpenAI: files, vector stores and responses
+- FakeMistral: the OCR endpoint
+- stub_parse_documents: a replacement for agentic-doc's parse_documents
+
+Each fake has a Faults with its latency and error rate, so slow or failing
+providers can be simulated; tests can queue specific replies with script().
+The servers are ThreadingHTTPServers speaking HTTP/1.1 with keep-alive, like
+the real services.
+"""
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+Reply = Tuple[int, Dict[str, str], bytes]
+
+
+@dataclass
+class Faults:
+    """Latency and errors a fake injects into each request."""
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 500
+
+    def delay(self):
+        seconds = self.latency + random.uniform(-self.jitter, self.jitter)
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def should_fail(self) -> bool:
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+
+def json_reply(status: int, body: Any, headers: Optional[Dict[str, str]] = None) -> Reply:
+    return status, {"Content-Type": "application/json", **(headers or {})}, json.dumps(body).encode()
+
+
+class FakeService:
+    """An HTTP server on a free local port that hands every request to handle()."""
+
+    def __init__(self, faults: Optional[Faults] = None):
+        self.faults = faults or Faults()
+        self.requests = 0
+        self._script: Deque[Tuple[float, Optional[int], Dict[str, str]]] = deque()
+        self._lock = threading.Lock()
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _dispatch(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                url = urlsplit(self.path)
+                with service._lock:
+                    service.requests += 1
+                    scripted = service._script.popleft() if service._script else None
+                if scripted is not None:
+                    delay, error_status, extra_headers = scripted
+                    time.sleep(delay)
+                    injected_failure = False
+                else:
+                    error_status, extra_headers = None, {}
+                    service.faults.delay()
+                    injected_failure = service.faults.should_fail()
+                if error_status is not None:
+                    status, headers, payload = json_reply(error_status, {"error": {"message": "Scripted failure", "type": "server_error"}})
+                elif injected_failure:
+                    status, headers, payload = service.fault_reply()
+                else:
+                    try:
+                        status, headers, payload = service.handle(self.command, unquote(url.path), url.query, self.headers, body)
+                    except Exception as e:
+                        status, headers, payload = json_reply(500, {"message": f"{type(e).__name__}: {e}"})
+                self.send_response(status)
+                for name, value in {**headers, **extra_headers}.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = do_PATCH = do_PUT = do_DELETE = _dispatch
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeService":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def script(self, status: Optional[int] = None, headers: Optional[Dict[str, str]] = None, delay: float = 0.0):
+        """
+        Queue the reply to a coming request, in place of the faults: after delay
+        seconds, an error with the given status, or else the normal reply, with
+        the given headers either way.
+        """
+        with self._lock:
+            self._script.append((delay, status, headers or {}))
+
+    def fault_reply(self) -> Reply:
+        return json_reply(self.faults.error_status, {"message": "Injected failure"})
+
+    def handle(self, method: str, path: str, query: str, headers: Any, body: bytes) -> Reply:
+        raise NotImplementedError
+
+
+def _split_top_level(text: str) -> List[str]:
+    """Split on commas that aren't inside parentheses."""
+    parts, depth, current = [], 0, ""
+    for char in text:
+        if char == "," and depth == 0:
+            parts.append(current.strip())
+            current = ""
+            continue
+        depth += char == "("
+        depth -= char == ")"
+        current += char
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+def _matches(row: Dict[str, Any], column: str, operator: str, value: str) -> bool:
+    negate = operator.startswith("not.")
+    if negate:
+        operator = operator[4:]
+    actual = row.get(column)
+    if operator == "eq":
+        result = str(actual) == value
+    elif operator == "neq":
+        result = str(actual) != value
+    elif operator == "is":
+        result = actual is None if value == "null" else str(actual).lower() == value
+    elif operator == "in":
+        values = [item.strip().strip('"') for item in value.strip("()").split(",")]
+        result = str(actual) in values
+    elif operator in ("lt", "lte", "gt", "gte"):
+        try:
+            left, right = float(actual), float(value)
+        except (TypeError, ValueError):
+            return False
+        result = {"lt": left < right, "lte": left <= right, "gt": left > right, "gte": left >= right}[operator]
+    else:
+        raise ValueError(f"Unsupported filter operator: {operator}")
+    return result != negate
+
+
+def _matches_or(row: Dict[str, Any], expression: str) -> bool:
+    for condition in _split_top_level(expression.strip()[1:-1]):
+        if condition.startswith("and("):
+            if all(_matches_condition(row, part) for part in _split_top_level(condition[4:-1])):
+                return True
+        elif _matches_condition(row, condition):
+            return True
+    return False
+
+
+def _matches_condition(row: Dict[str, Any], condition: str) -> bool:
+    column, rest = condition.split(".", 1)
+    if rest.startswith("not."):
+        operator, value = rest[4:].split(".", 1)
+        return _matches(row, column, f"not.{operator}", value)
+    operator, value = rest.split(".", 1)
+    return _matches(row, column, operator, value)
+
+
+class MissingRelationship(Exception):
+    """Raised for an embedded table FakeSupabase isn't embedding."""
+
+
+class FakeSupabase(FakeService):
+    """
+    PostgREST tables and storage held in memory. Supports what the app uses:
+    inserts, updates and selects with eq/in/is/or filters, order, limit and
+    offset, and documents embedding their agentic_doc_jobs row. With
+    embedding off, embedded selects fail like they do without a foreign key.
+    max_rows caps the rows of a select, like PostgREST's db-max-rows.
+    """
+
+    PRIMARY_KEYS = {"documents": "id", "agentic_doc_jobs": "job_id"}
+    # Embedded table -> (column on the parent, column on the embedded table)
+    EMBEDS = {"agentic_doc_jobs": ("job_id", "job_id")}
+
+    def __init__(self, faults: Optional[Faults] = None, embedding: bool = True, max_rows: Optional[int] = None):
+        super().__init__(faults)
+        self.embedding = embedding
+        self.max_rows = max_rows
+        self.tables: Dict[str, List[Dict[str, Any]]] = {}
+        self.objects: Dict[str, bytes] = {}
+        self._data_lock = threading.Lock()
+
+    def fault_reply(self) -> Reply:
+        return json_reply(self.faults.error_status, {"code": "XX000", "message": "Injected failure", "details": None, "hint": None})
+
+    def rows(self, table: str) -> List[Dict[str, Any]]:
+        with self._data_lock:
+            return [dict(row) for row in self.tables.get(table, [])]
+
+    def handle(self, method: str, path: str, query: str, headers: Any, body: bytes) -> Reply:
+        if path.startswith("/rest/v1/"):
+            return self._rest(method, path[len("/rest/v1/"):], parse_qsl(query, keep_blank_values=True), headers, body)
+        if path.startswith("/storage/v1/object/public/"):
+            content = self.objects.get(path[len("/storage/v1/object/public/"):])
+            if content is None:
+                return json_reply(404, {"message": "Object not found"})
+            return 200, {"Content-Type": "application/octet-stream"}, content
+        if path.startswith("/storage/v1/object/") and method in ("POST", "PUT"):
+            key = path[len("/storage/v1/object/"):]
+            self.objects[key] = body
+            return json_reply(200, {"Key": key, "Id": str(uuid.uuid4())})
+        return json_reply(404, {"message": f"No route for {method} {path}"})
+
+    def _filter(self, rows: List[Dict[str, Any]], params: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        for key, value in params:
+            if key in ("select", "order", "limit", "offset", "columns", "on_conflict"):
+                continue
+            if key == "or":
+                rows = [row for row in rows if _matches_or(row, value)]
+                continue
+            operator, _, operand = value.partition(".")
+            if operator == "not":
+                inner, _, operand = operand.partition(".")
+                operator = f"not.{inner}"
+            rows = [row for row in rows if _matches(row, key, operator, operand)]
+        return rows
+
+    def _select(self, row: Dict[str, Any], select: str) -> Dict[str, Any]:
+        if not select or select == "*":
+            return dict(row)
+        selected = {}
+        for column in _split_top_level(select):
+            embed = re.match(r"^(\w+)\((.*)\)$", column)
+            if embed is None:
+                selected[column] = row.get(column)
+                continue
+            table, columns = embed.groups()
+            if not self.embedding:
+                raise MissingRelationship(table)
+            parent_column, child_column = self.EMBEDS[table]
+            children = [child for child in self.tables.get(table, []) if child.get(child_column) == row.get(parent_column)]
+            selected[table] = self._select(children[0], columns) if children else None
+        return selected
+
+    def _rest(self, method: str, table: str, params: List[Tuple[str, str]], headers: Any, body: bytes) -> Reply:
+        query = dict(params)
+        with self._data_lock:
+            rows = self.tables.setdefault(table, [])
+            if method == "POST":
+                payload = json.loads(body or b"[]")
+                inserted = []
+                for values in payload if isinstance(payload, list) else [payload]:
+                    row = {"created_at": time.time(), **values}
+                    key = self.PRIMARY_KEYS.get(table, "id")
+                    row.setdefault(key, str(uuid.uuid4()))
+                    rows.append(row)
+                    inserted.append(dict(row))
+                return json_reply(201, inserted)
+
+            matched = self._filter(rows, params)
+            if method == "PATCH":
+                values = json.loads(body or b"{}")
+                for row in matched:
+                    row.update(values)
+                return json_reply(200, [dict(row) for row in matched])
+            if method == "DELETE":
+                self.tables[table] = [row for row in rows if row not in matched]
+                return json_reply(200, [dict(row) for row in matched])
+
+            if "order" in query:
+                column, _, direction = query["order"].partition(".")
+                matched = sorted(matched, key=lambda row: str(row.get(column)), reverse=direction.startswith("desc"))
+            offset = int(query.get("offset", 0))
+            if "limit" in query:
+                matched = matched[offset:offset + int(query["limit"])]
+            else:
+                matched = matched[offset:]
+            if self.max_rows is not None:
+                matched = matched[:self.max_rows]
+            try:
+                return json_reply(200, [self._select(row, query.get("select", "*")) for row in matched])
+            except MissingRelationship as e:
+                return json_reply(400, {
+                    "code": "PGRST200", "details": None, "hint": None,
+                    "message": f"Could not find a relationship between '{table}' and '{e}' in the schema cache"
+                })
+
+
+class FakeOpenAI(FakeService):
+    """
+    Files, vector stores and responses of the OpenAI API. Vector stores finish
+    indexing indexing_delay seconds after they are created. Responses return a
+    JSON object with a value for every requested field.
+    """
+
+    def __init__(self, faults: Optional[Faults] = None, indexing_delay: float = 0.0):
+        super().__init__(faults)
+        self.indexing_delay = indexing_delay
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.vector_stores: Dict[str, Dict[str, Any]] = {}
+
+    def fault_reply(self) -> Reply:
+        headers = {"retry-after-ms": "200"} if self.faults.error_status == 429 else {}
+        return json_reply(self.faults.error_status, {"error": {"message": "Injected failure", "type": "server_error"}}, headers)
+
+    def handle(self, method: str, path: str, query: str, headers: Any, body: bytes) -> Reply:
+        now = int(time.time())
+        if path == "/v1/files" and method == "POST":
+            file = {
+                "id": f"file-{uuid.uuid4().hex}", "object": "file", "bytes": len(body), "created_at": now,
+                "filename": "agenticdoc-document.md", "purpose": "assistants", "status": "processed"
+            }
+            self.files[file["id"]] = file
+            return json_reply(200, file)
+        if path.startswith("/v1/files/") and method == "GET":
+            file = self.files.get(path.rsplit("/", 1)[1])
+            return json_reply(200, file) if file else json_reply(404, {"error": {"message": "No such file"}})
+        if path == "/v1/vector_stores" and method == "POST":
+            request = json.loads(body or b"{}")
+            vector_store_id = f"vs_{uuid.uuid4().hex}"
+            self.vector_stores[vector_store_id] = {
+                "id": vector_store_id, "name": request.get("name"), "metadata": request.get("metadata") or {},
+                "file_ids": request.get("file_ids") or [], "created_at": now, "ready_at": time.monotonic() + self.indexing_delay
+            }
+            return json_reply(200, self._vector_store(self.vector_stores[vector_store_id]))
+        if path.startswith("/v1/vector_stores/") and method == "GET":
+            vector_store = self.vector_stores.get(path.rsplit("/", 1)[1])
+            return json_reply(200, self._vector_store(vector_store)) if vector_store else json_reply(404, {"error": {"message": "No such vector store"}})
+        if path == "/v1/responses" and method == "POST":
+            return json_reply(200, self._response(json.loads(body or b"{}")))
+        return json_reply(404, {"error": {"message": f"No route for {method} {path}"}})
+
+    @staticmethod
+    def _vector_store(vector_store: Dict[str, Any]) -> Dict[str, Any]:
+        ready = time.monotonic() >= vector_store["ready_at"]
+        count = len(vector_store["file_ids"])
+        return {
+            "id": vector_store["id"], "object": "vector_store", "created_at": vector_store["created_at"],
+            "name": vector_store["name"], "metadata": vector_store["metadata"], "usage_bytes": 0,
+            "last_active_at": vector_store["created_at"], "expires_after": None, "expires_at": None,
+            "status": "completed" if ready else "in_progress",
+            "file_counts": {"in_progress": 0 if ready else count, "completed": count if ready else 0, "failed": 0, "cancelled": 0, "total": count}
+        }
+
+    @staticmethod
+    def _response(request: Dict[str, Any]) -> Dict[str, Any]:
+        schema = ((request.get("text") or {}).get("format") or {}).get("schema")
+        if schema:
+            field_ids = list(schema.get("properties", {}))
+        else:
+            # File search requests list the fields in the prompt, one "- id: name - description" line each
+            field_ids = re.findall(r"^- ([\w-]+):", str(request.get("input", "")), re.MULTILINE)
+        text = json.dumps({field_id: f"value of {field_id}" for field_id in field_ids})
+        return {
+            "id": f"resp_{uuid.uuid4().hex}", "object": "response", "created_at": int(time.time()), "status": "completed",
+            "model": request.get("model"), "error": None, "incomplete_details": None, "instructions": request.get("instructions"),
+            "metadata": {}, "parallel_tool_calls": True, "temperature": 1.0, "tool_choice": "auto", "tools": [], "top_p": 1.0,
+            "output": [{
+                "type": "message", "id": f"msg_{uuid.uuid4().hex}", "status": "completed", "role": "assistant",
+                "content": [{"type": "output_text", "text": text, "annotations": []}]
+            }]
+        }
+
+
+class FakeMistral(FakeService):
+    """The Mistral OCR endpoint, returning one short markdown page per requested page."""
+
+    def __init__(self, faults: Optional[Faults] = None, default_pages: int = 1):
+        super().__init__(faults)
+        self.default_pages = default_pages
+
+    def fault_reply(self) -> Reply:
+        headers = {"retry-after": "1"} if self.faults.error_status == 429 else {}
+        return json_reply(self.faults.error_status, {"message": "Injected failure"}, headers)
+
+    def handle(self, method: str, path: str, query: str, headers: Any, body: bytes) -> Reply:
+        if path != "/v1/ocr" or method != "POST":
+            return json_reply(404, {"message": f"No route for {method} {path}"})
+        request = json.loads(body or b"{}")
+        pages = request.get("pages") or list(range(self.default_pages))
+        return json_reply(200, {
+            "model": request.get("model"),
+            "pages": [{"index": index, "markdown": sample_markdown(index), "images": [], "dimensions": None} for index in pages],
+            "usage_info": {"pages_processed": len(pages), "doc_size_bytes": None}
+        })
+
+
+def sample_markdown(page: int) -> str:
+    return (
+        f"# Page {page + 1}\n\n"
+        "Employee: Jane Doe\n\nPay period: 2024-01-01 to 2024-01-15\n\n"
+        "| Item | Amount |\n| --- | --- |\n| Gross pay | 4,200.00 |\n| Net pay | 3,150.00 |\n"
+    )
+
+
+def stub_parse_documents(faults: Faults) -> Callable[..., List[Any]]:
+    """
+    A replacement for agentic-doc's parse_documents that waits like the real
+    one would and returns one short markdown document per path, with a chunk
+    per block. Injected failures come back as error chunks, which is how
+    agentic-doc reports them.
+    """
+    def parse_documents(documents: List[Any], *args: Any, **kwargs: Any) -> List[Any]:
+        results = []
+        for index, _ in enumerate(documents):
+            faults.delay()
+            if faults.should_fail():
+                chunks = [SimpleNamespace(chunk_type="error", text="Injected failure")]
+                results.append(SimpleNamespace(markdown="", chunks=chunks, errors=[]))
+                continue
+            markdown = sample_markdown(index)
+            blocks = [block for block in markdown.split("\n\n") if block.strip()]
+            chunks = [
+                SimpleNamespace(
+                    chunk_type="table" if block.startswith("|") else "text",
+                    text=block,
+                    chunk_id=str(uuid.uuid4()),
+                    grounding=[SimpleNamespace(page=0, box=SimpleNamespace(l=0.1, t=position / len(blocks), r=0.9, b=(position + 1) / len(blocks)))]
+                )
+                for position, block in enumerate(blocks)
+            ]
+            results.append(SimpleNamespace(markdown=markdown, chunks=chunks, errors=[]))
+        return results
+    return parse_documents
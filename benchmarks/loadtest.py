@@ -0,0 +1,455 @@
+"""
+Load test of the FastAPI app against local fakes of Supabase, OpenAI, Mistral
+and agentic-doc (see benchmarks/fakes.py), so it runs offline and costs
+nothing.
+
+The fakes run in this process. The app runs in a subprocess, with its
+in-process workers, so its peak RSS isn't mixed up with the load generator's.
+Each phase sends requests at the given concurrency: /process, then
+/task/{id}, then /reprocess. After /process and /reprocess, the run waits for
+the job queue to drain and reports how long documents took from enqueue to
+completion. Results are printed and written as JSON; compare two runs, say
+before and after a change, with `compare`.
+
+    python benchmarks/loadtest.py run [--requests 100] [--concurrency 8] [--output results.json]
+    python benchmarks/loadtest.py run --openai-latency 0.5 --openai-error-rate 0.1 --openai-error-status 429
+    python benchmarks/loadtest.py compare before.json after.json
+"""
+import argparse
+import asyncio
+import io
+import itertools
+import json
+import os
+import platform
+import resource
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fakes import Faults, FakeMistral, FakeOpenAI, FakeSupabase, stub_parse_documents
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+JWT_SECRET = "loadtest-secret-loadtest-secret-loadtest"
+# Any three dot-separated segments pass the Supabase client's key check
+SERVICE_ROLE_KEY = "loadtest.loadtest.loadtest"
+
+
+@dataclass
+class PhaseResult:
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+    # Answered 429 by admission control
+    rejected: int = 0
+    wall_time: float = 0.0
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "requests": len(self.latencies) + self.errors + self.rejected,
+            "errors": self.errors,
+            "rejected": self.rejected,
+            "throughput_rps": round(len(self.latencies) / self.wall_time, 2) if self.wall_time else 0.0,
+            "latency_ms": latency_summary(self.latencies)
+        }
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of sorted samples."""
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, max(0, int(round(fraction * len(samples))) - 1))]
+
+
+def latency_summary(samples: List[float]) -> Dict[str, float]:
+    samples = sorted(samples)
+    if not samples:
+        return {}
+    return {
+        "mean": round(sum(samples) / len(samples) * 1000, 2),
+        "p50": round(percentile(samples, 0.50) * 1000, 2),
+        "p95": round(percentile(samples, 0.95) * 1000, 2),
+        "p99": round(percentile(samples, 0.99) * 1000, 2),
+        "max": round(samples[-1] * 1000, 2)
+    }
+
+
+def make_token() -> str:
+    from jose import jwt
+
+    now = int(time.time())
+    claims = {"sub": str(uuid.uuid4()), "aud": "authenticated", "role": "authenticated", "iat": now, "exp": now + 24 * 3600}
+    return jwt.encode(claims, JWT_SECRET, algorithm="HS256")
+
+
+def make_pdf(pages: int) -> bytes:
+    """A blank PDF with the given page count and a unique title, so no two uploads share a content hash."""
+    from PyPDF2 import PdfWriter
+
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=612, height=792)
+    writer.add_metadata({"/Title": f"loadtest {uuid.uuid4()}"})
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def make_fields(count: int) -> List[Dict[str, str]]:
+    return [{"id": f"field_{index}", "name": f"Field {index}", "description": f"Value number {index}"} for index in range(count)]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def peak_rss_mb(pid: int) -> Optional[float]:
+    """High-water mark of a live process's resident memory, from /proc on Linux."""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def git_commit() -> str:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        return f"{commit}-dirty" if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def run_phase(requests: int, concurrency: int, send: Callable[[int], Awaitable[Any]]) -> PhaseResult:
+    """Send requests from concurrency workers; send raises for a failed request."""
+    import httpx
+
+    result = PhaseResult()
+    indices = iter(range(requests))
+
+    async def worker():
+        for index in indices:
+            start = time.perf_counter()
+            try:
+                await send(index)
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code == 429:
+                    result.rejected += 1
+                else:
+                    result.errors += 1
+            except Exception:
+                result.errors += 1
+            else:
+                result.latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result.wall_time = time.perf_counter() - start
+    return result
+
+
+def wait_for_jobs(queue_path: str, kind: str, timeout: float) -> Dict[str, Any]:
+    """Wait until no job of a kind is queued or running, then summarize how long the jobs took."""
+    deadline = time.monotonic() + timeout
+    start = time.perf_counter()
+    connection = sqlite3.connect(queue_path, timeout=30)
+    try:
+        while True:
+            pending = connection.execute(
+                "SELECT count(*) FROM jobs WHERE kind = ? AND status IN ('queued', 'running')", (kind,)
+            ).fetchone()[0]
+            if pending == 0 or time.monotonic() > deadline:
+                break
+            time.sleep(0.2)
+        rows = connection.execute("SELECT status, created_at, updated_at FROM jobs WHERE kind = ?", (kind,)).fetchall()
+    finally:
+        connection.close()
+
+    completed = [updated_at - created_at for status, created_at, updated_at in rows if status == "completed"]
+    return {
+        "jobs": len(rows),
+        "completed": len(completed),
+        "failed": sum(1 for status, _, _ in rows if status == "failed"),
+        "unfinished": pending,
+        "drain_seconds": round(time.perf_counter() - start, 2),
+        "enqueue_to_completion_ms": latency_summary(completed)
+    }
+
+
+def app_environment(args: argparse.Namespace, supabase: FakeSupabase, openai: FakeOpenAI, mistral: FakeMistral, workdir: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        "SUPABASE_URL": supabase.url,
+        "SUPABASE_SERVICE_ROLE_KEY": SERVICE_ROLE_KEY,
+        "SUPABASE_JWT_SECRET": JWT_SECRET,
+        "OPENAI_API_KEY": "loadtest",
+        "OPENAI_BASE_URL": f"{openai.url}/v1",
+        "MISTRAL_OCR_URL": f"{mistral.url}/v1/ocr",
+        "VITE_MISTRAL_API_KEY": "loadtest",
+        "JOB_QUEUE_BACKEND": "sqlite",
+        "JOB_QUEUE_PATH": os.path.join(workdir, "jobs.sqlite3"),
+        "JOB_POLL_INTERVAL": "0.1",
+        "JOB_WORKER_CONCURRENCY": str(args.workers),
+        "RUN_IN_PROCESS_WORKERS": "true",
+        "EXTRACTION_CACHE_ENABLED": "false",
+        "DEDUP_ENABLED": "false",
+        "OPENAI_REAPER_INTERVAL": "0",
+        "OPENAI_BACKOFF_BASE": "0.1",
+        "BENCH_PARSE_LATENCY": str(args.parse_latency),
+        "BENCH_PARSE_ERROR_RATE": str(args.parse_error_rate),
+        "PYTHONPATH": ROOT
+    })
+    if args.engine == "mistral":
+        env["OCR_ROUTER_CONFIG"] = json.dumps({"strategy": "ordered", "engines": [{"engine": "mistral"}]})
+    for setting in args.env:
+        key, _, value = setting.partition("=")
+        env[key] = value
+    return env
+
+
+def start_app(env: Dict[str, str], port: int, log_path: str) -> subprocess.Popen:
+    log = open(log_path, "w")
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "serve", "--port", str(port)],
+        env=env, cwd=ROOT, stdout=log, stderr=subprocess.STDOUT
+    )
+    log.close()
+    return process
+
+
+async def wait_for_app(client: Any, process: subprocess.Popen, log_path: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            if (await client.get("/health")).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.2)
+    with open(log_path) as log:
+        tail = log.read()[-3000:]
+    raise RuntimeError(f"The app did not start; end of its log ({log_path}):\n{tail}")
+
+
+async def drive(args: argparse.Namespace, port: int, process: subprocess.Popen, queue_path: str, log_path: str) -> Dict[str, Any]:
+    import httpx
+
+    headers = {"Authorization": f"Bearer {make_token()}"}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    metadata = json.dumps({"document_type": "paystub", "fields": make_fields(args.fields)})
+    task_ids: List[str] = []
+    document_ids: List[str] = []
+    phases: Dict[str, Any] = {}
+    pipeline: Dict[str, Any] = {}
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", headers=headers, limits=limits, timeout=args.timeout) as client:
+        await wait_for_app(client, process, log_path)
+
+        async def process_document(index: int):
+            files = {"file": (f"loadtest-{index}.pdf", make_pdf(args.pages), "application/pdf")}
+            response = await client.post("/process", files=files, data={"metadata": metadata})
+            response.raise_for_status()
+            body = response.json()
+            task_ids.append(body["task_id"])
+            document_ids.append(body["document_info"][0]["id"])
+
+        phases["process"] = (await run_phase(args.requests, args.concurrency, process_document)).summary()
+        pipeline["process_document"] = await asyncio.to_thread(wait_for_jobs, queue_path, "process_document", args.drain_timeout)
+
+        if task_ids:
+            task_cycle = itertools.cycle(task_ids)
+
+            async def get_task(index: int):
+                response = await client.get(f"/task/{next(task_cycle)}")
+                response.raise_for_status()
+
+            phases["task"] = (await run_phase(args.requests, args.concurrency, get_task)).summary()
+
+        if document_ids:
+            document_cycle = itertools.cycle(document_ids)
+            fields = make_fields(args.fields)
+
+            async def reprocess(index: int):
+                response = await client.post("/reprocess", json={"document_id": next(document_cycle), "fields": fields})
+                response.raise_for_status()
+
+            phases["reprocess"] = (await run_phase(args.requests, args.concurrency, reprocess)).summary()
+            pipeline["reprocess_document"] = await asyncio.to_thread(wait_for_jobs, queue_path, "reprocess_document", args.drain_timeout)
+
+    return {"phases": phases, "pipeline": pipeline}
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"commit {report['commit']}, {report['config']['requests']} requests per phase at concurrency {report['config']['concurrency']}")
+    for name, phase in report["phases"].items():
+        latency = phase["latency_ms"]
+        print(
+            f"  {name:<10} {phase['throughput_rps']:8.1f} req/s  errors {phase['errors']:<4} rejected {phase.get('rejected', 0):<4} "
+            f"p50 {latency.get('p50', 0):8.1f}ms  p95 {latency.get('p95', 0):8.1f}ms  p99 {latency.get('p99', 0):8.1f}ms"
+        )
+    for kind, jobs in report["pipeline"].items():
+        latency = jobs["enqueue_to_completion_ms"]
+        print(
+            f"  {kind:<20} {jobs['completed']}/{jobs['jobs']} completed, {jobs['failed']} failed, drained in {jobs['drain_seconds']}s, "
+            f"p50 {latency.get('p50', 0):.0f}ms  p95 {latency.get('p95', 0):.0f}ms"
+        )
+    print(f"  peak RSS of the app: {report['peak_rss_mb']} MB")
+
+
+def run(args: argparse.Namespace):
+    supabase = FakeSupabase(Faults(args.supabase_latency, args.jitter * args.supabase_latency, args.supabase_error_rate)).start()
+    openai = FakeOpenAI(
+        Faults(args.openai_latency, args.jitter * args.openai_latency, args.openai_error_rate, args.openai_error_status),
+        indexing_delay=args.openai_indexing_delay
+    ).start()
+    mistral = FakeMistral(Faults(args.mistral_latency, args.jitter * args.mistral_latency, args.mistral_error_rate), default_pages=args.pages).start()
+
+    with tempfile.TemporaryDirectory(prefix="agenticdoc-loadtest-") as workdir:
+        port = free_port()
+        log_path = args.app_log or os.path.join(workdir, "app.log")
+        env = app_environment(args, supabase, openai, mistral, workdir)
+        process = start_app(env, port, log_path)
+        try:
+            results = asyncio.run(drive(args, port, process, env["JOB_QUEUE_PATH"], log_path))
+            peak_rss = peak_rss_mb(process.pid)
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+            for fake in (supabase, openai, mistral):
+                fake.stop()
+    if peak_rss is None:
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+        peak_rss = round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / divisor, 1)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("command", "handler", "output", "app_log")},
+        **results,
+        "peak_rss_mb": peak_rss,
+        "fake_requests": {"supabase": supabase.requests, "openai": openai.requests, "mistral": mistral.requests}
+    }
+    print_report(report)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{report['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as handle:
+        json.dump(report, handle, indent=2)
+    print(f"Results written to {output}")
+
+
+def change(before: float, after: float) -> str:
+    if not before:
+        return ""
+    return f"({(after - before) / before * 100:+.1f}%)"
+
+
+def compare(args: argparse.Namespace):
+    with open(args.before) as handle:
+        before = json.load(handle)
+    with open(args.after) as handle:
+        after = json.load(handle)
+    print(f"{before['commit']} -> {after['commit']}")
+    for name, new in after["phases"].items():
+        old = before["phases"].get(name)
+        if old is None:
+            continue
+        print(f"  {name}")
+        print(f"    throughput {old['throughput_rps']:.1f} -> {new['throughput_rps']:.1f} req/s {change(old['throughput_rps'], new['throughput_rps'])}")
+        for key in ("p50", "p95", "p99"):
+            old_value, new_value = old["latency_ms"].get(key, 0), new["latency_ms"].get(key, 0)
+            print(f"    {key:<10} {old_value:.1f} -> {new_value:.1f} ms {change(old_value, new_value)}")
+        print(f"    errors     {old['errors']} -> {new['errors']}")
+        print(f"    rejected   {old.get('rejected', 0)} -> {new.get('rejected', 0)}")
+    for kind, new in after["pipeline"].items():
+        old = before["pipeline"].get(kind)
+        if old is None:
+            continue
+        old_p50, new_p50 = old["enqueue_to_completion_ms"].get("p50", 0), new["enqueue_to_completion_ms"].get("p50", 0)
+        print(f"  {kind}: drained in {old['drain_seconds']} -> {new['drain_seconds']}s, p50 {old_p50:.0f} -> {new_p50:.0f} ms {change(old_p50, new_p50)}")
+    print(f"  peak RSS {before['peak_rss_mb']} -> {after['peak_rss_mb']} MB {change(before['peak_rss_mb'] or 0, after['peak_rss_mb'] or 0)}")
+
+
+def serve(args: argparse.Namespace):
+    """Run the app with agentic-doc's parse_documents replaced by the stub; the harness starts this."""
+    import uvicorn
+
+    from webapp import background, router, sharding
+    from webapp.app import app
+
+    parse_documents = stub_parse_documents(Faults(
+        latency=float(os.getenv("BENCH_PARSE_LATENCY", "0")),
+        error_rate=float(os.getenv("BENCH_PARSE_ERROR_RATE", "0"))
+    ))
+    for module in (background, router, sharding):
+        module.parse_documents = parse_documents
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the load test")
+    run_parser.add_argument("--requests", type=int, default=100, help="Requests per phase")
+    run_parser.add_argument("--concurrency", type=int, default=8)
+    run_parser.add_argument("--workers", type=int, default=2, help="JOB_WORKER_CONCURRENCY of the app")
+    run_parser.add_argument("--fields", type=int, default=5, help="Fields to extract per document")
+    run_parser.add_argument("--pages", type=int, default=1, help="Pages per uploaded PDF")
+    run_parser.add_argument("--engine", choices=["agentic_doc", "mistral"], default="agentic_doc")
+    run_parser.add_argument("--jitter", type=float, default=0.2, help="Latency jitter, as a fraction of each latency")
+    run_parser.add_argument("--supabase-latency", type=float, default=0.01)
+    run_parser.add_argument("--supabase-error-rate", type=float, default=0.0)
+    run_parser.add_argument("--openai-latency", type=float, default=0.2)
+    run_parser.add_argument("--openai-error-rate", type=float, default=0.0)
+    run_parser.add_argument("--openai-error-status", type=int, default=500, help="Status of injected OpenAI failures, e.g. 429")
+    run_parser.add_argument("--openai-indexing-delay", type=float, default=0.0, help="Seconds vector stores take to index")
+    run_parser.add_argument("--mistral-latency", type=float, default=0.5)
+    run_parser.add_argument("--mistral-error-rate", type=float, default=0.0)
+    run_parser.add_argument("--parse-latency", type=float, default=0.5, help="Seconds the agentic-doc stub takes per document")
+    run_parser.add_argument("--parse-error-rate", type=float, default=0.0)
+    run_parser.add_argument("--timeout", type=float, default=120, help="Timeout of each request in seconds")
+    run_parser.add_argument("--drain-timeout", type=float, default=600, help="Longest wait for the job queue to drain")
+    run_parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="Extra setting for the app")
+    run_parser.add_argument("--output", help="Where to write the JSON results (default: benchmarks/results/)")
+    run_parser.add_argument("--app-log", help="Where to write the app's log (default: a temporary file)")
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = commands.add_parser("compare", help="Compare the results of two runs")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.set_defaults(handler=compare)
+
+    serve_parser = commands.add_parser("serve", help=argparse.SUPPRESS)
+    serve_parser.add_argument("--port", type=int, required=True)
+    serve_parser.set_defaults(handler=serve)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
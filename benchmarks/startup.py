@@ -0,0 +1,170 @@
+"""
+Startup-time budget of the web process.
+
+Measures, in fresh interpreters, how long `import webapp.app` takes and the
+RSS after it, and which provider modules it loaded; those should only load
+with the first job (see webapp/worker.py). Then starts the app under uvicorn
+and measures the time until /health answers and the RSS at that point. Each
+measurement is the median of --runs runs.
+
+Exits with status 1 when a measurement is over its budget or a provider module
+was loaded at import, so it can run in CI:
+
+    python benchmarks/startup.py [--runs 5] [--max-import-seconds 1] [--max-ready-seconds 1.5] [--max-rss-mb 100]
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Any, Dict, List, Optional
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Modules that only the job handlers need
+LAZY_MODULES = ("agentic_doc", "openai", "PyPDF2", "supabase", "postgrest")
+
+IMPORT_PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import webapp.app
+elapsed = time.perf_counter() - start
+rss_mb = None
+try:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                rss_mb = int(line.split()[1]) / 1024
+except OSError:
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+loaded = sorted({name.split(".")[0] for name in sys.modules} & set(%r))
+print(json.dumps({"seconds": elapsed, "rss_mb": rss_mb, "loaded": loaded}))
+""" % (LAZY_MODULES,)
+
+
+def app_environment(workdir: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        # Without a key to verify tokens with, the app refuses to start
+        "SUPABASE_JWT_SECRET": "startup-secret-startup-secret",
+        "JOB_QUEUE_BACKEND": "sqlite",
+        "JOB_QUEUE_PATH": os.path.join(workdir, "jobs.sqlite3"),
+        "PYTHONPATH": ROOT
+    })
+    return env
+
+
+def rss_mb(pid: int) -> Optional[float]:
+    """Resident memory of a live process, from /proc on Linux."""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_import(env: Dict[str, str]) -> Dict[str, Any]:
+    result = subprocess.run([sys.executable, "-c", IMPORT_PROBE], env=env, cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing webapp.app failed:\n{result.stderr[-3000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure_ready(env: Dict[str, str], timeout: float = 60) -> Dict[str, Any]:
+    port = free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "webapp.app:app", "--port", str(port), "--log-level", "warning"],
+        env=env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"The app exited on startup:\n{process.stderr.read()[-3000:]}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as response:
+                    if response.status == 200:
+                        return {"seconds": time.perf_counter() - start, "rss_mb": rss_mb(process.pid)}
+            except OSError:
+                time.sleep(0.02)
+        raise RuntimeError(f"The app did not answer /health within {timeout}s")
+    finally:
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def median(samples: List[Optional[float]]) -> Optional[float]:
+    samples = [sample for sample in samples if sample is not None]
+    return round(statistics.median(samples), 3) if samples else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the web process's startup time and memory against a budget")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import-seconds", type=float, default=1.0, help="Budget for importing webapp.app")
+    parser.add_argument("--max-ready-seconds", type=float, default=1.5, help="Budget for starting uvicorn until /health answers")
+    parser.add_argument("--max-rss-mb", type=float, default=100.0, help="Budget for the RSS of the started app")
+    parser.add_argument("--allow-eager", action="append", default=[], help="Provider module allowed to load at import, repeatable")
+    parser.add_argument("--skip-ready", action="store_true", help="Only measure the import")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="startup-") as workdir:
+        env = app_environment(workdir)
+        imports = [measure_import(env) for _ in range(args.runs)]
+        readies = [] if args.skip_ready else [measure_ready(env) for _ in range(args.runs)]
+
+    report = {
+        "python": sys.version.split()[0],
+        "runs": args.runs,
+        "import_seconds": median([run["seconds"] for run in imports]),
+        "import_rss_mb": median([run["rss_mb"] for run in imports]),
+        "eager_modules": sorted({name for run in imports for name in run["loaded"]}),
+        "ready_seconds": median([run["seconds"] for run in readies]),
+        "ready_rss_mb": median([run["rss_mb"] for run in readies])
+    }
+
+    failures = []
+    if report["import_seconds"] > args.max_import_seconds:
+        failures.append(f"import took {report['import_seconds']}s, budget {args.max_import_seconds}s")
+    if report["ready_seconds"] is not None and report["ready_seconds"] > args.max_ready_seconds:
+        failures.append(f"startup took {report['ready_seconds']}s, budget {args.max_ready_seconds}s")
+    rss = report["ready_rss_mb"] if report["ready_rss_mb"] is not None else report["import_rss_mb"]
+    if rss is not None and rss > args.max_rss_mb:
+        failures.append(f"RSS was {rss} MB, budget {args.max_rss_mb} MB")
+    eager = [name for name in report["eager_modules"] if name not in args.allow_eager]
+    if eager:
+        failures.append(f"loaded at import: {', '.join(eager)}")
+    report["failures"] = failures
+
+    print(f"import webapp.app: {report['import_seconds']}s, {report['import_rss_mb']} MB")
+    if report["ready_seconds"] is not None:
+        print(f"ready to serve:    {report['ready_seconds']}s, {report['ready_rss_mb']} MB")
+    print(f"provider modules loaded at import: {', '.join(report['eager_modules']) or 'none'}")
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    for failure in failures:
+        print(f"OVER BUDGET: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import threading
+import time
+
+import anyio
+import pytest
+from fastapi import HTTPException
+from jose import jwt
+
+from webapp import auth
+from webapp.auth import AuthenticatedUser, JWKSCache, TokenCache, TokenVerificationUnavailable
+
+
+class CountingJWKSCache(JWKSCache):
+    def __init__(self, keys, **kwargs):
+        super().__init__(url="http://jwks.invalid", **kwargs)
+        self.served_keys = keys
+        self.downloads = 0
+        self.release = threading.Event()
+        self.release.set()
+
+    def _download(self):
+        self.downloads += 1
+        self.release.wait(5)
+        return dict(self.served_keys)
+
+
+def test_unknown_key_ids_are_refetched_at_most_once_per_interval():
+    cache = CountingJWKSCache({"known": {"kid": "known"}}, refetch_interval=60)
+    assert cache.get_key("known") == {"kid": "known"}
+    for _ in range(5):
+        try:
+            cache.get_key("made-up")
+        except TokenVerificationUnavailable:
+            pass
+    assert cache.downloads == 1
+
+
+def test_key_rotation_is_picked_up_after_the_interval():
+    cache = CountingJWKSCache({"old": {"kid": "old"}}, refetch_interval=0.05)
+    cache.get_key("old")
+    cache.served_keys = {"new": {"kid": "new"}}
+    time.sleep(0.06)
+    assert cache.get_key("new") == {"kid": "new"}
+    assert cache.downloads == 2
+
+
+def test_cached_keys_are_served_while_a_fetch_is_in_flight():
+    cache = CountingJWKSCache({"known": {"kid": "known"}}, refetch_interval=0)
+    cache.get_key("known")
+    cache.release.clear()
+    fetching = threading.Thread(target=lambda: _ignore_unavailable(cache, "made-up"))
+    fetching.start()
+    try:
+        while cache.downloads < 2:
+            time.sleep(0.001)
+        start = time.monotonic()
+        assert cache.get_key("known") == {"kid": "known"}
+        assert time.monotonic() - start < 0.5
+    finally:
+        cache.release.set()
+        fetching.join()
+
+
+def _ignore_unavailable(cache, kid):
+    try:
+        cache.get_key(kid)
+    except TokenVerificationUnavailable:
+        pass
+
+
+def hs256_token():
+    return jwt.encode({"sub": "user-1", "aud": "authenticated", "exp": int(time.time()) + 60}, "other-secret", algorithm="HS256")
+
+
+def without_secret(monkeypatch, remote_fallback):
+    remote_calls = []
+    remote_user = AuthenticatedUser(id="user-1", email=None, role=None, claims={})
+
+    async def verify_token_remotely(checked_token):
+        remote_calls.append(checked_token)
+        return remote_user
+
+    monkeypatch.setattr(auth, "SUPABASE_JWT_SECRET", "")
+    monkeypatch.setattr(auth, "AUTH_REMOTE_FALLBACK", remote_fallback)
+    monkeypatch.setattr(auth, "token_cache", TokenCache())
+    monkeypatch.setattr(auth, "verify_token_remotely", verify_token_remotely)
+    return remote_calls, remote_user
+
+
+def test_hs256_tokens_are_rejected_without_a_secret_or_remote_fallback(monkeypatch):
+    remote_calls, _ = without_secret(monkeypatch, remote_fallback=False)
+
+    with pytest.raises(HTTPException) as error:
+        anyio.run(auth.get_current_user, f"Bearer {hs256_token()}")
+
+    assert error.value.status_code == 401
+    assert remote_calls == []
+
+
+def test_hs256_tokens_are_verified_remotely_with_remote_fallback(monkeypatch):
+    remote_calls, remote_user = without_secret(monkeypatch, remote_fallback=True)
+    token = hs256_token()
+
+    user = anyio.run(auth.get_current_user, f"Bearer {token}")
+
+    assert user is remote_user
+    assert remote_calls == [token]
+
+
+def test_startup_fails_without_any_key_or_remote_fallback(monkeypatch):
+    monkeypatch.setattr(auth, "SUPABASE_JWT_SECRET", "")
+    monkeypatch.setattr(auth, "SUPABASE_JWKS_URL", "")
+    monkeypatch.setattr(auth, "AUTH_REMOTE_FALLBACK", False)
+    with pytest.raises(RuntimeError):
+        auth.check_configuration()
+
+    monkeypatch.setattr(auth, "AUTH_REMOTE_FALLBACK", True)
+    auth.check_configuration()
@@ -0,0 +1,110 @@
+import pytest
+
+from webapp import background
+from webapp.chunks import ParsedContent
+from webapp.jobqueue import SQLiteJobQueue
+from webapp.router import Engine, EngineRouter
+from webapp.tasks import TaskManager, TaskStatus
+
+
+class StubEngine(Engine):
+    def __init__(self, name):
+        self.name = name
+
+    def parse(self, document, parsed_doc=None):
+        return ParsedContent(f"parsed by {self.name}")
+
+
+@pytest.fixture
+def batch(tmp_path, monkeypatch):
+    """A batch of two uploaded documents, with the queue, tasks and engines it runs against."""
+    queue = SQLiteJobQueue(str(tmp_path / "jobs.sqlite3"))
+    tasks = TaskManager()
+    failed = []
+    documents = []
+    for name in ("small", "large"):
+        file_path = tmp_path / f"{name}.png"
+        file_path.write_bytes(b"x" * (10 if name == "small" else 1000))
+        documents.append({
+            "task_id": tasks.create_task(),
+            "document_id": f"doc-{name}",
+            "agentic_job_doc_id": f"job-{name}",
+            "file_path": str(file_path),
+            "file_url": f"https://files.invalid/{name}.png",
+            "content_hash": None
+        })
+
+    monkeypatch.setattr(background, "get_job_queue", lambda: queue)
+    monkeypatch.setattr(background, "task_manager", tasks)
+    monkeypatch.setattr(background, "get_documents_status", lambda document_ids: [])
+    monkeypatch.setattr(background, "engine_router", EngineRouter([StubEngine("mistral")], {"engines": [{"engine": "mistral", "max_file_size": 100}]}))
+    monkeypatch.setattr(background, "fail_document_processing", lambda error, task_id, agentic_job_doc_id: failed.append((task_id, error)))
+    return queue, tasks, documents, failed
+
+
+def run_batch(documents):
+    background.process_document_batch_in_background("batch-1", [dict(document) for document in documents], {"document_type": "invoice", "fields": []}, "user-1")
+
+
+def test_document_no_engine_accepts_fails_alone(batch, monkeypatch):
+    queue, tasks, documents, failed = batch
+    processed = []
+    monkeypatch.setattr(background, "process_document_in_background", lambda **kwargs: processed.append(kwargs["document_id"]))
+
+    run_batch(documents)
+
+    assert processed == ["doc-small"]
+    assert [task_id for task_id, _ in failed] == [documents[1]["task_id"]]
+    assert "No engine accepts" in failed[0][1]
+    assert queue.get(documents[1]["task_id"]) is None
+
+
+def test_failed_document_is_retried_as_its_own_job(batch, monkeypatch):
+    queue, tasks, documents, failed = batch
+
+    def process(**kwargs):
+        raise Exception("OCR timed out")
+
+    monkeypatch.setattr(background, "process_document_in_background", process)
+    monkeypatch.setattr(background, "JOB_MAX_ATTEMPTS", 3)
+
+    run_batch(documents[:1])
+
+    job = queue.get(documents[0]["task_id"])
+    assert (job.kind, job.max_attempts) == ("process_document", 2)
+    assert job.payload["document_id"] == "doc-small"
+    assert job.payload["metadata"]["document_type"] == "invoice"
+    assert tasks.get_task(documents[0]["task_id"]).status == TaskStatus.PENDING
+    assert failed == []
+
+    # A retry of the batch leaves the document to its own job
+    processed = []
+    monkeypatch.setattr(background, "process_document_in_background", lambda **kwargs: processed.append(kwargs["document_id"]))
+    run_batch(documents[:1])
+    assert processed == []
+
+
+def test_failed_document_without_attempts_left_fails(batch, monkeypatch):
+    queue, tasks, documents, failed = batch
+
+    def process(**kwargs):
+        raise Exception("OCR timed out")
+
+    monkeypatch.setattr(background, "process_document_in_background", process)
+    monkeypatch.setattr(background, "JOB_MAX_ATTEMPTS", 1)
+
+    run_batch(documents[:1])
+
+    assert failed == [(documents[0]["task_id"], "OCR timed out")]
+    assert queue.get(documents[0]["task_id"]) is None
+
+
+def test_failed_batch_leaves_finished_and_handed_off_documents_alone(batch, monkeypatch):
+    queue, tasks, documents, failed = batch
+    third = dict(documents[0], task_id=tasks.create_task(), document_id="doc-third", agentic_job_doc_id="job-third")
+    monkeypatch.setattr(background, "get_documents_status", lambda document_ids: [{"id": "doc-small", "status": "completed"}])
+    queue.enqueue("process_document", {}, job_id=documents[1]["task_id"])
+
+    background.fail_document_batch("Batch failed", documents + [third])
+
+    assert failed == [(third["task_id"], "Batch failed")]
@@ -0,0 +1,171 @@
+import time
+
+import pytest
+
+from webapp import jobqueue
+from webapp.jobqueue import COMPLETED, FAILED, QUEUED, RUNNING, LeaseLost, SQLiteJobQueue
+from webapp.worker import JobHandler, Worker
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobqueue, "JOB_RETRY_DELAY", 10)
+    return SQLiteJobQueue(str(tmp_path / "jobs.sqlite3"))
+
+
+def expire_lease(queue, job_id):
+    connection = queue._connect()
+    try:
+        connection.execute("UPDATE jobs SET locked_until = ? WHERE id = ?", (time.time() - 1, job_id))
+    finally:
+        connection.close()
+
+
+def make_runnable(queue, job_id):
+    connection = queue._connect()
+    try:
+        connection.execute("UPDATE jobs SET available_at = ? WHERE id = ?", (time.time() - 1, job_id))
+    finally:
+        connection.close()
+
+
+def test_claimed_job_is_leased_to_one_worker(queue):
+    job_id = queue.enqueue("process_document", {"document_id": "doc"})
+    assert queue.depth() == 1
+
+    job = queue.claim("worker-a", visibility_timeout=60)
+
+    assert job.id == job_id
+    assert job.payload == {"document_id": "doc"}
+    assert job.status == RUNNING
+    assert job.attempts == 1
+    assert queue.claim("worker-b", visibility_timeout=60) is None
+    assert queue.depth() == 0
+
+
+def test_completed_job_is_not_claimed_again(queue):
+    job_id = queue.enqueue("process_document", {})
+    queue.claim("worker-a", visibility_timeout=60)
+
+    queue.complete(job_id, "worker-a")
+
+    assert queue.get(job_id).status == COMPLETED
+    assert queue.claim("worker-a", visibility_timeout=60) is None
+
+
+def test_failed_job_is_retried_after_a_doubling_delay(queue):
+    job_id = queue.enqueue("process_document", {})
+
+    queue.claim("worker-a", visibility_timeout=60)
+    before = time.time()
+    assert queue.fail(job_id, "worker-a", "boom") is True
+    job = queue.get(job_id)
+    assert job.status == QUEUED
+    assert job.error == "boom"
+    assert job.available_at >= before + 10
+    assert queue.claim("worker-a", visibility_timeout=60) is None
+
+    make_runnable(queue, job_id)
+    assert queue.claim("worker-a", visibility_timeout=60).attempts == 2
+    before = time.time()
+    assert queue.fail(job_id, "worker-a", "boom") is True
+    assert queue.get(job_id).available_at >= before + 20
+
+
+def test_job_fails_for_good_after_its_last_attempt(queue):
+    job_id = queue.enqueue("process_document", {}, max_attempts=2)
+
+    queue.claim("worker-a", visibility_timeout=60)
+    assert queue.fail(job_id, "worker-a", "first") is True
+    make_runnable(queue, job_id)
+    queue.claim("worker-a", visibility_timeout=60)
+    assert queue.fail(job_id, "worker-a", "second") is False
+
+    job = queue.get(job_id)
+    assert job.status == FAILED
+    assert job.error == "second"
+    assert queue.claim("worker-a", visibility_timeout=60) is None
+
+
+def test_job_is_reclaimed_once_its_lease_expires(queue):
+    job_id = queue.enqueue("process_document", {})
+    queue.claim("worker-a", visibility_timeout=60)
+
+    expire_lease(queue, job_id)
+    job = queue.claim("worker-b", visibility_timeout=60)
+
+    assert job.id == job_id
+    assert job.attempts == 2
+
+
+def test_heartbeat_keeps_the_lease(queue):
+    job_id = queue.enqueue("process_document", {})
+    queue.claim("worker-a", visibility_timeout=60)
+    expire_lease(queue, job_id)
+
+    queue.heartbeat(job_id, "worker-a", visibility_timeout=60)
+
+    assert queue.claim("worker-b", visibility_timeout=60) is None
+
+
+def test_failing_a_job_after_losing_its_lease_raises(queue):
+    job_id = queue.enqueue("process_document", {}, max_attempts=1)
+    queue.claim("worker-a", visibility_timeout=60)
+    expire_lease(queue, job_id)
+    queue.claim("worker-b", visibility_timeout=60)
+
+    with pytest.raises(LeaseLost):
+        queue.fail(job_id, "worker-a", "boom")
+
+    job = queue.get(job_id)
+    assert job.status == RUNNING
+    assert job.error is None
+
+
+def test_worker_leaves_a_job_it_lost_to_the_new_lease_holder(queue, monkeypatch):
+    job_id = queue.enqueue("process_document", {}, max_attempts=1)
+    failures = []
+
+    def run():
+        # Another worker takes over while this one is still running
+        expire_lease(queue, job_id)
+        queue.claim("worker-b", visibility_timeout=60)
+        raise RuntimeError("boom")
+
+    worker = Worker(queue, concurrency=1)
+    handler = JobHandler(run=run, on_failure=lambda error, **payload: failures.append(error))
+    job = queue.claim(worker.worker_id, visibility_timeout=60)
+
+    monkeypatch.setattr("webapp.worker.get_job_handler", lambda kind: handler)
+    worker.run_job(job)
+
+    assert failures == []
+    assert queue.get(job_id).status == RUNNING
+
+
+def test_worker_records_the_failure_once_attempts_run_out(queue, monkeypatch):
+    job_id = queue.enqueue("process_document", {}, max_attempts=1)
+    failures = []
+
+    def run():
+        raise RuntimeError("boom")
+
+    worker = Worker(queue, concurrency=1)
+    handler = JobHandler(run=run, on_failure=lambda error, **payload: failures.append(error))
+    job = queue.claim(worker.worker_id, visibility_timeout=60)
+
+    monkeypatch.setattr("webapp.worker.get_job_handler", lambda kind: handler)
+    worker.run_job(job)
+
+    assert failures == ["boom"]
+    assert queue.get(job_id).status == FAILED
+
+
+def test_admission_counts_every_job_of_a_batch(queue, monkeypatch):
+    monkeypatch.setattr(jobqueue, "get_job_queue", lambda: queue)
+    admission = jobqueue.AdmissionControl(high_water=5, ttl=60)
+
+    admission.admit(jobs=5)
+
+    with pytest.raises(jobqueue.QueueFull):
+        admission.admit()
@@ -0,0 +1,84 @@
+from types import SimpleNamespace
+
+import pytest
+
+from benchmarks.fakes import FakeSupabase
+from webapp import documents
+from webapp.documents import get_openai_resource_references
+from webapp.lifecycle import is_own_file, is_own_vector_store, list_all
+
+
+@pytest.fixture
+def fake_supabase(monkeypatch):
+    service = FakeSupabase(max_rows=2).start()
+    from supabase import create_client
+    client = create_client(service.url, "test.test.test")
+    monkeypatch.setattr(documents, "get_supabase_client", lambda: client)
+    yield service
+    service.stop()
+
+
+def test_references_are_read_past_pages_capped_below_page_size(fake_supabase):
+    fake_supabase.tables["documents"] = [
+        {"id": f"doc-{index}", "file_ids": [f"file-{index}"], "vector_store_ids": [f"vs-{index}"]} for index in range(5)
+    ] + [{"id": "doc-unparsed", "file_ids": None, "vector_store_ids": None}]
+
+    rows = get_openai_resource_references(page_size=3)
+
+    assert sorted(file_id for row in rows for file_id in row["file_ids"]) == [f"file-{index}" for index in range(5)]
+
+
+def test_no_references(fake_supabase):
+    assert get_openai_resource_references(page_size=3) == []
+
+
+@pytest.mark.parametrize("metadata, name, own", [
+    ({"created_by": "agenticdoc"}, "Invoice Extraction", True),
+    ({"created_by": "agenticdoc"}, None, True),
+    # Other apps may name their stores the same way
+    ({}, "Invoice Extraction", False),
+    (None, "Invoice Extraction", False),
+    ({"created_by": "someone-else"}, "Invoice Extraction", False),
+])
+def test_vector_stores_are_matched_by_their_tag_only(metadata, name, own):
+    assert is_own_vector_store(SimpleNamespace(metadata=metadata, name=name)) is own
+
+
+@pytest.mark.parametrize("purpose, filename, own", [
+    ("assistants", "agenticdoc-document.md", True),
+    # Other apps upload markdown too
+    ("assistants", "notes.md", False),
+    ("assistants", "document.md", False),
+    ("fine-tune", "agenticdoc-document.md", False),
+])
+def test_files_are_matched_by_their_exact_name(purpose, filename, own):
+    assert is_own_file(SimpleNamespace(purpose=purpose, filename=filename)) is own
+
+
+class RawPage:
+    def __init__(self, ids, has_more):
+        self.headers = {}
+        self.page = SimpleNamespace(data=[SimpleNamespace(id=item_id) for item_id in ids], has_more=has_more)
+
+    def parse(self):
+        return self.page
+
+
+def test_every_page_of_a_list_is_fetched_through_the_limiter(monkeypatch):
+    from webapp import ratelimit
+    pages = {None: RawPage(["a", "b"], True), "b": RawPage(["c"], False)}
+    requests = []
+    operations = []
+
+    def list_method(**params):
+        requests.append(params)
+        return pages[params.get("after")]
+
+    real_call = ratelimit.openai_limiter.call
+    monkeypatch.setattr(ratelimit.openai_limiter, "call", lambda operation, *args, **kwargs: operations.append(operation) or real_call(operation, *args, **kwargs))
+
+    items = [item.id for item in list_all("files.list", list_method, purpose="assistants")]
+
+    assert items == ["a", "b", "c"]
+    assert requests == [{"purpose": "assistants"}, {"purpose": "assistants", "after": "b"}]
+    assert operations == ["files.list", "files.list"]
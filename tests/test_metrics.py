@@ -0,0 +1,79 @@
+import urllib.error
+import urllib.request
+
+import pytest
+
+from webapp.metrics import REGISTRY, Counter, Histogram, start_metrics_server
+
+
+@pytest.fixture
+def metric_names():
+    """Names of metrics a test registers, removed from the registry afterwards."""
+    names = []
+    yield names
+    for name in names:
+        REGISTRY.pop(name, None)
+
+
+def test_histogram_renders_cumulative_buckets(metric_names):
+    histogram = Histogram("test_parse_seconds", "Parse time", ["engine"], buckets=(1, 5))
+    metric_names.append(histogram.name)
+    for value in (0.5, 1.0, 3.0, 10.0):
+        histogram.observe(value, engine="mistral")
+
+    assert histogram.render().splitlines() == [
+        "# HELP test_parse_seconds Parse time",
+        "# TYPE test_parse_seconds histogram",
+        'test_parse_seconds_bucket{engine="mistral",le="1.0"} 2',
+        'test_parse_seconds_bucket{engine="mistral",le="5.0"} 3',
+        'test_parse_seconds_bucket{engine="mistral",le="+Inf"} 4',
+        'test_parse_seconds_sum{engine="mistral"} 14.5',
+        'test_parse_seconds_count{engine="mistral"} 4',
+    ]
+
+
+def test_histogram_without_labels(metric_names):
+    histogram = Histogram("test_document_pages", "Pages", buckets=(10,))
+    metric_names.append(histogram.name)
+    histogram.observe(12)
+    assert histogram.samples() == [
+        'test_document_pages_bucket{le="10.0"} 0',
+        'test_document_pages_bucket{le="+Inf"} 1',
+        "test_document_pages_sum 12.0",
+        "test_document_pages_count 1",
+    ]
+
+
+def test_label_values_are_escaped(metric_names):
+    counter = Counter("test_failures_total", "Failures", ["stage"])
+    metric_names.append(counter.name)
+    counter.inc(stage='say "hi"\\\n')
+    assert counter.samples() == ['test_failures_total{stage="say \\"hi\\"\\\\\\n"} 1.0']
+
+
+def test_wrong_labels_are_rejected(metric_names):
+    histogram = Histogram("test_job_seconds", "Jobs", ["kind"])
+    metric_names.append(histogram.name)
+    with pytest.raises(ValueError):
+        histogram.observe(1.0, outcome="completed")
+
+
+def test_metrics_server_renders_the_registry(metric_names):
+    counter = Counter("test_jobs_total", "Jobs run", ["kind"])
+    metric_names.append(counter.name)
+    counter.inc(kind="process_document")
+    server = start_metrics_server(0, host="127.0.0.1")
+    url = "http://127.0.0.1:%d" % server.server_address[1]
+    try:
+        with urllib.request.urlopen(f"{url}/metrics") as response:
+            body = response.read().decode()
+            assert response.headers["Content-Type"].startswith("text/plain")
+        assert 'test_jobs_total{kind="process_document"} 1.0' in body.splitlines()
+        assert "# TYPE agenticdoc_job_seconds histogram" in body
+
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f"{url}/health")
+        assert error.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,183 @@
+import threading
+import time
+
+import openai
+import pytest
+from openai import OpenAI
+
+from benchmarks.fakes import Faults, FakeOpenAI
+from webapp import ratelimit
+from webapp.ratelimit import RateLimiter, TokenBucket, parse_duration
+
+
+@pytest.fixture
+def fake_openai():
+    service = FakeOpenAI().start()
+    yield service
+    service.stop()
+
+
+@pytest.fixture
+def client(fake_openai):
+    return OpenAI(api_key="test", base_url=f"{fake_openai.url}/v1", max_retries=0, timeout=0.5)
+
+
+@pytest.fixture
+def backoffs(monkeypatch):
+    """Attempts that backed off, with a short fixed delay instead of the jittered one."""
+    attempts = []
+
+    def backoff_delay(attempt):
+        attempts.append(attempt)
+        return 0.01
+
+    monkeypatch.setattr(ratelimit, "backoff_delay", backoff_delay)
+    return attempts
+
+
+def create_vector_store(limiter, client):
+    return limiter.call("create_vector_store", client.vector_stores.with_raw_response.create, name="test")
+
+
+def timed(function, *args):
+    start = time.monotonic()
+    result = function(*args)
+    return result, time.monotonic() - start
+
+
+@pytest.mark.parametrize("value, seconds", [("20ms", 0.02), ("1s", 1.0), ("6m0s", 360.0), ("1h2m", 3720.0), ("", None), ("soon", None)])
+def test_parse_duration(value, seconds):
+    assert parse_duration(value) == seconds
+
+
+def test_token_bucket_spaces_out_callers_past_its_capacity():
+    bucket = TokenBucket(rate_per_minute=600, capacity=2)
+    waits = [bucket.reserve() for _ in range(4)]
+    assert waits[:2] == [0.0, 0.0]
+    assert waits[2] == pytest.approx(0.1, abs=0.01)
+    assert waits[3] == pytest.approx(0.2, abs=0.01)
+
+
+def test_token_bucket_pause_holds_back_every_caller():
+    bucket = TokenBucket(rate_per_minute=6000, capacity=10)
+    bucket.pause(0.5)
+    assert bucket.reserve() == pytest.approx(0.5, abs=0.05)
+    assert bucket.reserve() == pytest.approx(0.5, abs=0.05)
+
+
+@pytest.mark.parametrize("headers, pause", [({"retry-after-ms": "300"}, 0.3), ({"retry-after": "0.3"}, 0.3)])
+def test_rate_limit_waits_for_retry_after(fake_openai, client, backoffs, headers, pause):
+    limiter = RateLimiter(requests_per_minute=60000)
+    fake_openai.script(status=429, headers=headers)
+
+    vector_store, elapsed = timed(create_vector_store, limiter, client)
+
+    assert vector_store.name == "test"
+    assert fake_openai.requests == 2
+    # The server's delay is used instead of the backoff
+    assert elapsed >= pause
+
+
+def test_rate_limit_pauses_other_callers_too(fake_openai, client, backoffs):
+    limiter = RateLimiter(requests_per_minute=60000)
+    fake_openai.script(status=429, headers={"retry-after-ms": "300"})
+    limited = threading.Thread(target=create_vector_store, args=(limiter, client))
+    limited.start()
+    try:
+        deadline = time.monotonic() + 5
+        while limiter.bucket.paused_until < time.monotonic() and time.monotonic() < deadline:
+            time.sleep(0.001)
+        assert limiter.bucket.reserve() >= 0.2
+    finally:
+        limited.join()
+
+
+def test_no_remaining_requests_pauses_until_the_reset(fake_openai, client):
+    limiter = RateLimiter(requests_per_minute=60000)
+    fake_openai.script(headers={"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "300ms"})
+
+    _, first = timed(create_vector_store, limiter, client)
+    _, second = timed(create_vector_store, limiter, client)
+
+    assert first < 0.2
+    assert second >= 0.25
+
+
+def test_remaining_requests_left_do_not_pause(fake_openai, client):
+    limiter = RateLimiter(requests_per_minute=60000)
+    fake_openai.script(headers={"x-ratelimit-remaining-requests": "1", "x-ratelimit-reset-requests": "5s"})
+    create_vector_store(limiter, client)
+    _, elapsed = timed(create_vector_store, limiter, client)
+    assert elapsed < 0.2
+
+
+def test_server_errors_are_retried_with_backoff(fake_openai, client, backoffs):
+    limiter = RateLimiter(requests_per_minute=60000, max_attempts=5)
+    fake_openai.script(status=500)
+    fake_openai.script(status=503)
+
+    vector_store = create_vector_store(limiter, client)
+
+    assert vector_store.name == "test"
+    assert backoffs == [1, 2]
+
+
+def test_timeouts_are_retried_with_backoff(fake_openai, client, backoffs):
+    limiter = RateLimiter(requests_per_minute=60000, max_attempts=5)
+    fake_openai.script(delay=1.0)
+
+    vector_store = create_vector_store(limiter, client)
+
+    assert vector_store.name == "test"
+    assert backoffs == [1]
+
+
+def test_client_errors_are_not_retried(fake_openai, client, backoffs):
+    limiter = RateLimiter(requests_per_minute=60000)
+    fake_openai.script(status=400)
+    with pytest.raises(openai.BadRequestError):
+        create_vector_store(limiter, client)
+    assert fake_openai.requests == 1
+
+
+def test_attempts_are_capped(backoffs):
+    failing = FakeOpenAI(Faults(error_rate=1.0, error_status=500)).start()
+    try:
+        failing_client = OpenAI(api_key="test", base_url=f"{failing.url}/v1", max_retries=0, timeout=0.5)
+        limiter = RateLimiter(requests_per_minute=60000, max_attempts=3)
+        with pytest.raises(openai.InternalServerError):
+            create_vector_store(limiter, failing_client)
+        assert failing.requests == 3
+        assert backoffs == [1, 2]
+    finally:
+        failing.stop()
+
+
+def test_concurrency_is_capped():
+    slow = FakeOpenAI(Faults(latency=0.1)).start()
+    slow_client = OpenAI(api_key="test", base_url=f"{slow.url}/v1", max_retries=0, timeout=5)
+    limiter = RateLimiter(requests_per_minute=60000, max_concurrency=2)
+    in_flight, peak = [0], [0]
+    lock = threading.Lock()
+
+    def create(**kwargs):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        try:
+            return slow_client.vector_stores.with_raw_response.create(**kwargs)
+        finally:
+            with lock:
+                in_flight[0] -= 1
+
+    try:
+        threads = [threading.Thread(target=limiter.call, args=("create_vector_store", create), kwargs={"name": "test"}) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        slow.stop()
+
+    assert slow.requests == 6
+    assert peak[0] == 2
@@ -0,0 +1,151 @@
+import json
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+from postgrest.exceptions import APIError
+
+from benchmarks.fakes import FakeSupabase
+from webapp import repository
+from webapp.repository import DocumentNotFound, DocumentRepository, WriteBuffer
+
+
+@pytest.fixture
+def fake_supabase():
+    service = FakeSupabase().start()
+    service.tables["documents"] = [
+        {"id": "doc-1", "job_id": "job-1", "user_id": "user-1", "status": "completed", "document_type": "invoice"}
+    ]
+    service.tables["agentic_doc_jobs"] = [
+        {"job_id": "job-1", "result": "# Invoice", "fields": [{"id": "total"}], "chunks": [{"text": "Total: 10", "type": "text"}]}
+    ]
+    yield service
+    service.stop()
+
+
+@pytest.fixture
+def supabase(fake_supabase, monkeypatch):
+    from supabase import create_client
+    client = create_client(fake_supabase.url, "test.test.test")
+    monkeypatch.setattr(repository, "get_supabase_client", lambda: client)
+    return client
+
+
+@pytest.fixture
+def requests(fake_supabase, monkeypatch):
+    """Method, table and query of every request the fake gets."""
+    seen = []
+    handle = fake_supabase.handle
+
+    def recording_handle(method, path, query, headers, body):
+        seen.append((method, path.rsplit("/", 1)[-1], parse_qs(query), json.loads(body) if body else None))
+        return handle(method, path, query, headers, body)
+
+    monkeypatch.setattr(fake_supabase, "handle", recording_handle)
+    return seen
+
+
+def test_get_reads_the_document_and_job_in_one_request(supabase, requests):
+    record = DocumentRepository().get("doc-1")
+
+    assert (record.id, record.job_id, record.status, record.document_type) == ("doc-1", "job-1", "completed", "invoice")
+    assert (record.markdown, record.fields, record.chunks) == ("# Invoice", [{"id": "total"}], None)
+    assert len(requests) == 1
+    method, table, query, _ = requests[0]
+    assert (method, table) == ("GET", "documents")
+    assert "agentic_doc_jobs(result,fields)" in query["select"][0]
+
+
+def test_get_reads_chunks_only_when_asked(supabase, requests, monkeypatch):
+    monkeypatch.setattr(repository, "CHUNK_COLUMNS", ", chunks")
+    record = DocumentRepository().get("doc-1", include_chunks=True)
+    assert record.chunks == [{"text": "Total: 10", "type": "text"}]
+    assert "agentic_doc_jobs(result,fields,chunks)" in requests[0][2]["select"][0]
+
+
+def test_get_falls_back_to_separate_reads_without_a_relationship(fake_supabase, supabase, requests):
+    fake_supabase.embedding = False
+    documents = DocumentRepository()
+
+    record = documents.get("doc-1")
+
+    assert (record.id, record.markdown) == ("doc-1", "# Invoice")
+    assert [(method, table) for method, table, _, _ in requests] == [
+        ("GET", "documents"), ("GET", "documents"), ("GET", "agentic_doc_jobs")
+    ]
+
+    # The failed embedded select isn't tried again
+    requests.clear()
+    documents.get("doc-1")
+    assert [table for _, table, _, _ in requests] == ["documents", "agentic_doc_jobs"]
+
+
+def test_get_raises_other_api_errors(fake_supabase, supabase):
+    fake_supabase.script(status=400)
+    with pytest.raises(APIError):
+        DocumentRepository().get("doc-1")
+
+
+def test_get_missing_document_raises(fake_supabase, supabase):
+    with pytest.raises(DocumentNotFound):
+        DocumentRepository().get("doc-2")
+    fake_supabase.embedding = False
+    with pytest.raises(DocumentNotFound):
+        DocumentRepository().get("doc-2")
+
+
+def test_document_without_a_job_has_no_markdown(fake_supabase, supabase):
+    fake_supabase.tables["agentic_doc_jobs"] = []
+    record = DocumentRepository().get("doc-1")
+    assert (record.markdown, record.fields) == (None, None)
+
+
+def test_writes_to_a_row_are_merged(fake_supabase, supabase, requests):
+    writes = WriteBuffer()
+    writes.update_job("job-1", result="# Old")
+    writes.update_document("doc-1", status="processing")
+    writes.update_job("job-1", result="# New", error="")
+    writes.update_document("doc-1", status="completed")
+    assert len(writes) == 2
+
+    writes.flush()
+
+    assert [(method, table, body) for method, table, _, body in requests] == [
+        ("PATCH", "agentic_doc_jobs", {"result": "# New", "error": ""}),
+        ("PATCH", "documents", {"status": "completed"})
+    ]
+    assert fake_supabase.rows("agentic_doc_jobs")[0]["result"] == "# New"
+    assert fake_supabase.rows("documents")[0]["status"] == "completed"
+    assert len(writes) == 0
+
+
+def test_rows_updated_by_different_keys_are_written_separately(supabase, requests):
+    writes = WriteBuffer()
+    writes.update_document("doc-1", file_ids=["file-1"])
+    writes.update_document_by_job_id("job-1", status="completed")
+    writes.flush()
+    assert [query for _, _, query, _ in requests] == [{"id": ["eq.doc-1"]}, {"job_id": ["eq.job-1"]}]
+
+
+def test_failed_write_stops_the_flush(fake_supabase, supabase):
+    writes = WriteBuffer()
+    writes.update_job("job-1", result="# New")
+    writes.update_document("doc-1", status="failed")
+    fake_supabase.script(status=500)
+
+    with pytest.raises(APIError):
+        writes.flush()
+
+    assert fake_supabase.rows("agentic_doc_jobs")[0]["result"] == "# Invoice"
+    assert fake_supabase.rows("documents")[0]["status"] == "completed"
+
+
+def test_transition_writes_nothing_when_the_block_raises(fake_supabase, supabase, requests):
+    with pytest.raises(RuntimeError):
+        with DocumentRepository().transition() as writes:
+            writes.update_document("doc-1", status="failed")
+            raise RuntimeError("parsing failed")
+    assert requests == []
+
+    with DocumentRepository().transition() as writes:
+        writes.update_document("doc-1", status="failed")
+    assert fake_supabase.rows("documents")[0]["status"] == "failed"
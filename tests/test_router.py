@@ -0,0 +1,129 @@
+import pytest
+
+from webapp.chunks import ParsedContent
+from webapp.router import DocumentInfo, Engine, EngineRouter, NoEngineSucceeded
+
+
+class StubEngine(Engine):
+    def __init__(self, name, fail=False):
+        self.name = name
+        self.fail = fail
+        self.calls = 0
+
+    def parse(self, document, parsed_doc=None):
+        self.calls += 1
+        if self.fail:
+            raise Exception(f"{self.name} is down")
+        return ParsedContent(f"parsed by {self.name}")
+
+
+def document(page_count=1, file_size=1000, mime_type="application/pdf"):
+    return DocumentInfo(file_path="doc.pdf", file_url="https://files.invalid/doc.pdf", page_count=page_count, file_size=file_size, mime_type=mime_type)
+
+
+def names(engines):
+    return [engine.name for engine in engines]
+
+
+def test_engines_are_tried_in_order_until_one_succeeds():
+    first, second, third = StubEngine("first", fail=True), StubEngine("second"), StubEngine("third")
+    router = EngineRouter([first, second, third], {"engines": [{"engine": "first"}, {"engine": "second"}, {"engine": "third"}]})
+
+    content, engine_name = router.parse(document())
+
+    assert (content.markdown, engine_name) == ("parsed by second", "second")
+    assert (first.calls, second.calls, third.calls) == (1, 1, 0)
+
+
+def test_all_engines_failing_raises():
+    router = EngineRouter([StubEngine("first", fail=True)], {"engines": [{"engine": "first"}]})
+    with pytest.raises(NoEngineSucceeded, match="first is down"):
+        router.parse(document())
+
+
+def test_unknown_engine_in_config_is_rejected():
+    with pytest.raises(ValueError):
+        EngineRouter([StubEngine("first")], {"engines": [{"engine": "missing"}]})
+
+
+@pytest.mark.parametrize("features, expected", [
+    ({"page_count": 5}, ["small", "any"]),
+    ({"page_count": 6}, ["any"]),
+    # An unknown page count doesn't rule an engine out
+    ({"page_count": None}, ["small", "any"]),
+    ({"file_size": 2048}, ["any"]),
+    ({"mime_type": "image/png"}, ["any"]),
+])
+def test_rules_filter_engines_by_document_features(features, expected):
+    router = EngineRouter([StubEngine("small"), StubEngine("any")], {"engines": [
+        {"engine": "small", "max_pages": 5, "max_file_size": 1024, "mime_types": ["application/pdf"]},
+        {"engine": "any"}
+    ]})
+    assert names(router.route(document(**features))) == expected
+
+
+def test_no_rule_accepting_a_document_raises():
+    router = EngineRouter([StubEngine("small")], {"engines": [{"engine": "small", "max_pages": 1}]})
+    assert router.route(document(page_count=2)) == []
+    with pytest.raises(NoEngineSucceeded):
+        router.parse(document(page_count=2))
+
+
+def test_engine_over_its_error_rate_is_demoted_until_it_recovers(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr("webapp.router.time.monotonic", lambda: clock[0])
+    router = EngineRouter([StubEngine("flaky"), StubEngine("steady")], {"engines": [
+        {"engine": "flaky", "max_error_rate": 0.5, "min_samples": 4, "recovery_seconds": 30},
+        {"engine": "steady"}
+    ]})
+    for succeeded in (True, False, False, False):
+        router.stats["flaky"].record(1.0, succeeded)
+
+    # Demoted, but kept as a last resort
+    assert names(router.route(document())) == ["steady", "flaky"]
+    clock[0] += 29
+    assert names(router.route(document())) == ["steady", "flaky"]
+    clock[0] += 2
+    assert names(router.route(document())) == ["flaky", "steady"]
+
+
+def test_error_rate_is_ignored_below_min_samples():
+    router = EngineRouter([StubEngine("flaky"), StubEngine("steady")], {"engines": [
+        {"engine": "flaky", "max_error_rate": 0.1, "min_samples": 4},
+        {"engine": "steady"}
+    ]})
+    for _ in range(3):
+        router.stats["flaky"].record(1.0, False)
+    assert names(router.route(document())) == ["flaky", "steady"]
+
+
+def test_fastest_strategy_orders_healthy_engines_by_mean_latency():
+    router = EngineRouter([StubEngine("slow"), StubEngine("fast")], {"strategy": "fastest", "engines": [
+        {"engine": "slow"}, {"engine": "fast"}
+    ]})
+    router.stats["slow"].record(5.0, True)
+    router.stats["fast"].record(1.0, True)
+    # Failed calls don't count towards latency
+    router.stats["fast"].record(60.0, False)
+    assert names(router.route(document())) == ["fast", "slow"]
+
+
+def test_fastest_strategy_tries_engines_without_latency_first():
+    router = EngineRouter([StubEngine("measured"), StubEngine("untried")], {"strategy": "fastest", "engines": [
+        {"engine": "measured"}, {"engine": "untried"}
+    ]})
+    router.stats["measured"].record(0.001, True)
+    # An engine with no successful call yet counts as taking no time
+    assert names(router.route(document())) == ["untried", "measured"]
+
+
+def test_fastest_strategy_keeps_unhealthy_engines_last():
+    router = EngineRouter([StubEngine("fast"), StubEngine("slow")], {"strategy": "fastest", "engines": [
+        {"engine": "fast", "max_error_rate": 0.5, "min_samples": 2},
+        {"engine": "slow"}
+    ]})
+    router.stats["fast"].record(0.1, True)
+    router.stats["fast"].record(0.1, False)
+    router.stats["fast"].record(0.1, False)
+    router.stats["slow"].record(10.0, True)
+    assert names(router.route(document())) == ["slow", "fast"]
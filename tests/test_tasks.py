@@ -0,0 +1,46 @@
+import time
+
+from webapp.tasks import TaskManager, TaskStatus
+
+
+def test_finished_tasks_expire_after_ttl():
+    manager = TaskManager(ttl=0.05, max_entries=100, unfinished_ttl=60)
+    task_id = manager.create_task()
+    manager.update_task(task_id, TaskStatus.COMPLETED)
+    time.sleep(0.06)
+    manager.create_task()
+    assert manager.get_task(task_id) is None
+
+
+def test_unfinished_tasks_expire_after_their_own_ttl():
+    manager = TaskManager(ttl=60, max_entries=100, unfinished_ttl=0.05)
+    task_id = manager.create_task()
+    time.sleep(0.06)
+    manager.create_task()
+    assert manager.get_task(task_id) is None
+
+
+def test_finished_tasks_are_dropped_before_unfinished_ones_over_capacity():
+    manager = TaskManager(ttl=60, max_entries=2, unfinished_ttl=60)
+    unfinished = manager.create_task()
+    finished = manager.create_task()
+    manager.update_task(finished, TaskStatus.FAILED, error="boom")
+    manager.create_task()
+    assert manager.get_task(finished) is None
+    assert manager.get_task(unfinished) is not None
+
+
+def test_unfinished_tasks_are_dropped_oldest_first_when_nothing_finished():
+    manager = TaskManager(ttl=60, max_entries=2, unfinished_ttl=60)
+    task_ids = [manager.create_task() for _ in range(3)]
+    assert manager.get_task(task_ids[0]) is None
+    assert manager.get_task(task_ids[1]) is not None
+    assert len(manager.tasks) == 2
+
+
+def test_deleted_task_is_forgotten():
+    manager = TaskManager(ttl=60, max_entries=1, unfinished_ttl=60)
+    task_id = manager.create_task()
+    manager.delete_task(task_id)
+    assert manager.tasks == {}
+    assert not manager._unfinished
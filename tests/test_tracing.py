@@ -0,0 +1,87 @@
+import pytest
+
+from webapp import tracing, worker
+from webapp.jobqueue import COMPLETED, SQLiteJobQueue
+from webapp.tracing import TRACEPARENT_PAYLOAD_KEY, SpanExporter, parse_traceparent
+from webapp.worker import JobHandler, Worker
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+SPAN_ID = "00f067aa0ba902b7"
+
+
+class CollectingExporter(SpanExporter):
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+
+@pytest.fixture
+def exported():
+    exporter = CollectingExporter()
+    tracing.set_exporter(exporter)
+    yield exporter.spans
+    tracing.set_exporter(None)
+
+
+def test_parse_traceparent():
+    context = parse_traceparent(f"00-{TRACE_ID}-{SPAN_ID}-01")
+    assert (context.trace_id, context.span_id, context.sampled) == (TRACE_ID, SPAN_ID, True)
+    assert parse_traceparent(f" 00-{TRACE_ID}-{SPAN_ID}-00 ").sampled is False
+
+
+@pytest.mark.parametrize("value", [
+    None,
+    "",
+    "garbage",
+    f"00-{TRACE_ID}-{SPAN_ID}",
+    f"00-{TRACE_ID[:-1]}-{SPAN_ID}-01",
+    f"00-{TRACE_ID}-{SPAN_ID}0-01",
+    f"00-{'z' * 32}-{SPAN_ID}-01",
+    f"00-{TRACE_ID}-{SPAN_ID}-zz",
+    f"00-{'0' * 32}-{SPAN_ID}-01",
+    f"00-{TRACE_ID}-{'0' * 16}-01",
+])
+def test_malformed_traceparent_is_ignored(value):
+    assert parse_traceparent(value) is None
+
+
+def test_span_continues_a_remote_parent(exported):
+    with tracing.span("job", kind="consumer", parent=f"00-{TRACE_ID}-{SPAN_ID}-01") as job_span:
+        with tracing.span("stage parse") as stage_span:
+            assert tracing.current_traceparent() == f"00-{TRACE_ID}-{stage_span.span_id}-01"
+    tracing.flush()
+
+    assert (job_span.trace_id, job_span.parent_id) == (TRACE_ID, SPAN_ID)
+    assert (stage_span.trace_id, stage_span.parent_id) == (TRACE_ID, job_span.span_id)
+    assert {span.name for span in exported} == {"job", "stage parse"}
+
+
+def test_inject_payload_carries_the_current_trace(exported):
+    payload = {"document_id": "doc-1"}
+    assert tracing.inject_payload(payload) is payload
+    with tracing.span("request", kind="server") as request_span:
+        injected = tracing.inject_payload(payload)
+    assert injected == {"document_id": "doc-1", TRACEPARENT_PAYLOAD_KEY: request_span.traceparent}
+    assert TRACEPARENT_PAYLOAD_KEY not in payload
+
+
+def test_worker_pops_the_traceparent_before_calling_the_handler(tmp_path, monkeypatch, exported):
+    queue = SQLiteJobQueue(str(tmp_path / "jobs.sqlite3"))
+    calls = []
+
+    def run(**payload):
+        calls.append((payload, tracing.current_span()))
+
+    monkeypatch.setattr(worker, "get_job_handler", lambda kind: JobHandler(run=run, on_failure=lambda error, **payload: None))
+    queue.enqueue("test", {"document_id": "doc-1", TRACEPARENT_PAYLOAD_KEY: f"00-{TRACE_ID}-{SPAN_ID}-01"}, job_id="job-1")
+    job_worker = Worker(queue)
+    job = queue.claim(job_worker.worker_id, 60)
+
+    job_worker.run_job(job)
+
+    payload, handler_span = calls[0]
+    assert payload == {"document_id": "doc-1"}
+    assert (handler_span.name, handler_span.trace_id, handler_span.parent_id) == ("job test", TRACE_ID, SPAN_ID)
+    assert queue.get("job-1").status == COMPLETED
@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+
+from webapp.lifecycle import ReaperScheduler
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LOADED_MODULES_PROBE = """
+import sys
+from webapp.worker import get_job_handler
+get_job_handler(%r)
+print(" ".join(sorted({"webapp.background", "openai", "PyPDF2", "agentic_doc"} & set(sys.modules))))
+"""
+
+
+def loaded_by_handler(kind):
+    result = subprocess.run([sys.executable, "-c", LOADED_MODULES_PROBE % kind], cwd=ROOT, capture_output=True, text=True, check=True)
+    return result.stdout.split()
+
+
+def test_reaper_handler_does_not_load_the_document_pipeline():
+    assert loaded_by_handler("reap_openai_resources") == []
+
+
+def test_document_handler_loads_the_document_pipeline():
+    assert "webapp.background" in loaded_by_handler("process_document")
+
+
+def test_reaper_is_first_scheduled_one_interval_after_start(monkeypatch):
+    scheduled = []
+    scheduler = ReaperScheduler(interval=0.2)
+    monkeypatch.setattr(scheduler, "schedule", lambda: scheduled.append(True))
+    scheduler.start()
+    try:
+        scheduler._stopping.wait(0.1)
+        assert scheduled == []
+        scheduler._stopping.wait(0.2)
+        assert scheduled == [True]
+    finally:
+        scheduler.stop()
@@ -1,22 +1,32 @@
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 from dotenv import load_dotenv
+load_dotenv()
 
 from webapp.constant import DOCUMENT_BUCKET_NAME
-from webapp.documents import  save_document_info,create_agentic_doc_job
-from webapp.upload import upload_file_to_storage
-load_dotenv()
+from webapp.documents import  save_document_info,create_agentic_doc_job, create_agentic_doc_jobs, get_document_result, get_documents_status, save_documents_info
+from webapp.db import run_supabase_call
+from webapp.dedup import DEDUP_ENABLED
+from webapp.upload import upload_file_to_storage, spool_upload_to_disk, cleanup_temp_dir
 
 import os
+import uuid
+import asyncio
 
 from pathlib import Path
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Depends, Form, Body, Query
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Form, Body, Query, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import logging
-import tempfile
-from webapp.tasks import TaskStatus,task_manager
-from webapp.background import process_document_in_background, reprocess_document_in_background
-from webapp.auth import get_current_user
+from webapp.tasks import TaskStage, TaskStatus,task_manager
+from webapp.jobqueue import COMPLETED, FAILED, QUEUED, RUNNING, QueueFull, admit_jobs, enqueue_job, get_job, get_job_queue
+from webapp.worker import Worker, start_in_process_workers, start_warm_up
+from webapp.auth import check_configuration, get_current_user, get_current_user_for_stream
+from webapp.events import event_broker, format_sse
+from webapp.executor import shutdown_cpu_executor
+from webapp.metrics import DOCUMENT_BYTES, JOBS_REJECTED, render_prometheus, track_stage
+from webapp import tracing
 import json
+from datetime import datetime
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -38,16 +48,89 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Record each request as the root span of its trace, continuing the caller's trace if it sent one."""
+    # Named after the route template, which keeps span names low-cardinality, once routing found it
+    with tracing.span("http request", kind="server", parent=request.headers.get("traceparent"), method=request.method) as span:
+        response = await call_next(request)
+        if span is not None:
+            route = request.scope.get("route")
+            span.name = f"{request.method} {route.path if route is not None else 'unmatched'}"
+            span.set_attribute("status_code", response.status_code)
+            response.headers["traceparent"] = span.traceparent
+        return response
+
+in_process_worker: Optional[Worker] = None
+
+@app.on_event("startup")
+def check_auth_configuration():
+    check_configuration()
+
+@app.on_event("startup")
+def start_workers():
+    global in_process_worker
+    in_process_worker = start_in_process_workers()
+    start_warm_up()
+
+@app.on_event("shutdown")
+def stop_workers():
+    if in_process_worker is not None:
+        in_process_worker.stop()
+    shutdown_cpu_executor()
+
+def wake_workers():
+    if in_process_worker is not None:
+        in_process_worker.wake()
+
+async def admit_or_reject(endpoint: str, jobs: int = 1):
+    """Turn the request away with 429 while the job queue is over its high-water mark."""
+    try:
+        await admit_jobs(jobs)
+    except QueueFull as e:
+        JOBS_REJECTED.inc(endpoint=endpoint)
+        logger.warning(f"Rejecting {endpoint}: {str(e)}")
+        raise HTTPException(
+            status_code=429,
+            detail="Too many documents are waiting to be processed, retry later",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+def release_spooled_uploads(uploads):
+    """
+    Remove spooled uploads once they are in storage, unless the workers run on
+    this machine. Workers elsewhere download the file instead, and nothing on
+    this machine would ever remove it.
+    """
+    if not get_job_queue().shares_disk:
+        for upload in uploads:
+            cleanup_temp_dir(upload.temp_dir)
+
+JOB_TASK_STATUS = {
+    QUEUED: TaskStatus.PENDING,
+    RUNNING: TaskStatus.PROCESSING,
+    COMPLETED: TaskStatus.COMPLETED,
+    FAILED: TaskStatus.FAILED,
+}
+
+# Seconds between keep-alive comments on idle event streams
+SSE_KEEPALIVE_INTERVAL = float(os.getenv("SSE_KEEPALIVE_INTERVAL", "15"))
+
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "50"))
+
 ALLOWED_EXTENSIONS = {'.pdf', '.png', '.jpg', '.jpeg'}
 
 def is_valid_file(filename: str) -> bool:
     return Path(filename).suffix.lower() in ALLOWED_EXTENSIONS
 
+def content_hash_of(upload) -> Optional[str]:
+    """The upload's SHA-256, only stored when deduplication is on, since it needs the documents.content_hash column."""
+    return upload.sha256 if DEDUP_ENABLED else None
+
 @app.post("/process")
 async def process_document(
     file: UploadFile = File(...),
     metadata: str = Form(...),
-    background_tasks: BackgroundTasks = BackgroundTasks(),
     current_user: Dict[str, Any] = Depends(get_current_user)
 ):
     """
@@ -56,45 +139,51 @@ async def process_document(
     Args:
         file: The uploaded file to process
         metadata: JSON string containing additional metadata
-        background_tasks: FastAPI background tasks
         current_user: Current authenticated user
     """
+    upload = None
+    task_id = None
     try:
+        # Reject before the upload is spooled or stored
+        await admit_or_reject("/process")
+
         # Parse the metadata JSON string
         metadata_dict = json.loads(metadata)
 
-        task_id = task_manager.create_task()
-        temp_dir = tempfile.mkdtemp()
-        temp_file_path = os.path.join(temp_dir, file.filename)
-
-        content = await file.read()
-            
-        with open(temp_file_path, "wb") as buffer:
-            buffer.write(content)
-
-        file_path = upload_file_to_storage(
-            user_id=current_user.id,
-            file_content=content,
-            file_name=file.filename,
-            bucket_name=DOCUMENT_BUCKET_NAME
-        )
+        with track_stage("receive_upload"):
+            upload = await spool_upload_to_disk(file)
+        DOCUMENT_BYTES.observe(upload.file_size)
 
+        async def upload_to_storage() -> str:
+            with track_stage("storage_upload"), open(upload.file_path, "rb") as handle:
+                return await run_supabase_call(
+                    upload_file_to_storage,
+                    user_id=current_user.id,
+                    file_content=handle,
+                    file_name=file.filename,
+                    bucket_name=DOCUMENT_BUCKET_NAME
+                )
 
-        agentic_job_doc = create_agentic_doc_job(
-            user_id=current_user.id,
-            fields=metadata_dict.get("fields", {}),
-            result={},
-            error="",
-            document_type=metadata_dict.get("document_type", "unknown")
+        # The storage upload and the job row don't depend on each other
+        file_path, agentic_job_doc = await asyncio.gather(
+            upload_to_storage(),
+            run_supabase_call(
+                create_agentic_doc_job,
+                user_id=current_user.id,
+                fields=metadata_dict.get("fields", {}),
+                result={},
+                error="",
+                document_type=metadata_dict.get("document_type", "unknown")
+            )
         )
-
-
+        release_spooled_uploads([upload])
         agentic_job_doc_id = agentic_job_doc[0]["job_id"]
         # Save document info with metadata
-        document_info = save_document_info(
+        document_info = await run_supabase_call(
+            save_document_info,
             user_id=current_user.id,
             file_name=file.filename,
-            file_size=file.size,  
+            file_size=upload.file_size,
             file_type=file.content_type,
             status="processing",
             document_type=metadata_dict.get("document_type", "unknown"),
@@ -102,45 +191,235 @@ async def process_document(
             error_message="",
             job_id=agentic_job_doc_id,
             metadata=metadata_dict.get("fields", {}),
-            file_path=file_path
+            file_path=file_path,
+            content_hash=content_hash_of(upload)
         )
 
         document_id = document_info[0]["id"]
 
-
-        background_tasks.add_task(process_document_in_background, task_id, temp_file_path, agentic_job_doc_id,metadata_dict,file_path, document_id)
+        # Created last, so a failed upload never leaves a task behind
+        task_id = task_manager.create_task()
+        task_manager.set_stage(task_id, TaskStage.UPLOADED)
+        await enqueue_job("process_document", {
+            "task_id": task_id,
+            "file_path": upload.file_path,
+            "agentic_job_doc_id": agentic_job_doc_id,
+            "metadata": metadata_dict,
+            "file_url": file_path,
+            "document_id": document_id,
+            "user_id": current_user.id,
+            "content_hash": content_hash_of(upload)
+        }, job_id=task_id)
+        wake_workers()
         
         return {"message": "Document processing started", "document_info": document_info, "task_id": task_id, "status": "processing"}
         
     except json.JSONDecodeError:
         raise HTTPException(status_code=400, detail="Invalid metadata JSON format")
+    except HTTPException:
+        if upload is not None:
+            cleanup_temp_dir(upload.temp_dir)
+        raise
     except Exception as e:
+        if upload is not None:
+            cleanup_temp_dir(upload.temp_dir)
+        if task_id is not None:
+            task_manager.delete_task(task_id)
         raise HTTPException(status_code=500, detail=str(e))
     
+@app.post("/process/batch")
+async def process_document_batch(
+    files: List[UploadFile] = File(...),
+    metadata: str = Form(...),
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """
+    Process several documents that share the same metadata.
+    
+    Args:
+        files: The uploaded files to process
+        metadata: JSON string containing additional metadata, applied to every file
+        current_user: Current authenticated user
+    """
+    if len(files) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"A batch can hold at most {BATCH_MAX_FILES} files")
+    # Every document may end up as a job of its own when it's retried
+    await admit_or_reject("/process/batch", jobs=len(files))
+
+    uploads = []
+    batch_documents = []
+    try:
+        metadata_dict = json.loads(metadata)
+        document_type = metadata_dict.get("document_type", "unknown")
+        fields = metadata_dict.get("fields", {})
+
+        with track_stage("receive_upload"):
+            for file in files:
+                uploads.append(await spool_upload_to_disk(file))
+        for upload in uploads:
+            DOCUMENT_BYTES.observe(upload.file_size)
+
+        async def upload_to_storage(file: UploadFile, upload) -> str:
+            with track_stage("storage_upload"), open(upload.file_path, "rb") as handle:
+                return await run_supabase_call(
+                    upload_file_to_storage,
+                    user_id=current_user.id,
+                    file_content=handle,
+                    file_name=file.filename,
+                    bucket_name=DOCUMENT_BUCKET_NAME
+                )
+
+        # Uploads run concurrently, alongside a single insert for all the job rows
+        *file_paths, agentic_job_docs = await asyncio.gather(
+            *(upload_to_storage(file, upload) for file, upload in zip(files, uploads)),
+            run_supabase_call(
+                create_agentic_doc_jobs,
+                user_id=current_user.id,
+                fields=fields,
+                document_type=document_type,
+                count=len(files)
+            )
+        )
+
+        release_spooled_uploads(uploads)
+
+        documents_info = await run_supabase_call(save_documents_info, [
+            {
+                "user_id": current_user.id,
+                "file_name": file.filename,
+                "file_path": file_path,
+                "file_size": upload.file_size,
+                "file_type": file.content_type,
+                "status": "processing",
+                "document_type": document_type,
+                "processing_result": "",
+                "error_message": "",
+                "job_id": agentic_job_doc["job_id"],
+                "metadata": fields,
+                "content_hash": content_hash_of(upload)
+            }
+            for file, upload, file_path, agentic_job_doc in zip(files, uploads, file_paths, agentic_job_docs)
+        ])
+        documents_by_path = {document_info["file_path"]: document_info for document_info in documents_info}
+
+        for upload, file_path in zip(uploads, file_paths):
+            document_info = documents_by_path[file_path]
+            task_id = task_manager.create_task(document_id=document_info["id"])
+            task_manager.set_stage(task_id, TaskStage.UPLOADED)
+            batch_documents.append({
+                "task_id": task_id,
+                "document_id": document_info["id"],
+                "agentic_job_doc_id": document_info["job_id"],
+                "file_path": upload.file_path,
+                "file_url": file_path,
+                "content_hash": content_hash_of(upload)
+            })
+
+        batch_id = str(uuid.uuid4())
+        await enqueue_job("process_batch", {
+            "batch_id": batch_id,
+            "documents": batch_documents,
+            "metadata": metadata_dict,
+            "user_id": current_user.id
+        }, job_id=batch_id)
+        wake_workers()
+
+        return {
+            "message": "Batch processing started",
+            "batch_id": batch_id,
+            "documents": [
+                {"document_id": document["document_id"], "task_id": document["task_id"]}
+                for document in batch_documents
+            ],
+            "status": "processing"
+        }
+
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid metadata JSON format")
+    except HTTPException:
+        for upload in uploads:
+            cleanup_temp_dir(upload.temp_dir)
+        raise
+    except Exception as e:
+        for upload in uploads:
+            cleanup_temp_dir(upload.temp_dir)
+        for document in batch_documents:
+            task_manager.delete_task(document["task_id"])
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/batch/{batch_id}")
+async def get_batch_status(
+    batch_id: str,
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """
+    Get the aggregate progress of a batch from the status of its documents.
+    Requires authentication.
+    """
+    job = await get_job(batch_id)
+    if job is None or job.kind != "process_batch" or job.payload["user_id"] != current_user.id:
+        raise HTTPException(
+            status_code=404,
+            detail="Batch not found"
+        )
+
+    batch_documents = job.payload["documents"]
+    rows = await run_supabase_call(get_documents_status, [document["document_id"] for document in batch_documents])
+    rows_by_id = {row["id"]: row for row in rows}
+
+    counts = {"processing": 0, "completed": 0, "failed": 0}
+    documents = []
+    for document in batch_documents:
+        row = rows_by_id.get(document["document_id"], {})
+        status = row.get("status", "processing")
+        counts[status] = counts.get(status, 0) + 1
+        documents.append({
+            "document_id": document["document_id"],
+            "task_id": document["task_id"],
+            "status": status,
+            "error": row.get("error_message") or None
+        })
+
+    return {
+        "batch_id": batch_id,
+        "status": "completed" if counts["processing"] == 0 else "processing",
+        "total": len(batch_documents),
+        "counts": counts,
+        "documents": documents
+    }
+    
 @app.post("/reprocess")
 async def reprocess_document(
     data: Dict[str, Any] = Body(...),
-    background_tasks: BackgroundTasks = BackgroundTasks(),
     current_user: Dict[str, Any] = Depends(get_current_user)
 ):
     """
     Reprocess a document with new fields.
     
     Args:
-        data: JSON containing document_id and fields
-        background_tasks: FastAPI background tasks
+        data: JSON containing document_id, fields and an optional force flag
+            that skips the extraction cache
         current_user: Current authenticated user
     """
     try:
         document_id = data.get("document_id")
         fields = data.get("fields", {})
+        force_refresh = bool(data.get("force", False))
         
         if not document_id:
             raise HTTPException(status_code=400, detail="document_id is required")
+        await admit_or_reject("/reprocess")
             
-        background_tasks.add_task(reprocess_document_in_background, document_id, fields)
+        await enqueue_job("reprocess_document", {
+            "document_id": document_id,
+            "fields": fields,
+            "force_refresh": force_refresh
+        })
+        wake_workers()
         return {"message": "Document reprocessed", "document_id": document_id}
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
@@ -155,6 +434,31 @@ async def get_task_status(
     Requires authentication.
     """
     task = task_manager.get_task(task_id)
+    if not task or task.status == TaskStatus.PENDING:
+        # The job may be running in a worker outside this process
+        job = await get_job(task_id)
+        if job is not None:
+            job_status = JOB_TASK_STATUS[job.status]
+            if not task:
+                response = {
+                    "task_id": job.id,
+                    "status": job_status.value,
+                    "created_at": datetime.fromtimestamp(job.created_at).isoformat(),
+                    "updated_at": datetime.fromtimestamp(job.updated_at).isoformat()
+                }
+                if job_status == TaskStatus.COMPLETED:
+                    response["result"] = await run_supabase_call(get_document_result, job.payload["document_id"])
+                elif job_status == TaskStatus.FAILED:
+                    response["error"] = job.error
+                return response
+            if job_status != TaskStatus.PENDING:
+                task_manager.update_task(
+                    task_id,
+                    job_status,
+                    document_id=job.payload.get("document_id"),
+                    error=job.error if job_status == TaskStatus.FAILED else None
+                )
+
     if not task:
         raise HTTPException(
             status_code=404,
@@ -164,22 +468,106 @@ async def get_task_status(
     response = {
         "task_id": task.id,
         "status": task.status.value,
+        "stage": task.stage,
         "created_at": task.created_at.isoformat(),
         "updated_at": task.updated_at.isoformat()
     }
     
     if task.status == TaskStatus.COMPLETED:
-        response["result"] = task.result
+        response["result"] = await run_supabase_call(get_document_result, task.document_id)
     elif task.status == TaskStatus.FAILED:
         response["error"] = task.error
     
     return response
 
+@app.get("/task/{task_id}/events")
+async def stream_task_events(
+    task_id: str,
+    request: Request,
+    current_user: Dict[str, Any] = Depends(get_current_user_for_stream)
+):
+    """
+    Stream status and stage changes of a processing task as Server-Sent Events.
+    The stream ends after the completed or failed status event; the completed
+    event carries the result.
+    Requires authentication.
+    """
+    task = task_manager.get_task(task_id)
+    job = None if task else await get_job(task_id)
+    if not task and not job:
+        raise HTTPException(
+            status_code=404,
+            detail="Task not found"
+        )
+
+    async def task_status_event(status: TaskStatus, document_id: Optional[str], error: Optional[str]) -> Dict[str, Any]:
+        event = {"type": "status", "task_id": task_id, "status": status.value}
+        if status == TaskStatus.COMPLETED:
+            event["result"] = await run_supabase_call(get_document_result, document_id)
+        elif status == TaskStatus.FAILED:
+            event["error"] = error
+        return event
+
+    async def current_status_event() -> Optional[Dict[str, Any]]:
+        current_task = task_manager.get_task(task_id)
+        if current_task and current_task.status != TaskStatus.PENDING:
+            return await task_status_event(current_task.status, current_task.document_id, current_task.error)
+        # Jobs run by workers outside this process only show up in the queue
+        current_job = await get_job(task_id)
+        if current_job is None:
+            return None
+        return await task_status_event(JOB_TASK_STATUS[current_job.status], current_job.payload.get("document_id"), current_job.error)
+
+    async def event_stream():
+        subscription = event_broker.subscribe(task_id)
+        try:
+            last_status = None
+            current_task = task_manager.get_task(task_id)
+            if current_task and current_task.stage:
+                yield format_sse({"type": "stage", "task_id": task_id, "stage": current_task.stage})
+
+            while True:
+                event = await current_status_event() if last_status is None else None
+                if event is None:
+                    try:
+                        event = await asyncio.wait_for(subscription.queue.get(), timeout=SSE_KEEPALIVE_INTERVAL)
+                    except asyncio.TimeoutError:
+                        if await request.is_disconnected():
+                            break
+                        event = await current_status_event()
+                        if event is None or event["status"] == last_status:
+                            yield ": keep-alive\n\n"
+                            continue
+
+                if event["type"] == "status":
+                    if event["status"] == last_status:
+                        continue
+                    last_status = event["status"]
+                    if last_status == TaskStatus.COMPLETED.value and "result" not in event:
+                        event = await current_status_event()
+
+                yield format_sse(event)
+                if last_status in (TaskStatus.COMPLETED.value, TaskStatus.FAILED.value):
+                    break
+        finally:
+            event_broker.unsubscribe(subscription)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {"status": "healthy"} 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Pipeline metrics of this process in the Prometheus text format"""
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
 @app.get("/user-test")
 async def user_test(
         current_user: Dict[str, Any] = Depends(get_current_user)
@@ -1,8 +1,239 @@
-from fastapi import HTTPException, Depends, Header
-from typing import Optional
-from webapp.db import get_supabase_client
+"""
+Authentication of API requests with Supabase access tokens.
+
+Tokens are verified locally: HS256 tokens with SUPABASE_JWT_SECRET, asymmetric
+ones with the project's JWKS. Verified tokens are cached until they expire or
+AUTH_TOKEN_CACHE_TTL passes, whichever comes first. Asking Supabase to verify
+a token is only done when AUTH_REMOTE_FALLBACK is enabled, for tokens that
+can't be verified locally. Without it, the app refuses to start when no key is
+configured at all.
+
+Key IDs missing from the cached JWKS cause a fetch at most once every
+JWKS_REFETCH_INTERVAL seconds, and fetches never hold up requests whose key
+is already cached, so tokens with made-up key IDs can't stall authentication.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple
+
+import anyio
+import requests
+from fastapi import HTTPException, Depends, Header, Query
+from jose import JWTError, jwt
+
+from webapp.db import get_supabase_client, run_supabase_call
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET", "")
+SUPABASE_JWKS_URL = os.getenv(
+    "SUPABASE_JWKS_URL",
+    f"{os.getenv('SUPABASE_URL', '').rstrip('/')}/auth/v1/.well-known/jwks.json" if os.getenv("SUPABASE_URL") else ""
+)
+SUPABASE_JWT_AUDIENCE = os.getenv("SUPABASE_JWT_AUDIENCE", "authenticated")
+JWKS_CACHE_TTL = float(os.getenv("JWKS_CACHE_TTL", "600"))
+JWKS_REFETCH_INTERVAL = float(os.getenv("JWKS_REFETCH_INTERVAL", "30"))
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+AUTH_TOKEN_CACHE_TTL = float(os.getenv("AUTH_TOKEN_CACHE_TTL", "300"))
+AUTH_REMOTE_FALLBACK = os.getenv("AUTH_REMOTE_FALLBACK", "false").lower() == "true"
+
+ASYMMETRIC_ALGORITHMS = ("RS256", "ES256")
+
+class TokenVerificationUnavailable(Exception):
+    """Raised when no key to verify a token with is configured or reachable."""
+
+
+@dataclass(frozen=True)
+class AuthenticatedUser:
+    id: str
+    email: Optional[str] = None
+    role: Optional[str] = None
+    claims: Dict[str, Any] = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def from_claims(cls, claims: Dict[str, Any]) -> "AuthenticatedUser":
+        return cls(id=claims["sub"], email=claims.get("email"), role=claims.get("role"), claims=claims)
+
+
+class TokenCache:
+    """Bounded cache of verified tokens, keyed by their hash, each kept until its own expiry."""
+
+    def __init__(self, max_entries: int = AUTH_TOKEN_CACHE_SIZE, ttl: float = AUTH_TOKEN_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[bytes, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[Any]:
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return user
+
+    def set(self, token: str, user: Any, token_expires_at: Optional[float] = None):
+        expires_at = time.time() + self.ttl
+        if token_expires_at is not None:
+            expires_at = min(expires_at, token_expires_at)
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (user, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class JWKSCache:
+    """
+    Signing keys of the Supabase project, fetched again after JWKS_CACHE_TTL or
+    for an unknown key ID, but at most once every JWKS_REFETCH_INTERVAL.
+    """
+
+    def __init__(self, url: str = SUPABASE_JWKS_URL, ttl: float = JWKS_CACHE_TTL, refetch_interval: float = JWKS_REFETCH_INTERVAL):
+        self.url = url
+        self.ttl = ttl
+        self.refetch_interval = refetch_interval
+        self._keys: Dict[str, Dict[str, Any]] = {}
+        self._fetched_at = float("-inf")
+        self._attempted_at = float("-inf")
+        self._fetching = False
+        self._lock = threading.Lock()
+
+    def _download(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            response = requests.get(self.url, timeout=10)
+            response.raise_for_status()
+            keys = response.json().get("keys", [])
+        except (requests.RequestException, ValueError) as e:
+            raise TokenVerificationUnavailable(f"Could not fetch JWKS: {str(e)}") from e
+        return {key["kid"]: key for key in keys if "kid" in key}
+
+    def get_key(self, kid: Optional[str]) -> Dict[str, Any]:
+        if not self.url:
+            raise TokenVerificationUnavailable("No JWKS URL configured")
+        now = time.monotonic()
+        with self._lock:
+            key = self._keys.get(kid)
+            stale = now - self._fetched_at > self.ttl
+            # One thread fetches; the others keep using the keys they have
+            fetch = (stale or key is None) and not self._fetching and now - self._attempted_at >= self.refetch_interval
+            if fetch:
+                self._fetching = True
+                self._attempted_at = now
+
+        if fetch:
+            # The lock isn't held here, so a slow JWKS endpoint only delays this request
+            try:
+                keys = self._download()
+            except TokenVerificationUnavailable:
+                if key is None:
+                    raise
+                logger.warning("Could not refresh JWKS, using the cached keys")
+            else:
+                with self._lock:
+                    self._keys = keys
+                    self._fetched_at = time.monotonic()
+                key = keys.get(kid)
+            finally:
+                with self._lock:
+                    self._fetching = False
+
+        if key is None:
+            raise TokenVerificationUnavailable(f"No signing key with ID {kid}")
+        return key
+
+
+token_cache = TokenCache()
+jwks_cache = JWKSCache()
+
+
+def check_configuration():
+    """
+    Check at startup that tokens can be verified at all.
+
+    Raises:
+        RuntimeError: If no key is configured and AUTH_REMOTE_FALLBACK is off
+    """
+    if AUTH_REMOTE_FALLBACK:
+        if not SUPABASE_JWT_SECRET:
+            logger.warning("SUPABASE_JWT_SECRET is not set, HS256 tokens will be verified by Supabase")
+        return
+    if not SUPABASE_JWT_SECRET and not SUPABASE_JWKS_URL:
+        raise RuntimeError(
+            "No key to verify access tokens with: set SUPABASE_JWT_SECRET or SUPABASE_JWKS_URL, "
+            "or AUTH_REMOTE_FALLBACK=true to have Supabase verify them"
+        )
+    if not SUPABASE_JWT_SECRET:
+        logger.error("SUPABASE_JWT_SECRET is not set and AUTH_REMOTE_FALLBACK is off, HS256 tokens will be rejected")
+
+
+def verify_token(token: str) -> AuthenticatedUser:
+    """
+    Verify the signature, expiry and audience of a Supabase access token.
+
+    Args:
+        token: The access token
+
+    Returns:
+        The user the token was issued to
+
+    Raises:
+        JWTError: If the token is invalid or expired
+        TokenVerificationUnavailable: If there is no key to verify it with
+    """
+    header = jwt.get_unverified_header(token)
+    algorithm = header.get("alg")
+    if algorithm == "HS256":
+        if not SUPABASE_JWT_SECRET:
+            raise TokenVerificationUnavailable("SUPABASE_JWT_SECRET is not set")
+        key: Any = SUPABASE_JWT_SECRET
+    elif algorithm in ASYMMETRIC_ALGORITHMS:
+        key = jwks_cache.get_key(header.get("kid"))
+    else:
+        raise JWTError(f"Unsupported token algorithm: {algorithm}")
+
+    claims = jwt.decode(token, key, algorithms=[algorithm], audience=SUPABASE_JWT_AUDIENCE)
+    if not claims.get("sub"):
+        raise JWTError("Token has no subject")
+    return AuthenticatedUser.from_claims(claims)
+
+
+def _unauthorized() -> HTTPException:
+    return HTTPException(
+        status_code=401,
+        detail="Invalid authentication credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
+async def verify_token_remotely(token: str) -> Any:
+    """Ask Supabase to verify a token, for tokens there is no local key for."""
+    supabase = get_supabase_client()
+    user = await run_supabase_call(supabase.auth.get_user, token)
+    if not user:
+        raise _unauthorized()
+    return user.user
 
-# Initialize Supabase client
 
 async def get_current_user(authorization: Optional[str] = Header(None)):
     if not authorization:
@@ -11,29 +242,44 @@ async def get_current_user(authorization: Optional[str] = Header(None)):
             detail="Authorization header missing",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    
+
+    # Remove 'Bearer ' prefix if present
+    token = authorization.replace("Bearer ", "")
+
+    user = token_cache.get(token)
+    if user is not None:
+        return user
+
     try:
-        # Remove 'Bearer ' prefix if present
-        token = authorization.replace("Bearer ", "")
-        
-        # Get Supabase client
-        supabase = get_supabase_client()
-        
-        # Verify the JWT token
-        user = supabase.auth.get_user(token)
-        
-        if not user:
-            raise HTTPException(
-                status_code=401,
-                detail="Invalid authentication credentials",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-            
-        return user.user
-        
-    except Exception as e:
-        raise HTTPException(
-            status_code=401,
-            detail="Invalid authentication credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        ) 
\ No newline at end of file
+        # Only the first request with a token pays for verification; JWKS fetches block, so run it in a thread
+        user = await anyio.to_thread.run_sync(verify_token, token)
+        token_cache.set(token, user, user.claims.get("exp"))
+        return user
+    except JWTError:
+        raise _unauthorized()
+    except TokenVerificationUnavailable as e:
+        if not AUTH_REMOTE_FALLBACK:
+            logger.error(f"Can't verify token locally and AUTH_REMOTE_FALLBACK is off: {str(e)}")
+            raise _unauthorized()
+        logger.debug(f"Verifying token with Supabase: {str(e)}")
+
+    try:
+        user = await verify_token_remotely(token)
+    except HTTPException:
+        raise
+    except Exception:
+        raise _unauthorized()
+    token_cache.set(token, user, jwt.get_unverified_claims(token).get("exp"))
+    return user
+
+async def get_current_user_for_stream(
+    authorization: Optional[str] = Header(None),
+    access_token: Optional[str] = Query(None)
+):
+    """
+    Authenticate a streaming request. Browsers' EventSource can't set headers,
+    so the token may also be passed as the access_token query parameter.
+    """
+    if not authorization and access_token:
+        authorization = f"Bearer {access_token}"
+    return await get_current_user(authorization)
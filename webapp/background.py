@@ -1,18 +1,31 @@
 import json
-from typing import Any, Dict
-from agentic_doc.parse import parse_documents
-from webapp.documents import get_document_data_by_document_id, update_agentic_doc_job,  update_document_by_job_id, update_agentic_doc_job_fields, update_document_data   
+from typing import Any, Callable, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from webapp.landingai import parse_documents
+from webapp.chunks import CHUNK_STORAGE_ENABLED, ParsedContent, encode_chunks, load_chunks
+from webapp.dedup import DEDUP_ENABLED, content_index
+from webapp.documents import get_documents_status, update_agentic_doc_job,  update_document_by_job_id, update_document_data   
+from webapp.jobqueue import JOB_MAX_ATTEMPTS, get_job_queue
 from webapp.llm import extract_data_from_document
-from webapp.mistral import get_mistral_ocr_response
-from webapp.tasks import task_manager, TaskStatus
+from webapp.metrics import DOCUMENT_PAGES, track_stage
+from webapp.repository import document_repository
+from webapp.retrieval import LOCAL_RETRIEVAL_ENABLED
+from webapp.router import AgenticDocEngine, DocumentInfo, NoEngineSucceeded, engine_router
+from webapp.tasks import task_manager, TaskStage, TaskStatus
+from webapp import tracing
+from webapp.upload import download_file_to_temp_dir, remove_temp_file
 import logging
 import os
-from PyPDF2 import PdfReader
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def reprocess_document_in_background(document_id: str, fields: Dict[str, Any]):
+# Batches are sent to agentic-doc in groups of BATCH_PARSE_SIZE files, and at
+# most BATCH_CONCURRENCY documents of a batch are extracted at once
+BATCH_PARSE_SIZE = int(os.getenv("BATCH_PARSE_SIZE", "10"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+def reprocess_document_in_background(document_id: str, fields: Dict[str, Any], force_refresh: bool = False):
     """Process the document in the background and update the task status."""
     try:
         update_document_data(
@@ -22,128 +35,282 @@ def reprocess_document_in_background(document_id: str, fields: Dict[str, Any]):
                 "has_checked": False
             }
         )
-        print(f"Document {document_id} updated to processing")
-        document_data = get_document_data_by_document_id(document_id)
-        print(f"Document {document_id} data: {document_data}")
-
-        extracted_data = extract_data_from_document({
-            "markdown": document_data["markdown"],
-            "document_type": document_data["document_type"],
-            "fields": fields,
-            "document_id": document_id,
-            "file_ids": document_data["file_ids"],
-            "vector_store_ids": document_data["vector_store_ids"]
-        })
-
-        print(f"Extracted data: {extracted_data}")
-
-        update_agentic_doc_job_fields(
-            job_id=document_data["job_id"],
-            fields=fields
-        )
+        logger.info(f"Reprocessing document {document_id}")
+        # The document and its job come back in one request
+        with track_stage("load_document"):
+            document = document_repository.get(document_id, include_chunks=LOCAL_RETRIEVAL_ENABLED)
+        logger.debug(f"Document {document_id} loaded: job {document.job_id}, {len(document.markdown or '')} characters of markdown")
 
-        print(f"Updated agentic doc job fields: {fields}")
+        with track_stage("extraction"):
+            extracted_data = extract_data_from_document({
+                "markdown": document.markdown,
+                "document_type": document.document_type,
+                "fields": fields,
+                "document_id": document_id,
+                "file_ids": document.file_ids,
+                "vector_store_ids": document.vector_store_ids,
+                # Searched locally when the markdown is too large to send whole
+                "chunks": load_chunks(document.chunks, document.markdown) if LOCAL_RETRIEVAL_ENABLED else None,
+                "force_refresh": force_refresh
+            })
 
-        update_document_by_job_id(
-            job_id=document_data["job_id"],
-            status="completed",
-            processing_result=extracted_data,
-            metadata= fields
-        )
+        logger.debug(f"Extracted {len(extracted_data)} fields from document {document_id}")
 
-        print(f"Updated document by job id: {document_data['job_id']}")
+        # The new fields and the result are written together
+        with track_stage("save_result"), document_repository.transition() as writes:
+            writes.update_job(document.job_id, fields=fields)
+            writes.update_document_by_job_id(
+                document.job_id,
+                status="completed",
+                processing_result=extracted_data,
+                error_message="",
+                metadata=fields
+            )
 
-        # update document value to processing
+        logger.info(f"Document {document_id} reprocessed, job {document.job_id} updated")
     except Exception as e:
         logger.error(f"Error processing document: {str(e)}")
-        return None
+        raise
+
+def fail_document_reprocessing(error: str, document_id: str, **_: Any):
+    """Mark a reprocessed document as failed once its job has no retries left."""
+    update_document_data(
+        document_id=document_id,
+        data={
+            "status": "failed",
+            "error_message": error
+        }
+    )
+
+def parse_document(file_path: str, file_url: str, report_stage: Optional[Callable[[str], None]] = None, parsed_doc: Any = None) -> ParsedContent:
+    """
+    Parse a local document into markdown, and chunks when the engine has them,
+    with the engine the router picks.
+    
+    Args:
+        file_path: Local path of the document
+        file_url: Public URL of the stored document, used by Mistral OCR
+        report_stage: Called with each pipeline stage the document enters (optional)
+        parsed_doc: agentic-doc result already parsed as part of a batch (optional)
+        
+    Returns:
+        The markdown and chunks of the document
+    """
+    with track_stage("inspect"):
+        document = DocumentInfo.from_file(file_path, file_url)
+    if document.page_count is not None:
+        DOCUMENT_PAGES.observe(document.page_count)
+    try:
+        with track_stage("parse"):
+            content, engine = engine_router.parse(document, report_stage, parsed_doc)
+    except NoEngineSucceeded as e:
+        raise Exception(f"Document processing failed : {str(e)}")
+
+    logger.info(f"✅ Successfully parsed document using {engine}")
+    return content
 
-def process_document_in_background(task_id: str, file_path: str, agentic_job_doc_id: str,metadata: Dict[str, Any],file_url: str, document_id: str):
+def process_document_in_background(task_id: str, file_path: str, agentic_job_doc_id: str,metadata: Dict[str, Any],file_url: str, document_id: str, user_id: Optional[str] = None, content_hash: Optional[str] = None, parsed_doc: Any = None):
     """Process the document in the background and update the task status."""
     try:
         # Update task status to processing
         task_manager.update_task(task_id, TaskStatus.PROCESSING)
+
+        # A worker on another machine, or a retry after cleanup, won't have the upload locally
+        if not os.path.exists(file_path):
+            with track_stage("download"):
+                file_path = download_file_to_temp_dir(file_url)
+
         # Process the document
         logger.info(f"Processing document: {file_path}")
-        
-        # Check if file is PDF and get page count
-        use_mistral = False
-        if file_path.lower().endswith('.pdf'):
-            try:
-                pdf = PdfReader(file_path)
-                if len(pdf.pages) > 5:
-                    use_mistral = True
-                    logger.info(f"PDF has {len(pdf.pages)} pages, using Mistral OCR")
-            except Exception as e:
-                logger.warning(f"Error reading PDF: {str(e)}, falling back to default processing")
-
-        if use_mistral:
-            print("Using mistral ocr because pdf has more than 5 pages")
-            markdown = get_mistral_ocr_response(file_url)
-            logger.info(f"✅ Successfully parsed document using mistral \n\n{markdown}")
-        else:
-            results = parse_documents([str(file_path)])
-            markdown = ""
-
-            chunks = results[0].chunks
-            error_chunks = []
-            for chunk in chunks:
-                if chunk.chunk_type=="error":
-                    error_chunks.append(chunk)
-
-            if not results or len(results) == 0 or len(error_chunks) > 0:
-                try:
-                    logger.info("Attempting to parse document using mistral ocr")
-                    markdown = get_mistral_ocr_response(file_url)
-                    logger.info(f"✅ Successfully parsed document using mistral \n\n{markdown}")
-                except Exception as e:
-                    raise Exception("Document processing failed : No results returned")
-            else:
-                parsed_doc = results[0]
-                markdown = parsed_doc.markdown
 
-        update_agentic_doc_job(
-            job_id=agentic_job_doc_id,
-            result=markdown,
-            error=""
-        )
+        def report_stage(stage: str):
+            task_manager.set_stage(task_id, stage)
 
-        logger.info(f"✅ Successfully parsed document to get markdown \n\n{markdown}")
+        def parse_and_save() -> str:
+            content = parse_document(file_path, file_url, report_stage, parsed_doc)
+            with track_stage("save_markdown"):
+                update_agentic_doc_job(
+                    job_id=agentic_job_doc_id,
+                    result=content.markdown,
+                    error="",
+                    chunks=encode_chunks(content.chunks) if CHUNK_STORAGE_ENABLED and content.chunks is not None else None
+                )
+            return content.markdown
 
-        extracted_data = extract_data_from_document({
-            "markdown": markdown,
-            "document_type": metadata["document_type"],
-            "fields": metadata["fields"],
-            "document_id": document_id
-        })
+        file_ids = None
+        vector_store_ids = None
+        if DEDUP_ENABLED and content_hash:
+            dedup = content_index.resolve(content_hash, user_id, document_id, parse_and_save)
+            markdown = dedup.markdown
+            if dedup.hit:
+                file_ids = dedup.file_ids
+                vector_store_ids = dedup.vector_store_ids
+                # Resources shared with the earlier upload are recorded on this document too
+                with document_repository.transition() as writes:
+                    if CHUNK_STORAGE_ENABLED and dedup.chunks is not None:
+                        writes.update_job(agentic_job_doc_id, chunks=dedup.chunks)
+                    writes.update_job(agentic_job_doc_id, result=markdown, error="")
+                    writes.update_document(document_id, file_ids=file_ids, vector_store_ids=vector_store_ids)
+        else:
+            markdown = parse_and_save()
 
-        update_document_by_job_id(
-            job_id=agentic_job_doc_id,
-            status="completed",
-            processing_result=extracted_data,
-        )
+        logger.info(f"✅ Successfully parsed document {document_id} to {len(markdown)} characters of markdown")
+        logger.debug(f"Markdown of document {document_id}:\n\n{markdown}")
+
+        with track_stage("extraction"):
+            extracted_data = extract_data_from_document({
+                "markdown": markdown,
+                "document_type": metadata["document_type"],
+                "fields": metadata["fields"],
+                "document_id": document_id,
+                "file_ids": file_ids,
+                "vector_store_ids": vector_store_ids,
+                "report_stage": report_stage
+            })
 
-        # Update task with result
+        with track_stage("save_result"):
+            update_document_by_job_id(
+                job_id=agentic_job_doc_id,
+                status="completed",
+                processing_result=extracted_data,
+            )
+
+        # The result stays on the documents row; the task only references it
+        report_stage(TaskStage.DONE)
         task_manager.update_task(
             task_id,
             TaskStatus.COMPLETED,
-            result={"markdown": markdown, "data": extracted_data}
+            document_id=document_id
         )
         
     except Exception as e:
         logger.error(f"Error processing document: {str(e)}")
-        task_manager.update_task(
-            task_id,
-            TaskStatus.FAILED,
-            error=str(e)
-        )
-        update_document_by_job_id(
-            job_id=agentic_job_doc_id,
-            status="failed",
-            error_message=str(e)
-        )
+        raise
     finally:
+        remove_temp_file(file_path)
+
+def fail_document_processing(error: str, task_id: str, agentic_job_doc_id: str, **_: Any):
+    """Mark a task and its document as failed once the job has no retries left."""
+    task_manager.update_task(
+        task_id,
+        TaskStatus.FAILED,
+        error=error
+    )
+    update_document_by_job_id(
+        job_id=agentic_job_doc_id,
+        status="failed",
+        error_message=error
+    )
+
+def retry_batch_document(error: str, document: Dict[str, Any], metadata: Dict[str, Any], user_id: str):
+    """
+    Give a document that failed in a batch the retries a single upload gets,
+    as a process_document job of its own. The batch run was its first attempt.
+    """
+    attempts_left = JOB_MAX_ATTEMPTS - 1
+    if attempts_left <= 0:
+        fail_document_processing(error, document["task_id"], document["agentic_job_doc_id"])
+        return
+    payload = {
+        "task_id": document["task_id"],
+        "file_path": document["file_path"],
+        "agentic_job_doc_id": document["agentic_job_doc_id"],
+        "metadata": metadata,
+        "file_url": document["file_url"],
+        "document_id": document["document_id"],
+        "user_id": user_id,
+        "content_hash": document["content_hash"]
+    }
+    try:
+        get_job_queue().enqueue("process_document", tracing.inject_payload(payload), job_id=document["task_id"], max_attempts=attempts_left)
+    except Exception as e:
+        logger.error(f"Could not queue a retry of document {document['document_id']}: {str(e)}")
+        fail_document_processing(error, document["task_id"], document["agentic_job_doc_id"])
+        return
+    logger.warning(f"Document {document['document_id']} failed in its batch, retrying on its own: {error}")
+    task_manager.update_task(document["task_id"], TaskStatus.PENDING)
+
+def unfinished_batch_documents(documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Documents of a batch still left to the batch job, skipping ones a previous
+    run already finished or handed off to their own job.
+    """
+    finished = {
+        row["id"]
+        for row in get_documents_status([document["document_id"] for document in documents])
+        if row["status"] in ("completed", "failed")
+    }
+    job_queue = get_job_queue()
+    return [
+        document for document in documents
+        if document["document_id"] not in finished and job_queue.get(document["task_id"]) is None
+    ]
+
+
+def process_document_batch_in_background(batch_id: str, documents: List[Dict[str, Any]], metadata: Dict[str, Any], user_id: str):
+    """
+    Process a batch of uploaded documents. Documents bound for agentic-doc are
+    parsed together, then every document is finished in parallel. A failed
+    document doesn't stop the others: it is retried as a job of its own, or
+    marked failed right away when no engine accepts it.
+    """
+    documents = unfinished_batch_documents(documents)
+    logger.info(f"Processing batch {batch_id}: {len(documents)} documents left")
+
+    pending = []
+    to_parse = []
+    for document in documents:
+        task_manager.update_task(document["task_id"], TaskStatus.PROCESSING)
         try:
-            os.unlink(file_path)
+            if not os.path.exists(document["file_path"]):
+                document["file_path"] = download_file_to_temp_dir(document["file_url"])
+            if DEDUP_ENABLED and content_index.contains(document["content_hash"], user_id):
+                engines = None
+            else:
+                engines = engine_router.route(DocumentInfo.from_file(document["file_path"], document["file_url"]))
         except Exception as e:
-            logger.error(f"Error cleaning up temporary file: {str(e)}")
\ No newline at end of file
+            retry_batch_document(str(e), document, metadata, user_id)
+            continue
+        if engines == []:
+            # Retrying won't change the document's features
+            fail_document_processing("Document processing failed : No engine accepts this document", document["task_id"], document["agentic_job_doc_id"])
+            remove_temp_file(document["file_path"])
+            continue
+        pending.append(document)
+        if engines and engines[0].name == AgenticDocEngine.name:
+            to_parse.append(document)
+    parsed_docs: Dict[str, Any] = {}
+    for start in range(0, len(to_parse), BATCH_PARSE_SIZE):
+        group = to_parse[start:start + BATCH_PARSE_SIZE]
+        for document in group:
+            task_manager.set_stage(document["task_id"], TaskStage.PARSING)
+        try:
+            results = parse_documents([document["file_path"] for document in group])
+            for document, parsed_doc in zip(group, results):
+                parsed_docs[document["document_id"]] = parsed_doc
+        except Exception as e:
+            logger.warning(f"Batch parse failed, parsing these documents one by one: {str(e)}")
+
+    def finish_document(document: Dict[str, Any]):
+        try:
+            process_document_in_background(
+                task_id=document["task_id"],
+                file_path=document["file_path"],
+                agentic_job_doc_id=document["agentic_job_doc_id"],
+                metadata=metadata,
+                file_url=document["file_url"],
+                document_id=document["document_id"],
+                user_id=user_id,
+                content_hash=document["content_hash"],
+                parsed_doc=parsed_docs.get(document["document_id"])
+            )
+        except Exception as e:
+            retry_batch_document(str(e), document, metadata, user_id)
+
+    with ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY) as executor:
+        list(executor.map(tracing.bind_context(finish_document), pending))
+
+def fail_document_batch(error: str, documents: List[Dict[str, Any]], **_: Any):
+    """Mark the documents still left to a batch as failed once the batch job has no retries left."""
+    for document in unfinished_batch_documents(documents):
+        fail_document_processing(error, document["task_id"], document["agentic_job_doc_id"])
@@ -0,0 +1,169 @@
+"""
+Two-tier cache of extraction results: a bounded in-process LRU in front of a
+SQLite file on local disk.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from webapp.metrics import Counter
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+EXTRACTION_CACHE_ENABLED = os.getenv("EXTRACTION_CACHE_ENABLED", "true").lower() == "true"
+EXTRACTION_CACHE_SIZE = int(os.getenv("EXTRACTION_CACHE_SIZE", "256"))
+EXTRACTION_CACHE_TTL = float(os.getenv("EXTRACTION_CACHE_TTL", str(7 * 24 * 3600)))
+EXTRACTION_CACHE_PATH = os.getenv(
+    "EXTRACTION_CACHE_PATH",
+    os.path.join(tempfile.gettempdir(), "agenticdoc-extraction-cache.sqlite3")
+)
+
+EXTRACTION_CACHE_LOOKUPS = Counter(
+    "agenticdoc_extraction_cache_lookups_total",
+    "Extraction cache lookups, by the tier that answered",
+    ["result"]
+)
+
+
+def normalize_markdown(markdown: str) -> str:
+    """Drop trailing whitespace and line ending differences that don't change the content."""
+    return "\n".join(line.rstrip() for line in markdown.strip().splitlines())
+
+
+def extraction_cache_key(markdown: str, document_type: str, fields: List[Dict[str, Any]], model: str) -> str:
+    """
+    Build the cache key for one extraction.
+
+    Args:
+        markdown: Markdown of the document
+        document_type: Type of the document
+        fields: Fields to extract; their order does not matter
+        model: Model used for the extraction
+
+    Returns:
+        Hex digest identifying the extraction
+    """
+    field_definitions = sorted(
+        (field["id"], field.get("name", ""), field.get("description", ""))
+        for field in fields
+    )
+    digest = hashlib.sha256()
+    digest.update(hashlib.sha256(normalize_markdown(markdown).encode("utf-8")).digest())
+    digest.update(json.dumps([document_type, model, field_definitions]).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    def __init__(self, path: str = EXTRACTION_CACHE_PATH, max_entries: int = EXTRACTION_CACHE_SIZE, ttl: float = EXTRACTION_CACHE_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._memory: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=10)
+        if not self._initialized:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS extraction_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS extraction_cache_expires_at ON extraction_cache (expires_at)")
+            connection.commit()
+            self._initialized = True
+        return connection
+
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        connection = self._connect()
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def _remember(self, key: str, value: Dict[str, Any], expires_at: float):
+        with self._lock:
+            self._memory[key] = (value, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached result for key, or None when missing or expired."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._memory.move_to_end(key)
+                    EXTRACTION_CACHE_LOOKUPS.inc(result="memory")
+                    return dict(entry[0])
+                del self._memory[key]
+
+        try:
+            with self._connection() as connection:
+                row = connection.execute(
+                    "SELECT value, expires_at FROM extraction_cache WHERE key = ? AND expires_at > ?",
+                    (key, now)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Extraction cache read failed: {str(e)}")
+            row = None
+
+        if row is None:
+            EXTRACTION_CACHE_LOOKUPS.inc(result="miss")
+            return None
+
+        value = json.loads(row[0])
+        self._remember(key, value, row[1])
+        EXTRACTION_CACHE_LOOKUPS.inc(result="disk")
+        return dict(value)
+
+    def set(self, key: str, value: Dict[str, Any]):
+        """Store a result in both tiers and purge expired rows."""
+        now = time.time()
+        expires_at = now + self.ttl
+        self._remember(key, dict(value), expires_at)
+        try:
+            with self._connection() as connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO extraction_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), expires_at)
+                )
+                connection.execute("DELETE FROM extraction_cache WHERE expires_at <= ?", (now,))
+        except sqlite3.Error as e:
+            logger.warning(f"Extraction cache write failed: {str(e)}")
+
+    def invalidate(self, key: str):
+        """Remove one result from both tiers."""
+        with self._lock:
+            self._memory.pop(key, None)
+        try:
+            with self._connection() as connection:
+                connection.execute("DELETE FROM extraction_cache WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            logger.warning(f"Extraction cache invalidation failed: {str(e)}")
+
+    def clear(self):
+        """Remove every result from both tiers."""
+        with self._lock:
+            self._memory.clear()
+        try:
+            with self._connection() as connection:
+                connection.execute("DELETE FROM extraction_cache")
+        except sqlite3.Error as e:
+            logger.warning(f"Extraction cache clear failed: {str(e)}")
+
+
+extraction_cache = ExtractionCache()
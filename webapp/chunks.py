@@ -0,0 +1,126 @@
+"""
+Parsed chunks of a document, as stored with its agentic-doc job.
+
+agentic-doc returns the markdown of a document along with its chunks: each
+block of text, table or figure with the page and box it was found at. The
+chunks are kept in agentic_doc_jobs.chunks, without the IDs and image paths,
+so reprocessing can search them locally (see webapp/retrieval.py) instead of
+going back to an OpenAI vector store. Documents parsed by an engine that
+doesn't return chunks, or before chunks were stored, are split into chunks
+from their markdown when needed.
+
+Storing chunks needs a `chunks jsonb` column on agentic_doc_jobs, so it is
+off until CHUNK_STORAGE_ENABLED=true is set on a database that has it.
+"""
+import os
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+CHUNK_STORAGE_ENABLED = os.getenv("CHUNK_STORAGE_ENABLED", "false").lower() == "true"
+# Markdown is split into chunks of about this many characters, at blank lines
+MARKDOWN_CHUNK_CHARS = int(os.getenv("MARKDOWN_CHUNK_CHARS", "1500"))
+
+# Decimal places kept of box coordinates, which are fractions of the page size
+BBOX_PRECISION = 4
+
+
+@dataclass
+class DocumentChunk:
+    text: str
+    # text, table, figure or marginalia for agentic-doc chunks
+    type: str = "text"
+    # Zero-based, None when unknown
+    page: Optional[int] = None
+    # [left, top, right, bottom] as fractions of the page size
+    bbox: Optional[List[float]] = None
+
+    def to_row(self) -> Dict[str, Any]:
+        row: Dict[str, Any] = {"text": self.text, "type": self.type}
+        if self.page is not None:
+            row["page"] = self.page
+        if self.bbox is not None:
+            row["bbox"] = self.bbox
+        return row
+
+    @classmethod
+    def from_row(cls, row: Dict[str, Any]) -> "DocumentChunk":
+        return cls(text=row.get("text") or "", type=row.get("type") or "text", page=row.get("page"), bbox=row.get("bbox"))
+
+
+@dataclass
+class ParsedContent:
+    """What a parsing engine produced for a document."""
+    markdown: str
+    # None when the engine only returns markdown
+    chunks: Optional[List[DocumentChunk]] = None
+
+
+def chunks_from_agentic_doc(parsed_doc: Any, page_offset: int = 0) -> List[DocumentChunk]:
+    """
+    Convert the chunks of an agentic-doc result, skipping empty ones.
+
+    Args:
+        parsed_doc: agentic-doc ParsedDocument
+        page_offset: Added to every page number, for documents parsed in shards
+
+    Returns:
+        The chunks in document order
+    """
+    chunks = []
+    for chunk in parsed_doc.chunks:
+        text = (chunk.text or "").strip()
+        if not text:
+            continue
+        chunk_type = getattr(chunk.chunk_type, "value", chunk.chunk_type)
+        grounding = getattr(chunk, "grounding", None) or []
+        page, bbox = None, None
+        if grounding:
+            # A chunk spanning pages is located by where it starts
+            page = grounding[0].page + page_offset
+            box = grounding[0].box
+            bbox = [round(value, BBOX_PRECISION) for value in (box.l, box.t, box.r, box.b)]
+        chunks.append(DocumentChunk(text=text, type=str(chunk_type), page=page, bbox=bbox))
+    return chunks
+
+
+def chunks_from_markdown(markdown: str, max_chars: int = MARKDOWN_CHUNK_CHARS) -> List[DocumentChunk]:
+    """Split markdown at blank lines into chunks of up to about max_chars characters."""
+    chunks = []
+    current: List[str] = []
+    size = 0
+    for block in re.split(r"\n\s*\n", markdown or ""):
+        block = block.strip()
+        if not block:
+            continue
+        if current and size + len(block) > max_chars:
+            chunks.append(DocumentChunk(text="\n\n".join(current)))
+            current, size = [], 0
+        current.append(block)
+        size += len(block) + 2
+    if current:
+        chunks.append(DocumentChunk(text="\n\n".join(current)))
+    return chunks
+
+
+def encode_chunks(chunks: List[DocumentChunk]) -> List[Dict[str, Any]]:
+    """Rows of the agentic_doc_jobs.chunks column."""
+    return [chunk.to_row() for chunk in chunks]
+
+
+def load_chunks(rows: Optional[List[Dict[str, Any]]], markdown: Optional[str]) -> List[DocumentChunk]:
+    """
+    The chunks of a document: the stored ones, or else chunks split from its markdown.
+
+    Args:
+        rows: Value of the agentic_doc_jobs.chunks column, if any
+        markdown: Markdown of the document
+
+    Returns:
+        The chunks in document order
+    """
+    if rows:
+        return [DocumentChunk.from_row(row) for row in rows]
+    if isinstance(markdown, str):
+        return chunks_from_markdown(markdown)
+    return []
@@ -1,7 +1,10 @@
-from functools import lru_cache
+from functools import lru_cache, partial
+from typing import Any, Callable, Optional, TypeVar
 import os
+import anyio
 from fastapi import HTTPException
-from supabase import create_client, Client
+
+from webapp import tracing
 
 @lru_cache()
 def get_supabase_client():
@@ -9,4 +12,35 @@ def get_supabase_client():
     supabase_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
     if not supabase_url or not supabase_key:
         raise HTTPException(status_code=500, detail="Supabase configuration missing")
-    return create_client(supabase_url, supabase_key)
\ No newline at end of file
+    # supabase is slow to import; load it with the first client instead of at startup
+    from supabase import create_client
+    return create_client(supabase_url, supabase_key)
+
+
+T = TypeVar("T")
+
+# Upper bound on threads blocked on Supabase I/O at once, kept apart from the
+# default threadpool so request handling never waits behind slow storage calls
+SUPABASE_MAX_CONCURRENCY = int(os.getenv("SUPABASE_MAX_CONCURRENCY", "8"))
+_supabase_limiter: Optional[anyio.CapacityLimiter] = None
+
+def _get_supabase_limiter() -> anyio.CapacityLimiter:
+    global _supabase_limiter
+    if _supabase_limiter is None:
+        _supabase_limiter = anyio.CapacityLimiter(SUPABASE_MAX_CONCURRENCY)
+    return _supabase_limiter
+
+async def run_supabase_call(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Run a blocking Supabase call in a worker thread without blocking the event loop.
+    
+    Args:
+        func: The synchronous function making the Supabase request
+        *args: Positional arguments for func
+        **kwargs: Keyword arguments for func
+        
+    Returns:
+        Whatever func returns
+    """
+    with tracing.span(f"supabase {getattr(func, '__name__', 'call')}", kind="client"):
+        return await anyio.to_thread.run_sync(partial(func, *args, **kwargs), limiter=_get_supabase_limiter())
@@ -0,0 +1,142 @@
+"""
+Content-addressed index of parsed documents, so re-uploads skip parsing and OCR.
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from webapp.documents import find_document_by_content_hash, get_document_data_by_document_id
+from webapp.metrics import Counter
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "false").lower() == "true"
+# "user" only reuses a user's own documents, "global" reuses across users
+DEDUP_SCOPE = os.getenv("DEDUP_SCOPE", "user")
+DEDUP_CACHE_SIZE = int(os.getenv("DEDUP_CACHE_SIZE", "1024"))
+# How long a duplicate upload waits for the upload that is already parsing
+DEDUP_WAIT_TIMEOUT = float(os.getenv("DEDUP_WAIT_TIMEOUT", "600"))
+
+DEDUP_LOOKUPS = Counter(
+    "agenticdoc_dedup_lookups_total",
+    "Content hash lookups before parsing, by result",
+    ["result"]
+)
+
+
+@dataclass
+class DedupResult:
+    markdown: str
+    hit: bool
+    # Stored chunks of the earlier upload, on a hit
+    chunks: Optional[List[Dict[str, Any]]] = None
+    file_ids: Optional[List[str]] = None
+    vector_store_ids: Optional[List[str]] = None
+
+
+class ContentIndex:
+    """
+    Maps content hashes to the document that already holds their parsed markdown.
+    Concurrent uploads of the same content are single-flighted: one parses, the
+    others wait for it and reuse its result.
+    """
+
+    def __init__(self, max_entries: int = DEDUP_CACHE_SIZE, scope: str = DEDUP_SCOPE):
+        self.max_entries = max_entries
+        self.scope = scope
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._inflight: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, content_hash: str, user_id: str) -> str:
+        if self.scope == "global":
+            return content_hash
+        return f"{user_id}:{content_hash}"
+
+    def _record(self, key: str, document_id: str):
+        with self._lock:
+            self._entries[key] = document_id
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _hit(self, document_id: str) -> DedupResult:
+        document_data = get_document_data_by_document_id(document_id)
+        DEDUP_LOOKUPS.inc(result="hit")
+        logger.info(f"Reusing parsed markdown from document {document_id}")
+        return DedupResult(
+            markdown=document_data["markdown"],
+            hit=True,
+            chunks=document_data["chunks"],
+            file_ids=document_data["file_ids"],
+            vector_store_ids=document_data["vector_store_ids"]
+        )
+
+    def contains(self, content_hash: str, user_id: str) -> bool:
+        """Check whether a document with this content was already parsed."""
+        key = self._key(content_hash, user_id)
+        with self._lock:
+            if key in self._entries:
+                return True
+        scope_user_id = None if self.scope == "global" else user_id
+        return find_document_by_content_hash(content_hash, scope_user_id) is not None
+
+    def resolve(self, content_hash: str, user_id: str, document_id: str, parse: Callable[[], str]) -> DedupResult:
+        """
+        Return the markdown for some content, parsing it only if no earlier upload did.
+
+        Args:
+            content_hash: SHA-256 hex digest of the uploaded bytes
+            user_id: ID of the uploading user
+            document_id: ID of the document being processed
+            parse: Produces and saves the markdown on a miss
+
+        Returns:
+            DedupResult with the markdown, and the OpenAI file and vector store IDs on a hit
+        """
+        key = self._key(content_hash, user_id)
+
+        while True:
+            with self._lock:
+                cached_document_id = self._entries.get(key)
+                if cached_document_id is not None:
+                    self._entries.move_to_end(key)
+                    event = None
+                else:
+                    event = self._inflight.get(key)
+                    if event is None:
+                        self._inflight[key] = threading.Event()
+                        break
+            if cached_document_id is not None:
+                try:
+                    return self._hit(cached_document_id)
+                except Exception as e:
+                    logger.warning(f"Dropping dedup entry for document {cached_document_id}: {str(e)}")
+                    with self._lock:
+                        if self._entries.get(key) == cached_document_id:
+                            del self._entries[key]
+                    continue
+            # Another upload of the same content is parsing; wait for it, then look again
+            event.wait(DEDUP_WAIT_TIMEOUT)
+
+        try:
+            scope_user_id = None if self.scope == "global" else user_id
+            persisted_document_id = find_document_by_content_hash(content_hash, scope_user_id)
+            if persisted_document_id is not None:
+                self._record(key, persisted_document_id)
+                return self._hit(persisted_document_id)
+
+            DEDUP_LOOKUPS.inc(result="miss")
+            markdown = parse()
+            self._record(key, document_id)
+            return DedupResult(markdown=markdown, hit=False)
+        finally:
+            with self._lock:
+                self._inflight.pop(key).set()
+
+
+content_index = ContentIndex()
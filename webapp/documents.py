@@ -2,8 +2,9 @@
 # user_id, file_name, file_path, file_size, file_type, status (pending, processing, completed, failed), document_type, processing_result, error_message, job_id, metadata (we store user's fields to be extracted here)
 
 
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 from webapp.db import get_supabase_client
+from webapp.repository import document_repository
 
 def create_agentic_doc_job(
     user_id: str,
@@ -24,10 +25,44 @@ def create_agentic_doc_job(
 
     return response.data
 
+def create_agentic_doc_jobs(
+    user_id: str,
+    fields: Dict[str, Any],
+    document_type: str,
+    count: int
+) -> List[Dict[str, Any]]:
+    """
+    Insert several pending agentic_doc_jobs rows with the same fields in one request.
+    
+    Args:
+        user_id: The ID of the user who uploaded the documents
+        fields: Fields to extract
+        document_type: Type of the documents
+        count: Number of jobs to create
+        
+    Returns:
+        List of the inserted rows
+    """
+    supabase = get_supabase_client()
+    response = supabase.table("agentic_doc_jobs").insert([
+        {
+            "user_id": user_id,
+            "fields": fields,
+            "result": {},
+            "error": "",
+            "document_type": document_type,
+            "status": "pending"
+        }
+        for _ in range(count)
+    ]).execute()
+
+    return response.data
+
 def update_agentic_doc_job(
     job_id: str,
     result: Dict[str, Any],
     error: str,
+    chunks: Optional[List[Dict[str, Any]]] = None
 ) -> Dict[str, Any]:
     supabase = get_supabase_client()
 
@@ -36,6 +71,9 @@ def update_agentic_doc_job(
         "error": error
     }
 
+    if chunks is not None:
+        update_data["chunks"] = chunks
+
     response = supabase.table("agentic_doc_jobs").update(update_data).eq("job_id", job_id).execute()
 
     return response.data
@@ -66,7 +104,8 @@ def save_document_info(
     error_message: str,
     job_id: str,
     metadata: Dict[str, Any],
-    file_path: str
+    file_path: str,
+    content_hash: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     Save document information to the Supabase database.
@@ -83,6 +122,7 @@ def save_document_info(
         error_message: Error message if processing failed
         job_id: ID of the processing job
         metadata: Additional metadata about the document
+        content_hash: SHA-256 hex digest of the uploaded bytes (optional)
         
     Returns:
         Dict containing the response from Supabase
@@ -102,10 +142,32 @@ def save_document_info(
         "job_id": job_id,
         "metadata": metadata
     }
+
+    if content_hash is not None:
+        document_data["content_hash"] = content_hash
     
     response = supabase.table("documents").insert(document_data).execute()
     return response.data
 
+def save_documents_info(documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Insert several documents rows in one request.
+    
+    Args:
+        documents: Rows with the same columns save_document_info writes; a
+            content_hash of None is left out, as it is there
+        
+    Returns:
+        List of the inserted rows
+    """
+    supabase = get_supabase_client()
+    rows = [
+        {column: value for column, value in document.items() if not (column == "content_hash" and value is None)}
+        for document in documents
+    ]
+    response = supabase.table("documents").insert(rows).execute()
+    return response.data
+
 def update_document_by_job_id(
     job_id: str,
     status: str,
@@ -172,16 +234,65 @@ def update_document_data(
     return response.data
 
 def get_document_data_by_document_id(document_id: str) -> Dict[str, Any]:
+    document = document_repository.get(document_id, include_chunks=True)
+
+    return {
+        "document_type": document.document_type,
+        "markdown": document.markdown,
+        "chunks": document.chunks,
+        "job_id": document.job_id,
+        "file_ids": document.file_ids,
+        "vector_store_ids": document.vector_store_ids
+    }
+
+def get_documents_status(document_ids: List[str]) -> List[Dict[str, Any]]:
+    """
+    Get the processing status of several documents in one request.
+    
+    Args:
+        document_ids: IDs of the documents
+        
+    Returns:
+        List of rows with id, status and error_message
+    """
     supabase = get_supabase_client()
-    document_response = supabase.table("documents").select("job_id, document_type, file_ids, vector_store_ids").eq("id", document_id).execute()
-    agentic_job_response = supabase.table("agentic_doc_jobs").select("result").eq("job_id", document_response.data[0]["job_id"]).execute()
+    response = supabase.table("documents").select("id, status, error_message").in_("id", document_ids).execute()
+    return response.data
 
+def get_document_result(document_id: str) -> Dict[str, Any]:
+    """
+    Get the parsed markdown and extracted data of a processed document.
+    
+    Args:
+        document_id: ID of the document
+        
+    Returns:
+        Dict with the markdown and the extracted data
+    """
+    document = document_repository.get(document_id)
+
+    return {
+        "markdown": document.markdown,
+        "data": document.processing_result
+    }
+
+def get_file_and_vector_store_ids(document_id: str) -> Dict[str, Any]:
+    """
+    Get the OpenAI files and vector stores already created for a document.
+    
+    Args:
+        document_id: ID of the document
+        
+    Returns:
+        Dict with the file_ids and vector_store_ids, each None when not created yet
+    """
+    supabase = get_supabase_client()
+    response = supabase.table("documents").select("file_ids, vector_store_ids").eq("id", document_id).execute()
+    if not response.data:
+        return {"file_ids": None, "vector_store_ids": None}
     return {
-        "document_type": document_response.data[0]["document_type"],
-        "markdown": agentic_job_response.data[0]["result"],
-        "job_id": document_response.data[0]["job_id"],
-        "file_ids": document_response.data[0]["file_ids"],
-        "vector_store_ids": document_response.data[0]["vector_store_ids"]
+        "file_ids": response.data[0]["file_ids"],
+        "vector_store_ids": response.data[0]["vector_store_ids"]
     }
 
 def save_file_and_vector_store_ids(
@@ -196,8 +307,56 @@ def save_file_and_vector_store_ids(
     }).eq("id", document_id).execute()
     return response.data
 
+def get_openai_resource_references(page_size: int = 1000) -> List[Dict[str, Any]]:
+    """
+    Get the OpenAI files and vector stores recorded on every document.
+    
+    Args:
+        page_size: Rows fetched per request
+        
+    Returns:
+        List of rows with file_ids and vector_store_ids
+    """
+    supabase = get_supabase_client()
+    rows: List[Dict[str, Any]] = []
+    start = 0
+    while True:
+        response = (
+            supabase.table("documents")
+            .select("file_ids, vector_store_ids")
+            .or_("file_ids.not.is.null,vector_store_ids.not.is.null")
+            .order("id")
+            .range(start, start + page_size - 1)
+            .execute()
+        )
+        # PostgREST may cap pages below page_size (max-rows), so only an empty page means the end
+        if not response.data:
+            return rows
+        rows.extend(response.data)
+        start += len(response.data)
 
+def find_document_by_content_hash(content_hash: str, user_id: Optional[str] = None) -> Optional[str]:
+    """
+    Find a completed document whose upload had the given content hash.
+    
+    Args:
+        content_hash: SHA-256 hex digest of the uploaded bytes
+        user_id: Only match documents of this user (optional)
+        
+    Returns:
+        The document ID, or None when there is no match
+    """
+    supabase = get_supabase_client()
+    query = (
+        supabase.table("documents")
+        .select("id")
+        .eq("content_hash", content_hash)
+        .eq("status", "completed")
+    )
+    if user_id is not None:
+        query = query.eq("user_id", user_id)
 
-
-
-
+    response = query.limit(1).execute()
+    if not response.data:
+        return None
+    return response.data[0]["id"]
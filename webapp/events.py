@@ -0,0 +1,71 @@
+"""
+Fan-out of task progress events to Server-Sent Events subscribers.
+
+Events are published from worker threads and delivered to asyncio queues owned
+by the streaming responses, so publishing never blocks on slow clients.
+"""
+import asyncio
+import json
+import logging
+import threading
+from typing import Any, Dict, Set
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class Subscription:
+    __slots__ = ("task_id", "queue", "loop")
+
+    def __init__(self, task_id: str):
+        self.task_id = task_id
+        self.loop = asyncio.get_running_loop()
+        self.queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def _put(self, event: Dict[str, Any]):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            logger.warning(f"Dropping event for slow subscriber of task {self.task_id}")
+
+
+class EventBroker:
+    def __init__(self):
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, task_id: str) -> Subscription:
+        """Start receiving events for a task. Must be called from the event loop."""
+        subscription = Subscription(task_id)
+        with self._lock:
+            self._subscribers.setdefault(task_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.task_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.task_id]
+
+    def publish(self, task_id: str, event: Dict[str, Any]):
+        """Deliver an event to every subscriber of a task. Safe to call from any thread."""
+        with self._lock:
+            subscribers = list(self._subscribers.get(task_id, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._put, event)
+            except RuntimeError:
+                # The subscriber's event loop has shut down
+                self.unsubscribe(subscription)
+
+
+def format_sse(event: Dict[str, Any]) -> str:
+    """Encode an event as a Server-Sent Events message."""
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+event_broker = EventBroker()
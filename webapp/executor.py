@@ -0,0 +1,96 @@
+"""
+Executor for the CPU-bound parts of document jobs.
+
+Job handlers run on the worker's own threads (JOB_WORKER_CONCURRENCY), so jobs
+waiting on providers never take threads from Starlette's threadpool. Reading
+and splitting PDFs holds the GIL for the whole call, though, which stalls the
+event loop when workers run in the web process. That work runs in a small
+pool of worker processes instead, JOB_CPU_WORKERS of them. With 0 it runs in
+the calling thread.
+
+Functions sent to the pool must be importable from a light module, such as
+webapp.pdf, since each worker process imports them on start.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional, Tuple, TypeVar
+
+from webapp.metrics import CPU_TASK_SECONDS, CPU_TASK_WAIT_SECONDS, CPU_TASKS_IN_FLIGHT
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+JOB_CPU_WORKERS = int(os.getenv("JOB_CPU_WORKERS", "1"))
+
+T = TypeVar("T")
+
+_executor: Optional[ProcessPoolExecutor] = None
+_lock = threading.Lock()
+
+
+def _get_executor() -> Optional[ProcessPoolExecutor]:
+    global _executor
+    if JOB_CPU_WORKERS <= 0:
+        return None
+    with _lock:
+        if _executor is None:
+            # Forking a process that runs threads can copy held locks; spawned workers start clean
+            _executor = ProcessPoolExecutor(max_workers=JOB_CPU_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+def _discard_executor(executor: ProcessPoolExecutor):
+    global _executor
+    with _lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False)
+
+
+def _timed(func: Callable[..., T], submitted_at: float, *args: Any) -> Tuple[T, float]:
+    # Runs in the worker process; time.time() is comparable across processes
+    waited = time.time() - submitted_at
+    return func(*args), waited
+
+
+def run_cpu_bound(func: Callable[..., T], *args: Any) -> T:
+    """
+    Run a CPU-bound function in the process pool and wait for its result.
+
+    Args:
+        func: Module-level function, so it can be sent to another process
+        *args: Picklable arguments of the function
+
+    Returns:
+        Whatever func returns
+    """
+    task = func.__name__
+    executor = _get_executor()
+    start = time.monotonic()
+    with CPU_TASKS_IN_FLIGHT.track_inprogress(task=task):
+        if executor is None:
+            result = func(*args)
+        else:
+            try:
+                result, waited = executor.submit(_timed, func, time.time(), *args).result()
+            except BrokenProcessPool:
+                # A worker process died, e.g. killed for memory; later tasks get a new pool
+                _discard_executor(executor)
+                raise
+            CPU_TASK_WAIT_SECONDS.observe(max(waited, 0.0), task=task)
+    CPU_TASK_SECONDS.observe(time.monotonic() - start, task=task)
+    return result
+
+
+def shutdown_cpu_executor():
+    """Stop the worker processes, after the tasks already submitted finish."""
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
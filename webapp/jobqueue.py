@@ -0,0 +1,453 @@
+"""
+Durable job queue for document processing.
+
+Jobs are claimed with a lease (visibility timeout). A job whose worker dies is
+claimed again once its lease runs out, and failed jobs are retried with
+exponential backoff until they run out of attempts.
+
+Endpoints that enqueue jobs check admission first. Once more than
+JOB_QUEUE_HIGH_WATER jobs are waiting, they answer 429 with a Retry-After
+instead of growing the backlog.
+"""
+import abc
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, Iterator, Optional
+
+import anyio
+
+from webapp import tracing
+from webapp.db import get_supabase_client
+from webapp.metrics import JOB_QUEUE_DEPTH
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+JOB_QUEUE_BACKEND = os.getenv("JOB_QUEUE_BACKEND", "sqlite")
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "agenticdoc-jobs.sqlite3")
+JOB_QUEUE_TABLE = os.getenv("JOB_QUEUE_TABLE", "job_queue")
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "10"))
+# Most jobs waiting before new work is rejected; 0 never rejects
+JOB_QUEUE_HIGH_WATER = int(os.getenv("JOB_QUEUE_HIGH_WATER", "100"))
+JOB_QUEUE_RETRY_AFTER = int(os.getenv("JOB_QUEUE_RETRY_AFTER", "30"))
+# How long a count of waiting jobs is reused before the queue is asked again
+JOB_QUEUE_DEPTH_TTL = float(os.getenv("JOB_QUEUE_DEPTH_TTL", "1"))
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    payload: Dict[str, Any]
+    status: str
+    attempts: int
+    max_attempts: int
+    error: Optional[str] = None
+    created_at: Optional[float] = None
+    updated_at: Optional[float] = None
+    available_at: Optional[float] = None
+
+
+class LeaseLost(Exception):
+    """Raised when a worker records the outcome of a job whose lease another worker has taken over."""
+
+
+def retry_delay(attempts: int) -> float:
+    """Seconds to wait before the next attempt, doubling with every failed one."""
+    return JOB_RETRY_DELAY * (2 ** max(attempts - 1, 0))
+
+
+class JobQueue(abc.ABC):
+    """Interface shared by the queue backends."""
+
+    # Whether workers run on the machine that enqueued a job, and can read its spooled upload
+    shares_disk = False
+
+    @abc.abstractmethod
+    def enqueue(self, kind: str, payload: Dict[str, Any], job_id: Optional[str] = None, max_attempts: int = JOB_MAX_ATTEMPTS) -> str:
+        """Add a job and return its ID."""
+
+    @abc.abstractmethod
+    def claim(self, worker_id: str, visibility_timeout: float) -> Optional[Job]:
+        """
+        Lease the next runnable job to a worker, or return None when there is none.
+        Jobs whose lease expired are claimed again, even past their last attempt,
+        so the worker can record the failure.
+        """
+
+    @abc.abstractmethod
+    def heartbeat(self, job_id: str, worker_id: str, visibility_timeout: float):
+        """Extend the lease of a job the worker is still running."""
+
+    @abc.abstractmethod
+    def complete(self, job_id: str, worker_id: str):
+        """Mark a leased job as done."""
+
+    @abc.abstractmethod
+    def fail(self, job_id: str, worker_id: str, error: str) -> bool:
+        """
+        Record a failed attempt. Returns True when the job will be retried and
+        False when it has run out of attempts. Raises LeaseLost when the worker
+        no longer holds the job, leaving it to whoever does.
+        """
+
+    @abc.abstractmethod
+    def get(self, job_id: str) -> Optional[Job]:
+        """Get a job by its ID."""
+
+    @abc.abstractmethod
+    def depth(self) -> int:
+        """Number of jobs waiting to be claimed, including ones waiting to be retried."""
+
+
+class SQLiteJobQueue(JobQueue):
+    """Queue stored in a local SQLite database in WAL mode, shared by processes on one machine."""
+
+    shares_disk = True
+
+    def __init__(self, path: str = JOB_QUEUE_PATH):
+        self.path = path
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA busy_timeout = 30000")
+        with self._init_lock:
+            if not self._initialized:
+                connection.execute("PRAGMA journal_mode = WAL")
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS jobs ("
+                    "id TEXT PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL, "
+                    "status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, max_attempts INTEGER NOT NULL, "
+                    "available_at REAL NOT NULL, locked_by TEXT, locked_until REAL, error TEXT, "
+                    "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+                )
+                connection.execute("CREATE INDEX IF NOT EXISTS jobs_status_available_at ON jobs (status, available_at)")
+                self._initialized = True
+        return connection
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        connection = self._connect()
+        try:
+            # Take the write lock up front so two workers can't claim the same job
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _to_job(row: sqlite3.Row) -> Job:
+        return Job(
+            id=row["id"],
+            kind=row["kind"],
+            payload=json.loads(row["payload"]),
+            status=row["status"],
+            attempts=row["attempts"],
+            max_attempts=row["max_attempts"],
+            error=row["error"],
+            created_at=row["created_at"],
+            updated_at=row["updated_at"],
+            available_at=row["available_at"]
+        )
+
+    def enqueue(self, kind: str, payload: Dict[str, Any], job_id: Optional[str] = None, max_attempts: int = JOB_MAX_ATTEMPTS) -> str:
+        job_id = job_id or str(uuid.uuid4())
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute(
+                "INSERT INTO jobs (id, kind, payload, status, max_attempts, available_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(payload), QUEUED, max_attempts, now, now, now)
+            )
+        return job_id
+
+    def claim(self, worker_id: str, visibility_timeout: float) -> Optional[Job]:
+        now = time.time()
+        with self._transaction() as connection:
+            row = connection.execute(
+                "SELECT * FROM jobs WHERE (status = ? AND available_at <= ?) OR (status = ? AND locked_until <= ?) "
+                "ORDER BY available_at LIMIT 1",
+                (QUEUED, now, RUNNING, now)
+            ).fetchone()
+            if row is None:
+                return None
+
+            if row["status"] == RUNNING:
+                logger.warning(f"Reclaiming job {row['id']} after its lease held by {row['locked_by']} expired")
+
+            connection.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, locked_by = ?, locked_until = ?, updated_at = ? WHERE id = ?",
+                (RUNNING, worker_id, now + visibility_timeout, now, row["id"])
+            )
+            job = self._to_job(row)
+            job.status = RUNNING
+            job.attempts += 1
+            return job
+
+    def heartbeat(self, job_id: str, worker_id: str, visibility_timeout: float):
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE jobs SET locked_until = ?, updated_at = ? WHERE id = ? AND locked_by = ? AND status = ?",
+                (now + visibility_timeout, now, job_id, worker_id, RUNNING)
+            )
+
+    def complete(self, job_id: str, worker_id: str):
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = ?, error = NULL, locked_by = NULL, locked_until = NULL, updated_at = ? "
+                "WHERE id = ? AND locked_by = ?",
+                (COMPLETED, time.time(), job_id, worker_id)
+            )
+
+    def fail(self, job_id: str, worker_id: str, error: str) -> bool:
+        now = time.time()
+        with self._transaction() as connection:
+            row = connection.execute(
+                "SELECT attempts, max_attempts FROM jobs WHERE id = ? AND locked_by = ?",
+                (job_id, worker_id)
+            ).fetchone()
+            if row is None:
+                raise LeaseLost(job_id)
+            will_retry = row["attempts"] < row["max_attempts"]
+            connection.execute(
+                "UPDATE jobs SET status = ?, error = ?, available_at = ?, locked_by = NULL, locked_until = NULL, updated_at = ? "
+                "WHERE id = ?",
+                (QUEUED if will_retry else FAILED, error, now + retry_delay(row["attempts"]), now, job_id)
+            )
+        return will_retry
+
+    def get(self, job_id: str) -> Optional[Job]:
+        connection = self._connect()
+        try:
+            row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            connection.close()
+        return self._to_job(row) if row is not None else None
+
+    def depth(self) -> int:
+        connection = self._connect()
+        try:
+            return connection.execute("SELECT count(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+        finally:
+            connection.close()
+
+
+class SupabaseJobQueue(JobQueue):
+    """
+    Queue stored in a Postgres table behind Supabase, for workers spread over
+    several machines. Claims are compare-and-set updates on status and attempts,
+    so only one worker wins each job.
+    """
+
+    def __init__(self, table: str = JOB_QUEUE_TABLE):
+        self.table = table
+
+    def _query(self):
+        return get_supabase_client().table(self.table)
+
+    @staticmethod
+    def _to_job(row: Dict[str, Any]) -> Job:
+        return Job(
+            id=row["id"],
+            kind=row["kind"],
+            payload=row["payload"],
+            status=row["status"],
+            attempts=row["attempts"],
+            max_attempts=row["max_attempts"],
+            error=row.get("error"),
+            created_at=row.get("created_at"),
+            updated_at=row.get("updated_at"),
+            available_at=row.get("available_at")
+        )
+
+    def enqueue(self, kind: str, payload: Dict[str, Any], job_id: Optional[str] = None, max_attempts: int = JOB_MAX_ATTEMPTS) -> str:
+        job_id = job_id or str(uuid.uuid4())
+        now = time.time()
+        self._query().insert({
+            "id": job_id,
+            "kind": kind,
+            "payload": payload,
+            "status": QUEUED,
+            "attempts": 0,
+            "max_attempts": max_attempts,
+            "available_at": now,
+            "created_at": now,
+            "updated_at": now
+        }).execute()
+        return job_id
+
+    def claim(self, worker_id: str, visibility_timeout: float) -> Optional[Job]:
+        now = time.time()
+        response = (
+            self._query()
+            .select("*")
+            .or_(f"and(status.eq.{QUEUED},available_at.lte.{now}),and(status.eq.{RUNNING},locked_until.lte.{now})")
+            .order("available_at")
+            .limit(5)
+            .execute()
+        )
+        for row in response.data:
+            claimed = (
+                self._query()
+                .update({"status": RUNNING, "attempts": row["attempts"] + 1, "locked_by": worker_id, "locked_until": now + visibility_timeout, "updated_at": now})
+                .eq("id", row["id"])
+                .eq("status", row["status"])
+                .eq("attempts", row["attempts"])
+                .execute()
+            )
+            if claimed.data:
+                return self._to_job(claimed.data[0])
+        return None
+
+    def heartbeat(self, job_id: str, worker_id: str, visibility_timeout: float):
+        now = time.time()
+        (
+            self._query()
+            .update({"locked_until": now + visibility_timeout, "updated_at": now})
+            .eq("id", job_id)
+            .eq("locked_by", worker_id)
+            .eq("status", RUNNING)
+            .execute()
+        )
+
+    def complete(self, job_id: str, worker_id: str):
+        (
+            self._query()
+            .update({"status": COMPLETED, "error": None, "locked_by": None, "locked_until": None, "updated_at": time.time()})
+            .eq("id", job_id)
+            .eq("locked_by", worker_id)
+            .execute()
+        )
+
+    def fail(self, job_id: str, worker_id: str, error: str) -> bool:
+        now = time.time()
+        response = self._query().select("attempts, max_attempts").eq("id", job_id).eq("locked_by", worker_id).execute()
+        if not response.data:
+            raise LeaseLost(job_id)
+        row = response.data[0]
+        will_retry = row["attempts"] < row["max_attempts"]
+        updated = (
+            self._query()
+            .update({
+                "status": QUEUED if will_retry else FAILED,
+                "error": error,
+                "available_at": now + retry_delay(row["attempts"]),
+                "locked_by": None,
+                "locked_until": None,
+                "updated_at": now
+            })
+            .eq("id", job_id)
+            .eq("locked_by", worker_id)
+            .eq("attempts", row["attempts"])
+            .execute()
+        )
+        if not updated.data:
+            # The lease expired and the job was claimed again in between
+            raise LeaseLost(job_id)
+        return will_retry
+
+    def get(self, job_id: str) -> Optional[Job]:
+        response = self._query().select("*").eq("id", job_id).execute()
+        return self._to_job(response.data[0]) if response.data else None
+
+    def depth(self) -> int:
+        response = self._query().select("id", count="exact").eq("status", QUEUED).limit(1).execute()
+        return response.count or 0
+
+
+class QueueFull(Exception):
+    """Raised when admitting more jobs would take the queue past its high-water mark."""
+
+    def __init__(self, depth: int, retry_after: int = JOB_QUEUE_RETRY_AFTER):
+        super().__init__(f"{depth} jobs are waiting in the queue")
+        self.depth = depth
+        self.retry_after = retry_after
+
+
+class AdmissionControl:
+    """
+    Rejects new jobs while the queue is over its high-water mark. The depth is
+    counted at most once per ttl; jobs admitted since then are added to the
+    count, so a burst can't slip past the mark between two counts.
+    """
+
+    def __init__(self, high_water: int = JOB_QUEUE_HIGH_WATER, ttl: float = JOB_QUEUE_DEPTH_TTL):
+        self.high_water = high_water
+        self.ttl = ttl
+        self._depth = 0
+        self._counted_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def _current_depth(self) -> int:
+        now = time.monotonic()
+        if now - self._counted_at >= self.ttl:
+            self._depth = get_job_queue().depth()
+            self._counted_at = now
+            JOB_QUEUE_DEPTH.set(self._depth)
+        return self._depth
+
+    def admit(self, jobs: int = 1):
+        """
+        Reserve room for jobs about to be enqueued.
+
+        Raises:
+            QueueFull: If the queue already holds JOB_QUEUE_HIGH_WATER jobs or more
+        """
+        if self.high_water <= 0:
+            return
+        with self._lock:
+            depth = self._current_depth()
+            if depth >= self.high_water:
+                raise QueueFull(depth)
+            self._depth += jobs
+
+
+admission_control = AdmissionControl()
+
+
+@lru_cache()
+def get_job_queue() -> JobQueue:
+    if JOB_QUEUE_BACKEND == "supabase":
+        return SupabaseJobQueue()
+    if JOB_QUEUE_BACKEND == "sqlite":
+        return SQLiteJobQueue()
+    raise ValueError(f"Unknown JOB_QUEUE_BACKEND: {JOB_QUEUE_BACKEND}")
+
+
+async def admit_jobs(jobs: int = 1):
+    """Check admission from async code without blocking the event loop; raises QueueFull."""
+    await anyio.to_thread.run_sync(admission_control.admit, jobs)
+
+
+async def get_job(job_id: str) -> Optional[Job]:
+    """Look up a job from async code without blocking the event loop."""
+    return await anyio.to_thread.run_sync(lambda: get_job_queue().get(job_id))
+
+
+async def enqueue_job(kind: str, payload: Dict[str, Any], job_id: Optional[str] = None) -> str:
+    """Enqueue a job from async code without blocking the event loop, carrying the current trace."""
+    payload = tracing.inject_payload(payload)
+    return await anyio.to_thread.run_sync(lambda: get_job_queue().enqueue(kind, payload, job_id))
@@ -1,4 +1,18 @@
-from agentic_doc.parse import parse_documents
+"""
+Parsing with agentic-doc (LandingAI).
+
+agentic-doc takes most of a second and tens of MB to import, so it is imported
+the first time a document is parsed rather than when the web process starts.
+Every module that parses goes through parse_documents here.
+"""
+from typing import Any, List
+
+
+def parse_documents(documents: List[Any], **kwargs: Any) -> List[Any]:
+    """agentic_doc.parse.parse_documents, importing agentic-doc on first use."""
+    from agentic_doc.parse import parse_documents as parse_with_agentic_doc
+    return parse_with_agentic_doc(documents, **kwargs)
+
 
 def get_parsed_doc_from_landingai(file_url: str):
     try:
@@ -6,4 +20,3 @@ def get_parsed_doc_from_landingai(file_url: str):
         return results[0]
     except Exception as e:
         raise Exception(str(e),"Document processing failed : No results returned")
-    
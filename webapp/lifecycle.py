@@ -0,0 +1,255 @@
+"""
+Lifecycle of the OpenAI files and vector stores created for extraction.
+
+Vector stores expire on their own VECTOR_STORE_EXPIRY_DAYS after they were
+last used. Files don't, and failed attempts leave both behind, so a reaper
+periodically deletes:
+
+- vector stores that expired, or that no document references anymore
+- files that no document with a live vector store references anymore
+
+Documents share resources through duplicate detection, so a resource is kept
+as long as any document still references it. Resources younger than
+OPENAI_REAPER_MIN_AGE are never deleted, since extraction may not have
+recorded them yet. Documents whose resources were reaped get new ones the next
+time they are extracted.
+
+The reaper runs as a job on the job queue, scheduled every
+OPENAI_REAPER_INTERVAL seconds by one designated process: the web process
+running in-process workers, unless OPENAI_REAPER_SCHEDULER is off there, or
+the standalone worker started with --schedule-reaper. The job ID is derived
+from the interval, so a second scheduler by mistake still only causes one run
+per interval. Run it by hand with `python -m webapp.lifecycle [--dry-run]`.
+
+Only the scheduler runs in the web process, so the OpenAI modules are
+imported by the reaper job itself.
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from webapp.documents import get_openai_resource_references
+from webapp.jobqueue import get_job_queue
+from webapp.metrics import Counter
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Seconds between reaper runs; 0 disables scheduling
+OPENAI_REAPER_INTERVAL = float(os.getenv("OPENAI_REAPER_INTERVAL", "3600"))
+OPENAI_REAPER_MIN_AGE = float(os.getenv("OPENAI_REAPER_MIN_AGE", "3600"))
+OPENAI_REAPER_CONCURRENCY = int(os.getenv("OPENAI_REAPER_CONCURRENCY", "4"))
+# Whether a web process with in-process workers schedules the reaper
+OPENAI_REAPER_SCHEDULER = os.getenv("OPENAI_REAPER_SCHEDULER", "true").lower() == "true"
+
+REAPER_JOB_KIND = "reap_openai_resources"
+
+REAPED_RESOURCES = Counter(
+    "agenticdoc_openai_resources_reaped_total",
+    "OpenAI files and vector stores deleted by the reaper, by resource",
+    ["resource"]
+)
+
+
+def is_own_vector_store(vector_store: Any) -> bool:
+    """
+    Whether a vector store was created by this app, going by its metadata tag
+    only: other apps on the same OpenAI project may use similar names. Stores
+    created before they were tagged are left to expire on their own.
+    """
+    from webapp.llm import VECTOR_STORE_METADATA
+    metadata = vector_store.metadata or {}
+    return metadata.get("created_by") == VECTOR_STORE_METADATA["created_by"]
+
+
+def is_own_file(file: Any) -> bool:
+    """
+    Whether a file was uploaded by this app, going by its exact name. Files
+    uploaded before they were given that name are left alone.
+    """
+    from webapp.llm import OPENAI_FILE_NAME
+    return file.purpose == "assistants" and file.filename == OPENAI_FILE_NAME
+
+
+def list_all(operation: str, method: Any, **params: Any) -> Iterator[Any]:
+    """
+    Page through an OpenAI list endpoint, fetching every page under the rate limiter.
+
+    Args:
+        operation: Name of the call, used as the metrics label
+        method: A `with_raw_response` list method of the OpenAI client
+        **params: Arguments of the method
+    """
+    from webapp.ratelimit import openai_limiter
+    while True:
+        page = openai_limiter.call(operation, method, **params)
+        yield from page.data
+        if not page.has_more or not page.data:
+            return
+        params["after"] = page.data[-1].id
+
+
+def collect_references() -> Tuple[Set[str], Dict[str, Set[str]]]:
+    """
+    Gather the resources documents reference.
+
+    Returns:
+        Tuple of the referenced vector store IDs, and a map from each referenced
+        file ID to the vector stores of the documents referencing it
+    """
+    vector_store_ids: Set[str] = set()
+    file_stores: Dict[str, Set[str]] = {}
+    for row in get_openai_resource_references():
+        stores = set(row["vector_store_ids"] or [])
+        vector_store_ids.update(stores)
+        for file_id in row["file_ids"] or []:
+            file_stores.setdefault(file_id, set()).update(stores)
+    return vector_store_ids, file_stores
+
+
+def find_orphans(client: "OpenAI", min_age: float = OPENAI_REAPER_MIN_AGE) -> Tuple[List[str], List[str]]:
+    """
+    Find the resources the reaper should delete.
+
+    Args:
+        client: OpenAI client
+        min_age: Resources created less than this many seconds ago are kept
+
+    Returns:
+        Tuple of the orphaned vector store IDs and file IDs
+    """
+    referenced_stores, file_stores = collect_references()
+    created_before = time.time() - min_age
+
+    orphaned_stores = []
+    live_stores = set()
+    for vector_store in list_all("vector_stores.list", client.vector_stores.with_raw_response.list, limit=100):
+        if not is_own_vector_store(vector_store):
+            continue
+        expired = vector_store.status == "expired"
+        unreferenced = vector_store.id not in referenced_stores and vector_store.created_at < created_before
+        if expired or unreferenced:
+            orphaned_stores.append(vector_store.id)
+        else:
+            live_stores.add(vector_store.id)
+
+    orphaned_files = []
+    for file in list_all("files.list", client.files.with_raw_response.list, purpose="assistants"):
+        if not is_own_file(file) or file.created_at >= created_before:
+            continue
+        if not file_stores.get(file.id, set()) & live_stores:
+            orphaned_files.append(file.id)
+
+    return orphaned_stores, orphaned_files
+
+
+def delete_resource(client: "OpenAI", resource: str, resource_id: str) -> bool:
+    """Delete one file or vector store; returns False when it was already gone."""
+    from openai import NotFoundError
+    from webapp.ratelimit import openai_limiter
+    resources = client.vector_stores if resource == "vector_store" else client.files
+    try:
+        openai_limiter.call(f"{resource}s.delete", resources.with_raw_response.delete, resource_id)
+    except NotFoundError:
+        return False
+    REAPED_RESOURCES.inc(resource=resource)
+    return True
+
+
+def reap_openai_resources(min_age: float = OPENAI_REAPER_MIN_AGE, dry_run: bool = False) -> Dict[str, int]:
+    """
+    Delete orphaned vector stores, then orphaned files.
+
+    Args:
+        min_age: Resources created less than this many seconds ago are kept
+        dry_run: Only report what would be deleted
+
+    Returns:
+        Number of vector stores and files deleted, or that would be deleted
+    """
+    from webapp.llm import get_openai_client
+    client = get_openai_client()
+    orphaned_stores, orphaned_files = find_orphans(client, min_age)
+    logger.info(f"Found {len(orphaned_stores)} orphaned vector stores and {len(orphaned_files)} orphaned files")
+    if dry_run:
+        return {"vector_stores": len(orphaned_stores), "files": len(orphaned_files)}
+
+    deleted = {}
+    with ThreadPoolExecutor(max_workers=OPENAI_REAPER_CONCURRENCY) as executor:
+        # Stores first, so a store is never left pointing at a deleted file
+        for resource, resource_ids in (("vector_store", orphaned_stores), ("file", orphaned_files)):
+            results = executor.map(lambda resource_id: delete_resource(client, resource, resource_id), resource_ids)
+            deleted[f"{resource}s"] = sum(results)
+    logger.info(f"Deleted {deleted['vector_stores']} vector stores and {deleted['files']} files")
+    return deleted
+
+
+def fail_reaping(error: str, **_: Any):
+    """The next scheduled run tries again; nothing else needs to be marked failed."""
+    logger.error(f"Reaping OpenAI resources failed: {error}")
+
+
+class ReaperScheduler:
+    """Enqueues a reaper job every interval; run it in one process only."""
+
+    def __init__(self, interval: float = OPENAI_REAPER_INTERVAL):
+        self.interval = interval
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="openai-reaper-scheduler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+
+    def schedule(self):
+        queue = get_job_queue()
+        job_id = f"{REAPER_JOB_KIND}-{int(time.time() // self.interval)}"
+        if queue.get(job_id) is not None:
+            return
+        try:
+            queue.enqueue(REAPER_JOB_KIND, {}, job_id=job_id, max_attempts=1)
+        except Exception as e:
+            # Another process scheduled this interval's run first
+            logger.info(f"Reaper job {job_id} not enqueued: {str(e)}")
+
+    def _loop(self):
+        # The first run is one interval after startup, so starting a process
+        # doesn't load the OpenAI modules the reaper needs
+        while not self._stopping.wait(self.interval):
+            try:
+                self.schedule()
+            except Exception as e:
+                logger.error(f"Error scheduling reaper job: {str(e)}")
+
+
+def start_reaper_scheduler() -> Optional[ReaperScheduler]:
+    """Start scheduling the reaper, unless OPENAI_REAPER_INTERVAL is 0."""
+    if OPENAI_REAPER_INTERVAL <= 0:
+        return None
+    scheduler = ReaperScheduler()
+    scheduler.start()
+    return scheduler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Delete orphaned OpenAI files and vector stores")
+    parser.add_argument("--min-age", type=float, default=OPENAI_REAPER_MIN_AGE, help="Keep resources younger than this many seconds")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be deleted")
+    args = parser.parse_args()
+    print(reap_openai_resources(min_age=args.min_age, dry_run=args.dry_run))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,21 @@
 import json
 import os
 import logging
-import tempfile
 import time
-from typing import Dict, List, Any, TypedDict, Literal, Union, Optional
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Callable, Dict, List, Any, TypedDict, Literal, Union, Optional
+from openai import NotFoundError, OpenAI
 
-from webapp.documents import save_file_and_vector_store_ids
+from webapp.cache import EXTRACTION_CACHE_ENABLED, extraction_cache, extraction_cache_key
+from webapp.chunks import DocumentChunk
+from webapp.documents import get_file_and_vector_store_ids, save_file_and_vector_store_ids
+from webapp.metrics import EXTRACTION_GROUP_SECONDS, EXTRACTION_RETRIES, VECTOR_STORE_WAIT_SECONDS, track_stage
+from webapp.ratelimit import openai_limiter
+from webapp.retrieval import ChunkIndex, build_context, estimate_tokens
+from webapp.tasks import TaskStage
+from webapp import tracing
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -29,9 +38,52 @@ class ExtractDataParams(TypedDict):
     fields: List[DataField]
     file_ids: Optional[List[str]] = None
     vector_store_ids: Optional[List[str]] = None
+    force_refresh: Optional[bool] = None
+    # Chunks of the document, searched locally instead of a vector store when given
+    chunks: Optional[List[DocumentChunk]] = None
+    report_stage: Optional[Callable[[str], None]] = None
 
 ExtractionResult = Dict[str, str]
 
+EXTRACTION_MODEL = "gpt-4.1"
+
+# Vector store readiness polling: start fast, back off, give up at the deadline
+VECTOR_STORE_READY_TIMEOUT = float(os.getenv("VECTOR_STORE_READY_TIMEOUT", "120"))
+VECTOR_STORE_POLL_INITIAL_INTERVAL = 0.5
+VECTOR_STORE_POLL_MAX_INTERVAL = 5.0
+
+# Vector stores expire this many days after they were last used; 0 keeps them
+# until the reaper in webapp/lifecycle.py removes them
+VECTOR_STORE_EXPIRY_DAYS = int(os.getenv("VECTOR_STORE_EXPIRY_DAYS", "7"))
+# Tags the vector stores this app creates, so the reaper only touches those
+VECTOR_STORE_METADATA = {"created_by": "agenticdoc"}
+# Name of every file this app uploads, for the same reason
+OPENAI_FILE_NAME = "agenticdoc-document.md"
+
+# Markdown up to this many tokens is sent inline instead of through a vector
+# store; 0 always uses the vector store
+DIRECT_CONTEXT_MAX_TOKENS = int(os.getenv("DIRECT_CONTEXT_MAX_TOKENS", "8000"))
+
+# Large field lists are extracted in groups of EXTRACTION_GROUP_SIZE fields,
+# EXTRACTION_GROUP_CONCURRENCY groups at a time
+EXTRACTION_GROUP_SIZE = int(os.getenv("EXTRACTION_GROUP_SIZE", "20"))
+EXTRACTION_GROUP_CONCURRENCY = int(os.getenv("EXTRACTION_GROUP_CONCURRENCY", "4"))
+
+@lru_cache(maxsize=1)
+def get_openai_client() -> OpenAI:
+    """
+    Get the OpenAI client shared by the whole process, so its connection pool
+    is reused across documents and retries.
+    
+    Returns:
+        OpenAI client
+    """
+    openai_api_key = os.environ.get("OPENAI_API_KEY")
+    if not openai_api_key:
+        raise ValueError("OPENAI_API_KEY environment variable not set")
+    # Retries are left to the rate limiter, which backs off across threads
+    return OpenAI(api_key=openai_api_key, max_retries=0)
+
 def create_extractor_prompt(document_type: DocumentType, fields: List[DataField]) -> str:
     """
     Helper function to create a structured prompt for document data extraction.
@@ -87,45 +139,95 @@ def create_openai_file_from_markdown(client: OpenAI, markdown: str) -> str:
     Returns:
         File ID
     """
-    # Create a temporary file with the markdown content
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.md', delete=False) as temp_file:
-        temp_file.write(markdown)
-        temp_file_path = temp_file.name
+    # Upload the content from memory so a retried request sends it again in full
+    file_response = openai_limiter.call(
+        "files.create",
+        client.files.with_raw_response.create,
+        file=(OPENAI_FILE_NAME, markdown.encode("utf-8")),
+        purpose="assistants"
+    )
     
-    try:
-        # Create a file in OpenAI
-        with open(temp_file_path, 'rb') as file:
-            file_response = client.files.create(
-                file=file,
-                purpose="assistants"
-            )
-        
-        logger.info(f"Created file with ID: {file_response.id}")
-        return file_response.id
-    finally:
-        # Clean up the temporary file
-        os.unlink(temp_file_path)
+    logger.info(f"Created file with ID: {file_response.id}")
+    return file_response.id
 
-def create_vector_store(client: OpenAI, file_id: str, name: str = "Document Extraction") -> str:
+def create_vector_store(client: OpenAI, file_ids: List[str], name: str = "Document Extraction") -> str:
     """
-    Create a vector store with the given file.
+    Create a vector store with the given files.
     
     Args:
         client: OpenAI client
-        file_id: ID of the file to use
+        file_ids: IDs of the files to use
         name: Name of the vector store
         
     Returns:
         Vector store ID
     """
-    vector_store = client.vector_stores.create(
+    options: Dict[str, Any] = {}
+    if VECTOR_STORE_EXPIRY_DAYS > 0:
+        options["expires_after"] = {"anchor": "last_active_at", "days": VECTOR_STORE_EXPIRY_DAYS}
+    vector_store = openai_limiter.call(
+        "vector_stores.create",
+        client.vector_stores.with_raw_response.create,
         name=name,
-        file_ids=[file_id]
+        file_ids=file_ids,
+        metadata=VECTOR_STORE_METADATA,
+        **options
     )
     
     logger.info(f"Created vector store with ID: {vector_store.id}")
     return vector_store.id
 
+def is_vector_store_ready(client: OpenAI, vector_store_id: str) -> bool:
+    """
+    Check whether every file in a vector store has finished processing.
+    
+    Args:
+        client: OpenAI client
+        vector_store_id: ID of the vector store
+        
+    Returns:
+        True when the store is fully indexed
+    """
+    vector_store = openai_limiter.call("vector_stores.retrieve", client.vector_stores.with_raw_response.retrieve, vector_store_id)
+    if vector_store.file_counts.failed:
+        logger.warning("Vector store %s has %d failed files", vector_store_id, vector_store.file_counts.failed)
+    return vector_store.status == "completed" and vector_store.file_counts.in_progress == 0
+
+def wait_for_vector_stores(client: OpenAI, vector_store_ids: List[str], timeout: float = VECTOR_STORE_READY_TIMEOUT) -> float:
+    """
+    Poll vector stores until they are indexed, backing off between polls.
+    Stores that are already indexed return without sleeping. When the deadline
+    passes, extraction continues with whatever has been indexed so far.
+    
+    Args:
+        client: OpenAI client
+        vector_store_ids: IDs of the vector stores to wait for
+        timeout: Maximum number of seconds to wait
+        
+    Returns:
+        Number of seconds spent waiting
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    interval = VECTOR_STORE_POLL_INITIAL_INTERVAL
+    pending = list(vector_store_ids)
+
+    while True:
+        pending = [vector_store_id for vector_store_id in pending if not is_vector_store_ready(client, vector_store_id)]
+        if not pending:
+            break
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logger.warning("Vector stores %s not indexed after %.1fs, continuing", pending, timeout)
+            break
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, VECTOR_STORE_POLL_MAX_INTERVAL)
+
+    waited = time.monotonic() - start
+    VECTOR_STORE_WAIT_SECONDS.observe(waited)
+    logger.info("Waited %.2fs for vector stores %s", waited, vector_store_ids)
+    return waited
+
 def create_file_and_vector_store(markdown: str, document_type: DocumentType) -> Dict[str, str]:
     """
     Create a file from markdown content and a vector store with that file.
@@ -138,18 +240,13 @@ def create_file_and_vector_store(markdown: str, document_type: DocumentType) ->
         Dictionary containing file_id and vector_store_id
     """
     try:
-        openai_api_key = os.environ.get("OPENAI_API_KEY")
-        if not openai_api_key:
-            raise ValueError("OPENAI_API_KEY environment variable not set")
-        
-        # Initialize OpenAI client
-        client = OpenAI(api_key=openai_api_key)
+        client = get_openai_client()
         
         # Create a file from the markdown content
         file_id = create_openai_file_from_markdown(client, markdown)
         
         # Create a vector store with the file
-        vector_store_id = create_vector_store(client, file_id, f"{document_type} Extraction")
+        vector_store_id = create_vector_store(client, [file_id], f"{document_type} Extraction")
         
         return {
             "file_id": file_id,
@@ -159,10 +256,301 @@ def create_file_and_vector_store(markdown: str, document_type: DocumentType) ->
         logger.error("Error creating file and vector store: %s", error)
         raise error
 
+@dataclass
+class ExtractionCheckpoint:
+    """
+    OpenAI resources created so far for a document. Each step is saved on the
+    document as soon as it finishes, so a retry or restart picks up from it.
+    """
+    document_id: str
+    file_ids: List[str] = field(default_factory=list)
+    vector_store_ids: List[str] = field(default_factory=list)
+
+    @classmethod
+    def load(cls, document_id: str) -> "ExtractionCheckpoint":
+        try:
+            saved = get_file_and_vector_store_ids(document_id)
+        except Exception as db_error:
+            logger.error("Error loading extraction checkpoint for document %s: %s", document_id, db_error)
+            return cls(document_id)
+        return cls(document_id, saved["file_ids"] or [], saved["vector_store_ids"] or [])
+
+    def save(self):
+        try:
+            save_file_and_vector_store_ids(self.document_id, self.file_ids, self.vector_store_ids)
+        except Exception as db_error:
+            # Not critical: a later attempt only loses the chance to reuse the resources
+            logger.error("Error saving extraction checkpoint for document %s: %s", self.document_id, db_error)
+
+def vector_store_exists(client: OpenAI, vector_store_id: str) -> bool:
+    """Check that a vector store hasn't expired or been deleted."""
+    try:
+        vector_store = openai_limiter.call("vector_stores.retrieve", client.vector_stores.with_raw_response.retrieve, vector_store_id)
+    except NotFoundError:
+        return False
+    return vector_store.status != "expired"
+
+def file_exists(client: OpenAI, file_id: str) -> bool:
+    """Check that an uploaded file hasn't been deleted."""
+    try:
+        openai_limiter.call("files.retrieve", client.files.with_raw_response.retrieve, file_id)
+    except NotFoundError:
+        return False
+    return True
+
+def drop_expired_resources(client: OpenAI, checkpoint: ExtractionCheckpoint):
+    """
+    Forget vector stores that expired and files that were reaped since the
+    checkpoint was saved, so they get created again.
+    """
+    vector_store_ids = [vector_store_id for vector_store_id in checkpoint.vector_store_ids if vector_store_exists(client, vector_store_id)]
+    if vector_store_ids:
+        checkpoint.vector_store_ids = vector_store_ids
+        return
+    file_ids = [file_id for file_id in checkpoint.file_ids if file_exists(client, file_id)]
+    if checkpoint.vector_store_ids or file_ids != checkpoint.file_ids:
+        logger.info("Resources of document %s expired, creating them again", checkpoint.document_id)
+    checkpoint.vector_store_ids = []
+    checkpoint.file_ids = file_ids
+
+def prepare_vector_stores(client: OpenAI, checkpoint: ExtractionCheckpoint, markdown: str, document_type: DocumentType):
+    """
+    Upload the markdown and create its vector store, skipping the steps the
+    checkpoint already has a result for.
+    
+    Args:
+        client: OpenAI client
+        checkpoint: Resources created so far, updated and saved after each step
+        markdown: Markdown content of the document
+        document_type: Type of document
+    """
+    if checkpoint.file_ids or checkpoint.vector_store_ids:
+        drop_expired_resources(client, checkpoint)
+
+    if not checkpoint.file_ids:
+        try:
+            checkpoint.file_ids = [create_openai_file_from_markdown(client, markdown)]
+        except Exception as file_error:
+            logger.error("Error creating OpenAI file: %s", file_error)
+            raise Exception(f"Failed to create OpenAI file: {str(file_error)}")
+        checkpoint.save()
+
+    if not checkpoint.vector_store_ids:
+        try:
+            checkpoint.vector_store_ids = [create_vector_store(client, checkpoint.file_ids, f"{document_type} Extraction")]
+        except Exception as vector_error:
+            logger.error("Error creating vector store: %s", vector_error)
+            raise Exception(f"Failed to create vector store: {str(vector_error)}")
+        checkpoint.save()
+
+def create_extraction_schema(fields: List[DataField]) -> Dict[str, Any]:
+    """
+    Build the JSON schema of the extraction result from the requested fields,
+    for structured output.
+    
+    Args:
+        fields: List of fields to extract
+        
+    Returns:
+        JSON schema with one string property per field
+    """
+    return {
+        "type": "object",
+        "properties": {
+            field["id"]: {
+                "type": "string",
+                "description": f"{field['name']} - {field['description']}"
+            }
+            for field in fields
+        },
+        "required": [field["id"] for field in fields],
+        "additionalProperties": False
+    }
+
+def request_file_search_extraction(client: OpenAI, prompt: str, vector_store_ids: List[str]) -> Any:
+    """Ask the model to extract the fields, searching the document in its vector stores."""
+    return openai_limiter.call(
+        "responses.create",
+        client.responses.with_raw_response.create,
+        model=EXTRACTION_MODEL,
+        tools=[{
+            "type": "file_search",
+            "vector_store_ids": vector_store_ids,
+            "max_num_results": 50
+        }],
+        input=prompt
+    )
+
+def request_direct_extraction(client: OpenAI, prompt: str, markdown: str, fields: List[DataField]) -> Any:
+    """Ask the model to extract the fields from the markdown sent inline, as structured output."""
+    return openai_limiter.call(
+        "responses.create",
+        client.responses.with_raw_response.create,
+        model=EXTRACTION_MODEL,
+        instructions=prompt,
+        input=f"Document content:\n\n{markdown}",
+        text={
+            "format": {
+                "type": "json_schema",
+                "name": "extracted_fields",
+                "schema": create_extraction_schema(fields),
+                "strict": True
+            }
+        }
+    )
+
+def parse_extraction_response(response: Any, fields: List[DataField]) -> ExtractionResult:
+    """
+    Map the JSON object in a Responses API reply onto the requested fields.
+    
+    Args:
+        response: Response of the OpenAI Responses API
+        fields: List of fields that were requested
+        
+    Returns:
+        Dictionary with extracted field values, empty for fields that weren't found
+    """
+    logger.debug("Raw OpenAI API response: %s", response)
+    
+    # Check if the response has the expected structure
+    if hasattr(response, 'output') and isinstance(response.output, list):
+        # Find the message output that contains the content
+        for output_item in response.output:
+            if getattr(output_item, 'type', None) != 'message' or getattr(output_item, 'status', None) != 'completed':
+                continue
+            for content_item in getattr(output_item, 'content', None) or []:
+                if getattr(content_item, 'type', None) != 'output_text' or not hasattr(content_item, 'text'):
+                    continue
+                content = content_item.text
+                logger.debug("OpenAI response content: %s", content)
+                
+                clean_content = content.replace("```json", "").replace("```", "").strip()
+                
+                try:
+                    extracted_data = json.loads(clean_content)
+                except json.JSONDecodeError as e:
+                    logger.error("Error parsing JSON from OpenAI response: %s", e)
+                    raise Exception("Failed to parse extracted data")
+                logger.debug("Parsed JSON data from OpenAI: %s", extracted_data)
+                
+                result: ExtractionResult = {}
+                for field in fields:
+                    result[field["id"]] = extracted_data.get(field["id"], "")
+                
+                return result
+    
+    raise Exception("No valid response data received from OpenAI API")
+
+def split_field_groups(fields: List[DataField], group_size: int = EXTRACTION_GROUP_SIZE) -> List[List[DataField]]:
+    """Split a field list into groups of at most group_size fields, keeping their order."""
+    group_size = max(1, group_size)
+    return [fields[index:index + group_size] for index in range(0, len(fields), group_size)]
+
+def extraction_mode(vector_store_ids: Optional[List[str]], index: Optional[ChunkIndex]) -> str:
+    """Label of how the document reaches the model, for metrics."""
+    if index is not None:
+        return "retrieval"
+    return "direct" if vector_store_ids is None else "file_search"
+
+def extract_field_group(
+    client: OpenAI,
+    document_type: DocumentType,
+    fields: List[DataField],
+    markdown: str,
+    vector_store_ids: Optional[List[str]],
+    index: Optional[ChunkIndex] = None
+) -> ExtractionResult:
+    """
+    Extract one group of fields from a document.
+    
+    Args:
+        client: OpenAI client
+        document_type: Type of document
+        fields: Fields of the group
+        markdown: Markdown content of the document
+        vector_store_ids: Vector stores to search, or None to send the markdown inline
+        index: Chunks of the document; when given, the ones matching the fields are sent inline instead
+        
+    Returns:
+        Dictionary with extracted values of the group's fields
+    """
+    # Create a formatted prompt for the OpenAI API
+    prompt = create_extractor_prompt(document_type, fields)
+    logger.debug("Created prompt for OpenAI: %s", prompt)
+    
+    mode = extraction_mode(vector_store_ids, index)
+    start = time.monotonic()
+    try:
+        try:
+            if index is not None:
+                response = request_direct_extraction(client, prompt, build_context(index, fields), fields)
+            elif vector_store_ids is None:
+                response = request_direct_extraction(client, prompt, markdown, fields)
+            else:
+                response = request_file_search_extraction(client, prompt, vector_store_ids)
+        except Exception as api_error:
+            logger.error("OpenAI API connection error: %s", api_error)
+            if "Connection" in str(api_error):
+                logger.error("Network connectivity issue detected. Check firewall, proxy settings, or network configuration.")
+            elif "timeout" in str(api_error).lower():
+                logger.error("Request timed out. Check network latency or increase timeout settings.")
+            elif "rate_limit" in str(api_error).lower():
+                logger.error("Rate limit exceeded after backing off. Lower OPENAI_REQUESTS_PER_MINUTE or OPENAI_MAX_CONCURRENCY.")
+            raise Exception(f"OpenAI API error: {str(api_error)}")
+        
+        # Process the extraction results
+        return parse_extraction_response(response, fields)
+    finally:
+        elapsed = time.monotonic() - start
+        EXTRACTION_GROUP_SECONDS.observe(elapsed, mode=mode)
+        logger.info("Extracted a group of %d fields (%s) in %.2fs", len(fields), mode, elapsed)
+
+def extract_field_groups(
+    client: OpenAI,
+    document_type: DocumentType,
+    groups: List[List[DataField]],
+    markdown: str,
+    vector_store_ids: Optional[List[str]],
+    result: ExtractionResult,
+    index: Optional[ChunkIndex] = None
+) -> List[List[DataField]]:
+    """
+    Extract several field groups concurrently against the same document,
+    merging each group that succeeds into result.
+    
+    Returns:
+        The groups that failed
+    """
+    def run(group: List[DataField]) -> ExtractionResult:
+        return extract_field_group(client, document_type, group, markdown, vector_store_ids, index)
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, min(EXTRACTION_GROUP_CONCURRENCY, len(groups)))) as executor:
+        futures = [executor.submit(tracing.bind_context(run), group) for group in groups]
+        for group, future in zip(groups, futures):
+            try:
+                result.update(future.result())
+            except Exception as error:
+                logger.warning("Field group %s failed: %s", [field["id"] for field in group], error)
+                failed.append(group)
+    return failed
+
 def extract_data_from_document(params: ExtractDataParams) -> ExtractionResult:
     """
-    Extract data from a document using OpenAI's API with vector store.
-    Will retry up to 2 times in case of errors.
+    Extract data from a document using OpenAI's API.
+    Will retry up to 2 times in case of errors. Results are cached by markdown,
+    document type and field set; set force_refresh to bypass the cache.
+    
+    Markdown under DIRECT_CONTEXT_MAX_TOKENS is sent inline with a JSON schema
+    for the fields. For larger markdown, when the document's chunks are given,
+    the chunks matching each field group are found locally and sent inline.
+    Otherwise the markdown is uploaded to a vector store and searched. That
+    path is resumable: the uploaded file and the vector store are saved on the
+    document as soon as they exist, and retries, including a retry of the
+    whole job after a restart, reuse them instead of creating new ones.
+    
+    Fields are extracted in groups of EXTRACTION_GROUP_SIZE, concurrently, and
+    a retry only asks again for the groups that failed.
     
     Args:
         params: Dictionary containing markdown, documentType, and fields
@@ -174,119 +562,76 @@ def extract_data_from_document(params: ExtractDataParams) -> ExtractionResult:
     document_type = params["document_type"]
     fields = params["fields"]
     document_id = params["document_id"]
+    report_stage = params.get("report_stage") or (lambda stage: None)
+
+    cache_key = extraction_cache_key(markdown, document_type, fields, EXTRACTION_MODEL)
+    if EXTRACTION_CACHE_ENABLED and not params.get("force_refresh"):
+        cached_result = extraction_cache.get(cache_key)
+        if cached_result is not None:
+            logger.info("Extraction cache hit for document %s", document_id)
+            return cached_result
     
-    # Create a formatted prompt for the OpenAI API
-    prompt = create_extractor_prompt(document_type, fields)
-    logger.info("Created prompt for OpenAI: %s", prompt)
-    logger.info("Markdown to be processed: %s", markdown)
+    logger.info("Extracting %d fields from %d characters of markdown for document %s", len(fields), len(markdown), document_id)
+    
+    direct_context = estimate_tokens(markdown) <= DIRECT_CONTEXT_MAX_TOKENS
+    checkpoint = None
+    index = None
+    if direct_context:
+        logger.info("Sending document %s inline (about %d tokens)", document_id, estimate_tokens(markdown))
+    elif params.get("chunks"):
+        index = ChunkIndex(params["chunks"])
+        logger.info("Sending the chunks of document %s matching each field group, out of %d", document_id, len(index))
+    elif params.get("file_ids") or params.get("vector_store_ids"):
+        # The caller already has them recorded on the document
+        checkpoint = ExtractionCheckpoint(document_id, params.get("file_ids") or [], params.get("vector_store_ids") or [])
+    else:
+        # Resume from an earlier run of this document, if any
+        checkpoint = ExtractionCheckpoint.load(document_id)
+        if checkpoint.file_ids:
+            logger.info("Resuming extraction for document %s with files %s and vector stores %s", document_id, checkpoint.file_ids, checkpoint.vector_store_ids)
+    
+    groups = split_field_groups(fields)
+    result: ExtractionResult = {}
     
     max_retries = 2
     retry_count = 0
     
     while retry_count <= max_retries:
         try:
-            openai_api_key = os.environ.get("OPENAI_API_KEY")
-            if not openai_api_key:
-                raise ValueError("OPENAI_API_KEY environment variable not set")
-            
-            # Initialize OpenAI client
-            client = OpenAI(api_key=openai_api_key)
+            client = get_openai_client()
             
-            # Create a file from the markdown content
-            file_ids = []
-            vector_store_ids = []
-            if params.get("file_ids") is None:
-                try:
-                    file_id = create_openai_file_from_markdown(client, markdown)
-                    file_ids.append(file_id)
-                except Exception as file_error:
-                    logger.error("Error creating OpenAI file: %s", file_error)
-                    raise Exception(f"Failed to create OpenAI file: {str(file_error)}")
-            else:
-                file_ids = params.get("file_ids")
-            
-            # Create a vector store with the file
-            if params.get("vector_store_ids") is None:
-                try:
-                    vector_store_id = create_vector_store(client, file_id, f"{document_type} Extraction")
-                    vector_store_ids.append(vector_store_id)
-                except Exception as vector_error:
-                    logger.error("Error creating vector store: %s", vector_error)
-                    raise Exception(f"Failed to create vector store: {str(vector_error)}")
-            else:
-                vector_store_ids = params.get("vector_store_ids")
+            if checkpoint is not None:
+                # Upload the markdown and index it, unless an earlier attempt already did
+                report_stage(TaskStage.INDEXING)
+                with track_stage("indexing"):
+                    prepare_vector_stores(client, checkpoint, markdown, document_type)
+                
+                with track_stage("vector_store_wait"):
+                    wait_for_vector_stores(client, checkpoint.vector_store_ids)
 
-            # save the file id and  vector store id to the database
-            try:
-                save_file_and_vector_store_ids(document_id, file_ids, vector_store_ids)
-            except Exception as db_error:
-                logger.error("Error saving to database: %s", db_error)
-                # Continue execution as this is not critical
-            
-            # Make the API request with vector store
-            time.sleep(30)
-            try:
-                response = client.responses.create(
-                    model="gpt-4.1",
-                    tools=[{
-                        "type": "file_search",
-                        "vector_store_ids": vector_store_ids,
-                        "max_num_results": 50
-                    }],
-                    input=prompt
-                )
-            except Exception as api_error:
-                logger.error("OpenAI API connection error: %s", api_error)
-                if "Connection" in str(api_error):
-                    logger.error("Network connectivity issue detected. Check firewall, proxy settings, or network configuration.")
-                elif "timeout" in str(api_error).lower():
-                    logger.error("Request timed out. Check network latency or increase timeout settings.")
-                elif "rate_limit" in str(api_error).lower():
-                    logger.error("Rate limit exceeded. Implement backoff strategy or reduce request frequency.")
-                raise Exception(f"OpenAI API error: {str(api_error)}")
-            
-            logger.info("Raw OpenAI API response: %s", response)
-            
-            # Process the extraction results
-            result: ExtractionResult = {}
-            
-            # Check if the response has the expected structure
-            if hasattr(response, 'output') and isinstance(response.output, list):
-                # Find the message output that contains the content
-                for output_item in response.output:
-                    if hasattr(output_item, 'type') and hasattr(output_item, 'status'):
-                        if output_item.type == 'message' and output_item.status == 'completed':
-                            # Extract the content from the message
-                            if hasattr(output_item, 'content'):
-                                content_items = output_item.content
-                                for content_item in content_items:
-                                    if hasattr(content_item, 'type') and content_item.type == 'output_text':
-                                        if hasattr(content_item, 'text'):
-                                            content = content_item.text
-                                            logger.info("OpenAI response content: %s", content)
-                                            
-                                            clean_content = content.replace("```json", "").replace("```", "").strip()
-                                            logger.info("Cleaned content for parsing: %s", clean_content)
-                                            
-                                            try:
-                                                extracted_data = json.loads(clean_content)
-                                                logger.info("Parsed JSON data from OpenAI: %s", extracted_data)
-                                                
-                                                for field in fields:
-                                                    result[field["id"]] = extracted_data.get(field["id"], "")
-                                                
-                                                logger.info("Final mapped extraction results: %s", result)
-                                                return result
-                                            except json.JSONDecodeError as e:
-                                                logger.error("Error parsing JSON from OpenAI response: %s", e)
-                                                raise Exception("Failed to parse extracted data")
+            # Make the API requests, with the document inline or in the vector store
+            report_stage(TaskStage.EXTRACTING)
+            vector_store_ids = checkpoint.vector_store_ids if checkpoint is not None else None
+            if len(groups) == 1:
+                result.update(extract_field_group(client, document_type, groups[0], markdown, vector_store_ids, index))
+                groups = []
+            else:
+                groups = extract_field_groups(client, document_type, groups, markdown, vector_store_ids, result, index)
+                if groups:
+                    raise Exception(f"{len(groups)} field groups failed to extract")
             
-            raise Exception("No valid response data received from OpenAI API")
+            # Keep the requested field order
+            result = {field["id"]: result.get(field["id"], "") for field in fields}
+            logger.debug("Final mapped extraction results: %s", result)
+            if EXTRACTION_CACHE_ENABLED:
+                extraction_cache.set(cache_key, result)
+            return result
             
         except Exception as error:
             retry_count += 1
             if retry_count > max_retries:
                 logger.error("Error in OpenAI extraction process after %d retries: %s", max_retries, error)
                 raise error
+            EXTRACTION_RETRIES.inc(mode=extraction_mode(checkpoint.vector_store_ids if checkpoint is not None else None, index))
             logger.warning("Attempt %d failed, retrying... Error: %s", retry_count, error)
-            continue 
\ No newline at end of file
+            continue
@@ -0,0 +1,295 @@
+"""
+In-process metrics for the document processing pipeline, exposed in the
+Prometheus text format on /metrics: by the API, and by standalone workers on a
+listener of their own (see start_metrics_server).
+
+Label values must come from small fixed sets (stages, engines, outcomes, job
+kinds), never from IDs, file names or error messages.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from webapp import tracing
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+BYTES_BUCKETS = (10_000, 100_000, 500_000, 1_000_000, 5_000_000, 10_000_000, 25_000_000, 50_000_000, 100_000_000)
+PAGES_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, description: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def _label_values(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(self, values: LabelValues, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+        pairs = list(zip(self.labelnames, values)) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+    def samples(self) -> List[str]:
+        """Sample lines of the metric in the Prometheus text format."""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.type}"]
+        return "\n".join(lines + self.samples())
+
+
+class Counter(Metric):
+    """A monotonically increasing count, one series per label combination."""
+
+    type = "counter"
+
+    def __init__(self, name: str, description: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, description, labelnames)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = self._label_values(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def get(self, **labels: str) -> float:
+        return self.values.get(self._label_values(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self.values.items())
+        return [f"{self.name}{self._format_labels(key)} {value}" for key, value in values]
+
+
+class Histogram(Metric):
+    """Cumulative bucketed observations, one series per label combination."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, description: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, description, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.counts: Dict[LabelValues, list] = {}
+        self.sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._label_values(labels)
+        with self._lock:
+            counts = self.counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            counts[-1] += 1
+            self.sums[key] = self.sums.get(key, 0.0) + value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe the duration of the block in seconds."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            series = [(key, list(counts), self.sums[key]) for key, counts in self.counts.items()]
+        lines = []
+        for key, counts, total in series:
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{self._format_labels(key, (('le', repr(float(bound))),))} {count}")
+            lines.append(f"{self.name}_bucket{self._format_labels(key, (('le', '+Inf'),))} {counts[-1]}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {counts[-1]}")
+        return lines
+
+
+class Gauge(Metric):
+    """A value that goes up and down, one series per label combination."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, description: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, description, labelnames)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = self._label_values(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str):
+        key = self._label_values(labels)
+        with self._lock:
+            self.values[key] = value
+
+    def get(self, **labels: str) -> float:
+        return self.values.get(self._label_values(labels), 0.0)
+
+    @contextmanager
+    def track_inprogress(self, **labels: str) -> Iterator[None]:
+        """Count the block as in progress while it runs."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self.values.items())
+        return [f"{self.name}{self._format_labels(key)} {value}" for key, value in values]
+
+
+REGISTRY: Dict[str, Metric] = {}
+
+
+def render_prometheus() -> str:
+    """Every registered metric in the Prometheus text exposition format."""
+    return "\n".join(metric.render() for metric in list(REGISTRY.values())) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """
+    Serve /metrics on a port of its own, from a daemon thread, for processes
+    without the API such as standalone workers.
+
+    Args:
+        port: Port to listen on, 0 for any free port
+        host: Address to listen on
+
+    Returns:
+        The running server; its server_address has the port it got
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+VECTOR_STORE_WAIT_SECONDS = Histogram(
+    "agenticdoc_vector_store_wait_seconds",
+    "Time spent waiting for OpenAI vector stores to finish indexing"
+)
+
+EXTRACTION_GROUP_SECONDS = Histogram(
+    "agenticdoc_extraction_group_seconds",
+    "Time to extract one group of fields from a document, by mode",
+    ["mode"]
+)
+
+STAGE_SECONDS = Histogram(
+    "agenticdoc_stage_seconds",
+    "Time spent in each stage of the document pipeline",
+    ["stage"]
+)
+STAGE_FAILURES = Counter(
+    "agenticdoc_stage_failures_total",
+    "Stages of the document pipeline that raised, by stage",
+    ["stage"]
+)
+ENGINE_PARSE_SECONDS = Histogram(
+    "agenticdoc_engine_parse_seconds",
+    "Time each parsing engine took per document, by engine and outcome",
+    ["engine", "outcome"]
+)
+DOCUMENT_BYTES = Histogram(
+    "agenticdoc_document_bytes",
+    "Size of processed documents in bytes",
+    buckets=BYTES_BUCKETS
+)
+DOCUMENT_PAGES = Histogram(
+    "agenticdoc_document_pages",
+    "Page count of processed PDFs",
+    buckets=PAGES_BUCKETS
+)
+EXTRACTION_RETRIES = Counter(
+    "agenticdoc_extraction_retries_total",
+    "Extraction attempts that failed and were retried, by mode",
+    ["mode"]
+)
+JOBS_IN_FLIGHT = Gauge(
+    "agenticdoc_jobs_in_flight",
+    "Background jobs running in this process, by kind",
+    ["kind"]
+)
+JOB_SECONDS = Histogram(
+    "agenticdoc_job_seconds",
+    "Duration of background job attempts, by kind and outcome",
+    ["kind", "outcome"]
+)
+JOB_QUEUE_DEPTH = Gauge(
+    "agenticdoc_job_queue_depth",
+    "Jobs waiting in the queue, as last counted for admission control"
+)
+JOB_QUEUE_WAIT_SECONDS = Histogram(
+    "agenticdoc_job_queue_wait_seconds",
+    "Time new jobs waited in the queue before a worker claimed them, by kind",
+    ["kind"]
+)
+JOBS_REJECTED = Counter(
+    "agenticdoc_jobs_rejected_total",
+    "Requests turned away with 429 because the job queue was full, by endpoint",
+    ["endpoint"]
+)
+CPU_TASKS_IN_FLIGHT = Gauge(
+    "agenticdoc_cpu_tasks_in_flight",
+    "CPU-bound tasks submitted to the process pool and not finished, by task",
+    ["task"]
+)
+CPU_TASK_WAIT_SECONDS = Histogram(
+    "agenticdoc_cpu_task_wait_seconds",
+    "Time CPU-bound tasks waited for a free worker process, by task",
+    ["task"]
+)
+CPU_TASK_SECONDS = Histogram(
+    "agenticdoc_cpu_task_seconds",
+    "Duration of CPU-bound tasks including the wait for a worker process, by task",
+    ["task"]
+)
+
+
+@contextmanager
+def track_stage(stage: str) -> Iterator[None]:
+    """Time a pipeline stage, record it as a trace span, and count it as failed if the block raises."""
+    start = time.monotonic()
+    try:
+        with tracing.span(f"stage {stage}"):
+            yield
+    except Exception:
+        STAGE_FAILURES.inc(stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.monotonic() - start, stage=stage)
@@ -1,7 +1,47 @@
-import requests
+import asyncio
+import logging
 import os
+import threading
+from typing import Any, Coroutine, Dict, List, Optional, TypeVar
 
-def create_mistral_ocr_request(document_url: str):
+import httpx
+
+from webapp import tracing
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+MISTRAL_OCR_URL = os.getenv("MISTRAL_OCR_URL", "https://api.mistral.ai/v1/ocr")
+MISTRAL_CONNECT_TIMEOUT = float(os.getenv("MISTRAL_CONNECT_TIMEOUT", "10"))
+MISTRAL_READ_TIMEOUT = float(os.getenv("MISTRAL_READ_TIMEOUT", "180"))
+# Most OCR requests in flight at once, across every worker thread of the process
+MISTRAL_MAX_CONCURRENCY = int(os.getenv("MISTRAL_MAX_CONCURRENCY", "4"))
+MISTRAL_MAX_CONNECTIONS = int(os.getenv("MISTRAL_MAX_CONNECTIONS", "10"))
+
+
+class MistralOCRError(Exception):
+    """Raised when the Mistral OCR API call fails."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class MistralOCRTimeout(MistralOCRError):
+    """Raised when the Mistral OCR API doesn't answer in time."""
+
+
+class MistralOCRRateLimited(MistralOCRError):
+    """Raised when the Mistral OCR API rejects the request with 429."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message, status_code=429)
+        self.retry_after = retry_after
+
+
+def create_mistral_ocr_request(document_url: str, pages: Optional[List[int]] = None):
     body = {
         "model": "mistral-ocr-latest",
         "document": {
@@ -10,40 +50,141 @@ def create_mistral_ocr_request(document_url: str):
         },
         "include_image_base64": False
     }
+    if pages is not None:
+        # Zero-based page indices to OCR; the whole document when omitted
+        body["pages"] = pages
     return body
 
 
 def format_mistral_ocr_response(response_data):
     """
     Format the Mistral OCR response by combining markdown from all pages with double newlines.
-    
+
     Args:
         response_data (dict): The JSON response from Mistral OCR API
-        
+
     Returns:
         str: Combined markdown with double newlines between pages
     """
     if not response_data.get('pages'):
         return ""
-        
+
     markdown_parts = []
     for page in response_data['pages']:
         if page.get('markdown'):
             markdown_parts.append(page['markdown'])
-    
+
     return "\n\n".join(markdown_parts).strip()
 
-def get_mistral_ocr_response(document_url: str):
-    request_url = 'https://api.mistral.ai/v1/ocr'
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': f'Bearer {os.getenv("VITE_MISTRAL_API_KEY")}'
-    }
 
-    body = create_mistral_ocr_request(document_url)
+class MistralOCRClient:
+    """
+    Async Mistral OCR client with a pooled keep-alive connection, connect and
+    read timeouts, and a cap on requests in flight.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        url: str = MISTRAL_OCR_URL,
+        max_concurrency: int = MISTRAL_MAX_CONCURRENCY
+    ):
+        self.api_key = api_key or os.getenv("VITE_MISTRAL_API_KEY")
+        self.url = url
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(MISTRAL_READ_TIMEOUT, connect=MISTRAL_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=MISTRAL_MAX_CONNECTIONS, max_keepalive_connections=MISTRAL_MAX_CONNECTIONS),
+            headers={"Authorization": f"Bearer {self.api_key}"}
+        )
+
+    async def ocr(self, document_url: str, pages: Optional[List[int]] = None, headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """
+        Run OCR on a document.
+
+        Args:
+            document_url: Public URL of the document
+            pages: Zero-based page indices to OCR (optional, all pages by default)
+            headers: Extra request headers, such as the trace context (optional)
+
+        Returns:
+            The JSON response of the Mistral OCR API
+
+        Raises:
+            MistralOCRTimeout: If the request timed out
+            MistralOCRRateLimited: If the API answered 429
+            MistralOCRError: For any other failure
+        """
+        body = create_mistral_ocr_request(document_url, pages)
+        async with self._semaphore:
+            try:
+                response = await self._client.post(self.url, json=body, headers=headers)
+            except httpx.TimeoutException as e:
+                raise MistralOCRTimeout(f"Mistral OCR request timed out: {str(e)}") from e
+            except httpx.HTTPError as e:
+                raise MistralOCRError(f"Mistral OCR request failed: {str(e)}") from e
+
+        if response.status_code == 429:
+            try:
+                retry_after = float(response.headers["retry-after"])
+            except (KeyError, ValueError):
+                retry_after = None
+            raise MistralOCRRateLimited("Mistral OCR rate limit exceeded", retry_after=retry_after)
+        if response.status_code >= 400:
+            raise MistralOCRError(
+                f"Mistral OCR returned {response.status_code}: {response.text[:500]}",
+                status_code=response.status_code
+            )
+        try:
+            return response.json()
+        except ValueError as e:
+            raise MistralOCRError(f"Mistral OCR returned invalid JSON: {str(e)}", status_code=response.status_code) from e
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+class _ClientLoop:
+    """
+    Event loop on a background thread that owns the shared OCR client, so
+    worker threads share one connection pool and one concurrency limit.
+    """
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._client: Optional[MistralOCRClient] = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="mistral-ocr-loop", daemon=True).start()
+            return self._loop
+
+    def run(self, coroutine: Coroutine[Any, Any, T]) -> T:
+        return asyncio.run_coroutine_threadsafe(coroutine, self._ensure_started()).result()
+
+    async def _get_client(self) -> MistralOCRClient:
+        if self._client is None:
+            self._client = MistralOCRClient()
+        return self._client
+
+    def ocr(self, document_url: str, pages: Optional[List[int]] = None) -> Dict[str, Any]:
+        # The loop thread doesn't see the caller's context, so the trace goes along as headers
+        with tracing.span("mistral ocr", kind="client", pages=len(pages) if pages else 0):
+            headers = tracing.inject_headers()
+
+            async def run_ocr() -> Dict[str, Any]:
+                client = await self._get_client()
+                return await client.ocr(document_url, pages, headers)
+            return self.run(run_ocr())
+
+
+_client_loop = _ClientLoop()
 
-    response = requests.post(request_url, headers=headers, json=body)
 
-    result = response.json()
-    print("✅ Mistral OCR response: ", result)
+def get_mistral_ocr_response(document_url: str, pages: Optional[List[int]] = None):
+    result = _client_loop.ocr(document_url, pages)
+    logger.info(f"✅ Mistral OCR returned {len(result.get('pages') or [])} pages")
     return format_mistral_ocr_response(result)
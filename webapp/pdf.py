@@ -0,0 +1,48 @@
+"""
+CPU-bound PDF reading and splitting.
+
+These functions run in the CPU executor's worker processes (see
+webapp/executor.py), so this module only imports what they need.
+"""
+import os
+from dataclasses import dataclass
+from typing import List
+
+from PyPDF2 import PdfReader, PdfWriter
+
+
+@dataclass
+class PageRange:
+    # Zero-based, end exclusive
+    start: int
+    end: int
+
+
+def count_pdf_pages(file_path: str) -> int:
+    """Return the number of pages of a PDF, raising if it can't be read."""
+    return len(PdfReader(file_path).pages)
+
+
+def split_pdf(file_path: str, ranges: List[PageRange], output_dir: str) -> List[str]:
+    """
+    Write each page range of a PDF to its own file.
+
+    Args:
+        file_path: Path of the PDF
+        ranges: Page ranges to extract
+        output_dir: Directory for the shard files
+
+    Returns:
+        Paths of the shard files, in the order of ranges
+    """
+    reader = PdfReader(file_path)
+    shard_paths = []
+    for index, page_range in enumerate(ranges):
+        writer = PdfWriter()
+        for page_number in range(page_range.start, page_range.end):
+            writer.add_page(reader.pages[page_number])
+        shard_path = os.path.join(output_dir, f"shard-{index:04d}.pdf")
+        with open(shard_path, "wb") as shard_file:
+            writer.write(shard_file)
+        shard_paths.append(shard_path)
+    return shard_paths
@@ -0,0 +1,206 @@
+"""
+Process-wide rate limiting and backoff for OpenAI API calls.
+
+Every call goes through a token bucket, which caps requests per minute, and a
+semaphore, which caps requests in flight. A 429 pauses the bucket for every
+thread until the Retry-After delay has passed, and a response reporting zero
+remaining requests pauses it until the rate limit window resets. Rate limits,
+timeouts, connection errors and 5xx responses are retried with exponential
+backoff and full jitter.
+"""
+import logging
+import os
+import random
+import re
+import threading
+import time
+from typing import Any, Callable, Mapping, Optional
+
+import openai
+
+from webapp import tracing
+from webapp.metrics import Counter, Gauge, Histogram
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+OPENAI_REQUESTS_PER_MINUTE = float(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "500"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+OPENAI_MAX_ATTEMPTS = int(os.getenv("OPENAI_MAX_ATTEMPTS", "5"))
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "1"))
+OPENAI_BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", "60"))
+
+OPENAI_QUEUE_DEPTH = Gauge(
+    "agenticdoc_openai_queue_depth",
+    "OpenAI calls waiting for the rate limiter"
+)
+OPENAI_WAIT_SECONDS = Histogram(
+    "agenticdoc_openai_rate_limit_wait_seconds",
+    "Time OpenAI calls spent waiting for the rate limiter, by operation",
+    ["operation"]
+)
+OPENAI_RETRIES = Counter(
+    "agenticdoc_openai_retries_total",
+    "OpenAI calls retried, by operation and reason",
+    ["operation", "reason"]
+)
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError
+)
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parse a rate limit reset duration such as "20ms", "1s" or "6m0s" into seconds."""
+    if not value:
+        return None
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def retry_after_from_headers(headers: Mapping[str, str]) -> Optional[float]:
+    """Seconds the server asked us to wait, from Retry-After or the rate limit reset headers."""
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return parse_duration(headers.get("x-ratelimit-reset-requests"))
+
+
+def backoff_delay(attempt: int, base: float = OPENAI_BACKOFF_BASE, cap: float = OPENAI_BACKOFF_MAX) -> float:
+    """Exponential backoff with full jitter for the given attempt, counting from 1."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class TokenBucket:
+    """
+    Token bucket that callers reserve from. Tokens may go negative, in which
+    case each caller waits for its share of the refill, so waiting callers are
+    served in arrival order instead of stampeding when tokens come back.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity if capacity is not None else max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.paused_until = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self) -> float:
+        """Take a token and return the number of seconds to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.paused_until - now)
+
+    def pause(self, seconds: float):
+        """Hold back every caller for the given number of seconds, without a burst afterwards."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens = min(self.tokens, 0.0)
+            self.paused_until = max(self.paused_until, now + seconds)
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        requests_per_minute: float = OPENAI_REQUESTS_PER_MINUTE,
+        max_concurrency: int = OPENAI_MAX_CONCURRENCY,
+        max_attempts: int = OPENAI_MAX_ATTEMPTS
+    ):
+        self.bucket = TokenBucket(requests_per_minute)
+        self.max_attempts = max_attempts
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+
+    def _acquire(self, operation: str):
+        OPENAI_QUEUE_DEPTH.inc()
+        start = time.monotonic()
+        try:
+            wait = self.bucket.reserve()
+            if wait > 0:
+                time.sleep(wait)
+            self._semaphore.acquire()
+        finally:
+            OPENAI_QUEUE_DEPTH.dec()
+            OPENAI_WAIT_SECONDS.observe(time.monotonic() - start, operation=operation)
+
+    def _observe_headers(self, headers: Mapping[str, str]):
+        if headers.get("x-ratelimit-remaining-requests") == "0":
+            reset = parse_duration(headers.get("x-ratelimit-reset-requests"))
+            if reset:
+                logger.info("OpenAI request quota exhausted, pausing for %.2fs", reset)
+                self.bucket.pause(reset)
+
+    def call(self, operation: str, method: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        Call an OpenAI API method under the rate limiter, retrying transient failures.
+
+        Args:
+            operation: Name of the call, used as the metrics label
+            method: A `with_raw_response` method of the OpenAI client, so rate limit headers can be read
+            *args, **kwargs: Arguments of the method
+
+        Returns:
+            The parsed response of the method
+
+        Raises:
+            openai.OpenAIError: If the call failed with a non-retryable error, or every attempt failed
+        """
+        with tracing.span(f"openai {operation}", kind="client") as span:
+            if span is not None:
+                kwargs["extra_headers"] = tracing.inject_headers(kwargs.get("extra_headers"))
+            return self._call(operation, span, method, *args, **kwargs)
+
+    def _call(self, operation: str, span: Optional[tracing.Span], method: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        attempt = 0
+        while True:
+            attempt += 1
+            if span is not None:
+                span.set_attribute("attempts", attempt)
+            self._acquire(operation)
+            try:
+                raw_response = method(*args, **kwargs)
+            except RETRYABLE_ERRORS as error:
+                if attempt >= self.max_attempts:
+                    raise
+                delay = backoff_delay(attempt)
+                if isinstance(error, openai.RateLimitError):
+                    reason = "rate_limit"
+                    retry_after = retry_after_from_headers(error.response.headers)
+                    if retry_after is not None:
+                        delay = retry_after
+                    # Every thread waits out a rate limit, not just this one
+                    self.bucket.pause(delay)
+                else:
+                    reason = "timeout" if isinstance(error, openai.APITimeoutError) else "error"
+                OPENAI_RETRIES.inc(operation=operation, reason=reason)
+                logger.warning("OpenAI %s attempt %d failed (%s), retrying in %.2fs", operation, attempt, error, delay)
+            else:
+                self._observe_headers(raw_response.headers)
+                return raw_response.parse()
+            finally:
+                self._semaphore.release()
+            if reason != "rate_limit":
+                time.sleep(delay)
+
+
+openai_limiter = RateLimiter()
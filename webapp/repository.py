@@ -0,0 +1,192 @@
+"""
+Document repository over the documents and agentic_doc_jobs tables.
+
+Reads fetch a document together with its agentic-doc job in one request,
+through a PostgREST embedded select. Writes made during one pipeline
+transition are buffered, merged per row, and sent when the transition ends,
+so a transition costs one write per row instead of one per update. Rows are
+written in the order they were first updated, so callers update the
+agentic_doc_jobs row before the document whose status points readers at it.
+"""
+import logging
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from webapp import tracing
+from webapp.chunks import CHUNK_STORAGE_ENABLED
+from webapp.db import get_supabase_client
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DOCUMENT_COLUMNS = "id, job_id, user_id, status, document_type, metadata, processing_result, error_message, file_ids, vector_store_ids"
+JOB_COLUMNS = "result, fields"
+# Only read when asked for, since they are about as large as the markdown
+CHUNK_COLUMNS = ", chunks" if CHUNK_STORAGE_ENABLED else ""
+
+# PostgREST error codes for a relationship it can't embed
+MISSING_RELATIONSHIP_ERRORS = ("PGRST200", "PGRST201")
+
+
+@dataclass
+class DocumentRecord:
+    id: str
+    job_id: str
+    user_id: Optional[str]
+    status: Optional[str]
+    document_type: Optional[str]
+    metadata: Any
+    processing_result: Any
+    error_message: Optional[str]
+    file_ids: Optional[List[str]]
+    vector_store_ids: Optional[List[str]]
+    # Columns of the agentic_doc_jobs row
+    markdown: Any
+    fields: Any
+    # Stored chunks, see webapp/chunks.py; None when not read or not stored
+    chunks: Any = None
+
+    @classmethod
+    def from_rows(cls, document: Dict[str, Any], job: Optional[Dict[str, Any]]) -> "DocumentRecord":
+        job = job or {}
+        return cls(
+            id=document["id"],
+            job_id=document["job_id"],
+            user_id=document.get("user_id"),
+            status=document.get("status"),
+            document_type=document.get("document_type"),
+            metadata=document.get("metadata"),
+            processing_result=document.get("processing_result"),
+            error_message=document.get("error_message"),
+            file_ids=document.get("file_ids"),
+            vector_store_ids=document.get("vector_store_ids"),
+            markdown=job.get("result"),
+            fields=job.get("fields"),
+            chunks=job.get("chunks")
+        )
+
+
+class DocumentNotFound(Exception):
+    """Raised when no document has the requested ID."""
+
+
+class WriteBuffer:
+    """
+    Updates collected during one pipeline transition. Updates to the same row
+    are merged, later values winning, and each row is written once on flush,
+    in the order the rows were first updated.
+    """
+
+    def __init__(self):
+        self._pending: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+
+    def update(self, table: str, key_column: str, key: str, **data: Any):
+        self._pending.setdefault((table, key_column, key), {}).update(data)
+
+    def update_document(self, document_id: str, **data: Any):
+        self.update("documents", "id", document_id, **data)
+
+    def update_document_by_job_id(self, job_id: str, **data: Any):
+        self.update("documents", "job_id", job_id, **data)
+
+    def update_job(self, job_id: str, **data: Any):
+        self.update("agentic_doc_jobs", "job_id", job_id, **data)
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def flush(self):
+        """
+        Write every buffered row, one after the other.
+
+        PostgREST has no transactions across requests, so if a write fails the
+        rows before it stay written and the rows after it aren't sent. Writing
+        in order means a failure never leaves a later row, such as a document's
+        status, updated without an earlier one it depends on.
+        """
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        supabase = get_supabase_client()
+        with tracing.span("supabase flush_writes", kind="client", rows=len(pending)):
+            for (table, key_column, key), data in pending.items():
+                supabase.table(table).update(data).eq(key_column, key).execute()
+
+
+class DocumentRepository:
+    def __init__(self):
+        self._embedding_supported = True
+
+    def _get_unfused(self, document_id: str, job_columns: str) -> Optional[DocumentRecord]:
+        supabase = get_supabase_client()
+        document_response = supabase.table("documents").select(DOCUMENT_COLUMNS).eq("id", document_id).execute()
+        if not document_response.data:
+            return None
+        document = document_response.data[0]
+        job_response = supabase.table("agentic_doc_jobs").select(job_columns).eq("job_id", document["job_id"]).execute()
+        return DocumentRecord.from_rows(document, job_response.data[0] if job_response.data else None)
+
+    def get(self, document_id: str, include_chunks: bool = False) -> DocumentRecord:
+        """
+        Get a document and its agentic-doc job in one request.
+
+        Args:
+            document_id: ID of the document
+            include_chunks: Also read the job's stored chunks
+
+        Returns:
+            The document with its job's markdown and fields
+
+        Raises:
+            DocumentNotFound: If there is no such document
+        """
+        with tracing.span("supabase get_document", kind="client"):
+            return self._get(document_id, JOB_COLUMNS + (CHUNK_COLUMNS if include_chunks else ""))
+
+    def _get(self, document_id: str, job_columns: str) -> DocumentRecord:
+        record = None
+        if self._embedding_supported:
+            supabase = get_supabase_client()
+            # Loaded with the client, so this costs nothing once there is one
+            from postgrest.exceptions import APIError
+            try:
+                response = (
+                    supabase.table("documents")
+                    .select(f"{DOCUMENT_COLUMNS}, agentic_doc_jobs({job_columns})")
+                    .eq("id", document_id)
+                    .execute()
+                )
+            except APIError as e:
+                if e.code not in MISSING_RELATIONSHIP_ERRORS:
+                    raise
+                # Without a foreign key from documents.job_id PostgREST can't embed the job
+                logger.warning(f"Can't embed agentic_doc_jobs in documents, reading them separately: {e.message}")
+                self._embedding_supported = False
+            else:
+                if not response.data:
+                    raise DocumentNotFound(document_id)
+                document = response.data[0]
+                job = document.pop("agentic_doc_jobs", None)
+                if isinstance(job, list):
+                    job = job[0] if job else None
+                record = DocumentRecord.from_rows(document, job)
+
+        if record is None:
+            record = self._get_unfused(document_id, job_columns)
+        if record is None:
+            raise DocumentNotFound(document_id)
+        return record
+
+    @contextmanager
+    def transition(self) -> Iterator[WriteBuffer]:
+        """
+        Buffer the writes of one pipeline transition and send them when the
+        block exits. Nothing is written if the block raises.
+        """
+        buffer = WriteBuffer()
+        yield buffer
+        buffer.flush()
+
+
+document_repository = DocumentRepository()
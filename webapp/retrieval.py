@@ -0,0 +1,149 @@
+"""
+Local lexical retrieval over the chunks of a document.
+
+When a document is too large to send inline, reprocessing used to go back to
+its OpenAI vector store, which may need to be created again and indexed first.
+Instead, its chunks (see webapp/chunks.py) are ranked with BM25 against each
+requested field's ID, name and description. The RETRIEVAL_TOP_K best chunks
+per field are sent inline, in document order, up to RETRIEVAL_MAX_TOKENS.
+Building the index takes milliseconds, so it is built for each extraction
+rather than stored.
+"""
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, List
+
+from webapp.chunks import DocumentChunk
+
+LOCAL_RETRIEVAL_ENABLED = os.getenv("LOCAL_RETRIEVAL_ENABLED", "true").lower() == "true"
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "5"))
+RETRIEVAL_MAX_TOKENS = int(os.getenv("RETRIEVAL_MAX_TOKENS", "8000"))
+
+# BM25 term frequency saturation and length normalization
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has in is it its of on or that the this to was were will with".split()
+)
+
+TOKEN_PATTERN = re.compile(r"[^\W_]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase words and numbers of a text, without stopwords."""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count of a text, at about 4 characters per token."""
+    return (len(text) + 3) // 4
+
+
+class ChunkIndex:
+    """BM25 index over the chunks of one document."""
+
+    def __init__(self, chunks: List[DocumentChunk]):
+        self.chunks = chunks
+        self._term_counts = [Counter(tokenize(chunk.text)) for chunk in chunks]
+        self._lengths = [sum(counts.values()) for counts in self._term_counts]
+        self._average_length = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+        document_frequency: Counter = Counter()
+        for counts in self._term_counts:
+            document_frequency.update(counts.keys())
+        total = len(chunks)
+        self._idf: Dict[str, float] = {
+            term: math.log(1 + (total - frequency + 0.5) / (frequency + 0.5))
+            for term, frequency in document_frequency.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def scores(self, query: str) -> List[float]:
+        """BM25 score of every chunk for a query."""
+        terms = [term for term in set(tokenize(query)) if term in self._idf]
+        scores = []
+        for counts, length in zip(self._term_counts, self._lengths):
+            score = 0.0
+            normalization = BM25_K1 * (1 - BM25_B + BM25_B * length / self._average_length) if self._average_length else BM25_K1
+            for term in terms:
+                frequency = counts.get(term, 0)
+                if frequency:
+                    score += self._idf[term] * frequency * (BM25_K1 + 1) / (frequency + normalization)
+            scores.append(score)
+        return scores
+
+    def search(self, query: str, top_k: int = RETRIEVAL_TOP_K) -> List[int]:
+        """Indices of the top_k chunks matching a query, best first; chunks without a match are left out."""
+        scores = self.scores(query)
+        ranked = sorted((index for index, score in enumerate(scores) if score > 0), key=lambda index: -scores[index])
+        return ranked[:top_k]
+
+    def select(self, queries: List[str], top_k: int = RETRIEVAL_TOP_K, max_tokens: int = RETRIEVAL_MAX_TOKENS) -> List[int]:
+        """
+        Pick the chunks to send for several queries.
+
+        Each query's best chunks are taken in turn, rank by rank, so every query
+        gets its best match in before any gets a second one. Chunks are added
+        until the token budget is spent.
+
+        Args:
+            queries: One query per field
+            top_k: Chunks per query
+            max_tokens: Estimated tokens of all selected chunks together
+
+        Returns:
+            Indices of the selected chunks, in document order
+        """
+        rankings = [self.search(query, top_k) for query in queries]
+        selected: List[int] = []
+        budget = max_tokens
+        for rank in range(top_k):
+            for ranking in rankings:
+                if rank >= len(ranking) or ranking[rank] in selected:
+                    continue
+                cost = estimate_tokens(self.chunks[ranking[rank]].text)
+                if cost > budget:
+                    continue
+                selected.append(ranking[rank])
+                budget -= cost
+        return sorted(selected)
+
+
+def field_query(field: Dict[str, str]) -> str:
+    """Search terms of a requested field."""
+    return " ".join([field["id"].replace("_", " "), field.get("name", ""), field.get("description", "")])
+
+
+def format_chunk(chunk: DocumentChunk) -> str:
+    if chunk.page is None:
+        return chunk.text
+    return f"[Page {chunk.page + 1}, {chunk.type}]\n{chunk.text}"
+
+
+def build_context(index: ChunkIndex, fields: List[Dict[str, str]], top_k: int = RETRIEVAL_TOP_K, max_tokens: int = RETRIEVAL_MAX_TOKENS) -> str:
+    """
+    The excerpts of a document relevant to a group of fields, to send inline.
+
+    Args:
+        index: Index of the document's chunks
+        fields: Fields to extract
+        top_k: Chunks per field
+        max_tokens: Estimated tokens of the excerpts
+
+    Returns:
+        The selected chunks in document order
+    """
+    selected = index.select([field_query(field) for field in fields], top_k, max_tokens)
+    if not selected:
+        # No field shares a word with the document; its beginning is the best guess
+        budget = max_tokens
+        for position, chunk in enumerate(index.chunks):
+            budget -= estimate_tokens(chunk.text)
+            if budget < 0:
+                break
+            selected.append(position)
+    return "\n\n".join(format_chunk(index.chunks[position]) for position in selected)
@@ -0,0 +1,269 @@
+"""
+Routing of documents to parsing engines.
+
+The router picks engines from document features (page count, file size, MIME
+type) and from rolling latency and error statistics of each engine. Engines
+are tried in order until one succeeds. Rules come from OCR_ROUTER_CONFIG, a
+JSON document or the path of a JSON file, so thresholds can be tuned without
+code changes. For example:
+
+    {
+        "strategy": "ordered",
+        "engines": [
+            {"engine": "agentic_doc", "max_pages": 5, "max_error_rate": 0.5},
+            {"engine": "mistral"}
+        ]
+    }
+"""
+import json
+import logging
+import mimetypes
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from webapp.chunks import ParsedContent, chunks_from_agentic_doc
+from webapp.landingai import parse_documents
+from webapp.metrics import ENGINE_PARSE_SECONDS
+from webapp.mistral import get_mistral_ocr_response
+from webapp import tracing
+from webapp.sharding import get_pdf_page_count, parse_pdf_with_agentic_doc_sharded, parse_pdf_with_mistral_sharded, should_shard
+from webapp.tasks import TaskStage
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+OCR_ROUTER_CONFIG = os.getenv("OCR_ROUTER_CONFIG", "")
+# Number of recent calls per engine the statistics are computed over
+ENGINE_STATS_WINDOW = int(os.getenv("ENGINE_STATS_WINDOW", "50"))
+
+DEFAULT_ROUTER_CONFIG = {
+    "strategy": "ordered",
+    "engines": [
+        {"engine": "agentic_doc", "max_pages": 5},
+        {"engine": "mistral"}
+    ]
+}
+
+
+class NoEngineSucceeded(Exception):
+    """Raised when every candidate engine failed to parse a document."""
+
+
+@dataclass
+class DocumentInfo:
+    file_path: str
+    file_url: str
+    page_count: Optional[int]
+    file_size: int
+    mime_type: str
+
+    @classmethod
+    def from_file(cls, file_path: str, file_url: str) -> "DocumentInfo":
+        mime_type, _ = mimetypes.guess_type(file_path)
+        return cls(
+            file_path=file_path,
+            file_url=file_url,
+            page_count=get_pdf_page_count(file_path),
+            file_size=os.path.getsize(file_path),
+            mime_type=mime_type or "application/octet-stream"
+        )
+
+
+class Engine:
+    """A way of turning a document into markdown."""
+
+    name = ""
+    stage = TaskStage.PARSING
+
+    def parse(self, document: DocumentInfo, parsed_doc: Any = None) -> ParsedContent:
+        """Return the markdown of a document, and its chunks if the engine has them, raising when it can't parse it."""
+        raise NotImplementedError
+
+
+class AgenticDocEngine(Engine):
+    name = "agentic_doc"
+    stage = TaskStage.PARSING
+
+    def parse(self, document: DocumentInfo, parsed_doc: Any = None) -> ParsedContent:
+        if parsed_doc is None:
+            if should_shard(document.page_count):
+                return parse_pdf_with_agentic_doc_sharded(document.file_path, document.page_count)
+            results = parse_documents([str(document.file_path)])
+            parsed_doc = results[0] if results else None
+
+        if parsed_doc is None:
+            raise Exception("agentic-doc returned no results")
+        error_chunks = [chunk for chunk in parsed_doc.chunks if chunk.chunk_type == "error"]
+        if error_chunks:
+            raise Exception(f"agentic-doc returned {len(error_chunks)} error chunks")
+        return ParsedContent(parsed_doc.markdown, chunks_from_agentic_doc(parsed_doc))
+
+
+class MistralEngine(Engine):
+    name = "mistral"
+    stage = TaskStage.OCR
+
+    def parse(self, document: DocumentInfo, parsed_doc: Any = None) -> ParsedContent:
+        if should_shard(document.page_count):
+            return ParsedContent(parse_pdf_with_mistral_sharded(document.file_url, document.page_count))
+        return ParsedContent(get_mistral_ocr_response(document.file_url))
+
+
+@dataclass
+class EngineRule:
+    engine: str
+    max_pages: Optional[int] = None
+    max_file_size: Optional[int] = None
+    mime_types: Optional[List[str]] = None
+    # The engine is skipped while its recent error rate is above this, given enough samples
+    max_error_rate: Optional[float] = None
+    min_samples: int = 10
+    # An unhealthy engine is given another try this many seconds after its last failure
+    recovery_seconds: float = 60.0
+
+    def accepts(self, document: DocumentInfo) -> bool:
+        if self.max_pages is not None and document.page_count is not None and document.page_count > self.max_pages:
+            return False
+        if self.max_file_size is not None and document.file_size > self.max_file_size:
+            return False
+        if self.mime_types is not None and document.mime_type not in self.mime_types:
+            return False
+        return True
+
+
+class EngineStats:
+    """Rolling latency and error statistics of one engine."""
+
+    def __init__(self, window: int = ENGINE_STATS_WINDOW):
+        self._calls: Deque[Tuple[float, bool]] = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.last_failure_at: Optional[float] = None
+
+    def record(self, seconds: float, succeeded: bool):
+        with self._lock:
+            self._calls.append((seconds, succeeded))
+            if not succeeded:
+                self.last_failure_at = time.monotonic()
+
+    @property
+    def samples(self) -> int:
+        return len(self._calls)
+
+    @property
+    def error_rate(self) -> float:
+        with self._lock:
+            if not self._calls:
+                return 0.0
+            return sum(1 for _, succeeded in self._calls if not succeeded) / len(self._calls)
+
+    @property
+    def mean_latency(self) -> Optional[float]:
+        with self._lock:
+            latencies = [seconds for seconds, succeeded in self._calls if succeeded]
+        if not latencies:
+            return None
+        return sum(latencies) / len(latencies)
+
+
+class EngineRouter:
+    def __init__(self, engines: List[Engine], config: Dict[str, Any]):
+        self.engines = {engine.name: engine for engine in engines}
+        self.strategy = config.get("strategy", "ordered")
+        self.rules = [EngineRule(**rule) for rule in config["engines"]]
+        for rule in self.rules:
+            if rule.engine not in self.engines:
+                raise ValueError(f"Unknown engine in router config: {rule.engine}")
+        self.stats = {name: EngineStats() for name in self.engines}
+
+    def _is_healthy(self, rule: EngineRule) -> bool:
+        stats = self.stats[rule.engine]
+        if rule.max_error_rate is None or stats.samples < rule.min_samples:
+            return True
+        if stats.error_rate <= rule.max_error_rate:
+            return True
+        return stats.last_failure_at is not None and time.monotonic() - stats.last_failure_at > rule.recovery_seconds
+
+    def route(self, document: DocumentInfo) -> List[Engine]:
+        """
+        Choose the engines to try for a document, best first.
+
+        Args:
+            document: Features of the document
+
+        Returns:
+            Candidate engines in the order they should be tried
+        """
+        eligible = [rule for rule in self.rules if rule.accepts(document)]
+        healthy = [rule for rule in eligible if self._is_healthy(rule)]
+        # Unhealthy engines stay at the back as a last resort
+        candidates = healthy + [rule for rule in eligible if rule not in healthy]
+
+        if self.strategy == "fastest":
+            def expected_latency(rule: EngineRule) -> float:
+                latency = self.stats[rule.engine].mean_latency
+                return latency if latency is not None else 0.0
+            candidates = sorted(healthy, key=expected_latency) + candidates[len(healthy):]
+
+        logger.info(
+            f"Routing {document.mime_type} ({document.page_count} pages, {document.file_size} bytes) "
+            f"to {[rule.engine for rule in candidates]}"
+        )
+        return [self.engines[rule.engine] for rule in candidates]
+
+    def parse(
+        self,
+        document: DocumentInfo,
+        report_stage: Optional[Callable[[str], None]] = None,
+        parsed_doc: Any = None
+    ) -> Tuple[ParsedContent, str]:
+        """
+        Parse a document with the first candidate engine that succeeds.
+
+        Args:
+            document: Features of the document
+            report_stage: Called with the stage of each engine tried (optional)
+            parsed_doc: agentic-doc result already parsed as part of a batch (optional)
+
+        Returns:
+            Tuple of the parsed content and the name of the engine that produced it
+
+        Raises:
+            NoEngineSucceeded: If every candidate failed
+        """
+        errors = []
+        for engine in self.route(document):
+            if report_stage is not None:
+                report_stage(engine.stage)
+            start = time.monotonic()
+            try:
+                with tracing.span(f"engine {engine.name}", kind="client", pages=document.page_count or 0, bytes=document.file_size):
+                    content = engine.parse(document, parsed_doc if engine.name == AgenticDocEngine.name else None)
+            except Exception as e:
+                self.stats[engine.name].record(time.monotonic() - start, False)
+                ENGINE_PARSE_SECONDS.observe(time.monotonic() - start, engine=engine.name, outcome="failure")
+                logger.warning(f"Engine {engine.name} failed for {document.file_path}: {str(e)}")
+                errors.append(f"{engine.name}: {str(e)}")
+                continue
+            self.stats[engine.name].record(time.monotonic() - start, True)
+            ENGINE_PARSE_SECONDS.observe(time.monotonic() - start, engine=engine.name, outcome="success")
+            logger.info(f"Parsed {document.file_path} with {engine.name} in {time.monotonic() - start:.2f}s")
+            return content, engine.name
+
+        raise NoEngineSucceeded("; ".join(errors) or "No engine accepts this document")
+
+
+def load_router_config(value: str = OCR_ROUTER_CONFIG) -> Dict[str, Any]:
+    """Read the router config from a JSON string or a JSON file path, or use the default."""
+    if not value:
+        return DEFAULT_ROUTER_CONFIG
+    if value.lstrip().startswith("{"):
+        return json.loads(value)
+    with open(value) as config_file:
+        return json.load(config_file)
+
+
+engine_router = EngineRouter([AgenticDocEngine(), MistralEngine()], load_router_config())
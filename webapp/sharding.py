@@ -0,0 +1,143 @@
+"""
+Page-sharded parsing of large PDFs.
+
+A PDF is split into page ranges that are parsed in parallel. Only the shards
+that failed are retried, and the markdown is merged back in page order.
+"""
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+from webapp import tracing
+from webapp.chunks import ParsedContent, chunks_from_agentic_doc
+from webapp.executor import run_cpu_bound
+from webapp.landingai import parse_documents
+from webapp.mistral import get_mistral_ocr_response
+from webapp.pdf import PageRange, count_pdf_pages, split_pdf
+from webapp.upload import cleanup_temp_dir
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# PDFs longer than SHARD_PAGES pages are parsed in shards of that many pages
+SHARD_PAGES = int(os.getenv("SHARD_PAGES", "10"))
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "4"))
+SHARD_MAX_ATTEMPTS = int(os.getenv("SHARD_MAX_ATTEMPTS", "3"))
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class ShardParseError(Exception):
+    """Raised when some shards still fail after every attempt."""
+
+
+def get_pdf_page_count(file_path: str) -> Optional[int]:
+    """Return the number of pages of a PDF, or None for other files and unreadable PDFs."""
+    if not file_path.lower().endswith('.pdf'):
+        return None
+    try:
+        return run_cpu_bound(count_pdf_pages, file_path)
+    except Exception as e:
+        logger.warning(f"Error reading PDF: {str(e)}")
+        return None
+
+
+def should_shard(page_count: Optional[int]) -> bool:
+    return page_count is not None and page_count > SHARD_PAGES
+
+
+def page_ranges(page_count: int, shard_pages: int = SHARD_PAGES) -> List[PageRange]:
+    """Split page_count pages into consecutive ranges of at most shard_pages pages."""
+    return [
+        PageRange(start, min(start + shard_pages, page_count))
+        for start in range(0, page_count, shard_pages)
+    ]
+
+
+def parse_shards(
+    shards: List[T],
+    parse_shard: Callable[[T], R],
+    workers: int = SHARD_WORKERS,
+    max_attempts: int = SHARD_MAX_ATTEMPTS
+) -> List[R]:
+    """
+    Parse shards in parallel, retrying only the ones that failed.
+    
+    Args:
+        shards: Shards to parse
+        parse_shard: Returns the result of one shard, such as its markdown, raising on failure
+        workers: Number of shards parsed at once
+        max_attempts: Attempts per shard before giving up
+        
+    Returns:
+        Result of each shard, in the order of shards
+        
+    Raises:
+        ShardParseError: If a shard fails on every attempt
+    """
+    results: Dict[int, R] = {}
+    errors: Dict[int, Exception] = {}
+    pending = list(range(len(shards)))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for attempt in range(1, max_attempts + 1):
+            futures = {index: executor.submit(tracing.bind_context(parse_shard), shards[index]) for index in pending}
+            errors = {}
+            for index, future in futures.items():
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    errors[index] = e
+            if not errors:
+                break
+            pending = sorted(errors)
+            logger.warning(f"{len(pending)} of {len(shards)} shards failed on attempt {attempt}: {pending}")
+
+    if errors:
+        first_error = errors[min(errors)]
+        raise ShardParseError(f"Shards {sorted(errors)} failed after {max_attempts} attempts: {str(first_error)}")
+
+    return [results[index] for index in range(len(shards))]
+
+
+def merge_markdown(parts: List[str]) -> str:
+    return "\n\n".join(part.strip() for part in parts if part and part.strip())
+
+
+def parse_agentic_doc_shard(shard_path: str) -> Any:
+    results = parse_documents([shard_path])
+    if not results:
+        raise Exception(f"No results returned for {shard_path}")
+    error_chunks = [chunk for chunk in results[0].chunks if chunk.chunk_type == "error"]
+    if error_chunks:
+        raise Exception(f"{len(error_chunks)} error chunks in {shard_path}")
+    return results[0]
+
+
+def parse_pdf_with_agentic_doc_sharded(file_path: str, page_count: int) -> ParsedContent:
+    """Parse a large PDF with agentic-doc, one page range at a time in parallel."""
+    ranges = page_ranges(page_count)
+    shard_dir = tempfile.mkdtemp()
+    try:
+        shard_paths = run_cpu_bound(split_pdf, file_path, ranges, shard_dir)
+        logger.info(f"Parsing {page_count} pages with agentic-doc in {len(shard_paths)} shards")
+        parsed_docs = parse_shards(shard_paths, parse_agentic_doc_shard)
+        # Shard pages are numbered from 0; number them as in the whole PDF
+        chunks = [chunk for page_range, parsed_doc in zip(ranges, parsed_docs) for chunk in chunks_from_agentic_doc(parsed_doc, page_range.start)]
+        return ParsedContent(merge_markdown([parsed_doc.markdown for parsed_doc in parsed_docs]), chunks)
+    finally:
+        cleanup_temp_dir(shard_dir)
+
+
+def parse_pdf_with_mistral_sharded(file_url: str, page_count: int) -> str:
+    """OCR a large PDF with Mistral, one page range per request in parallel."""
+    ranges = page_ranges(page_count)
+    logger.info(f"Parsing {page_count} pages with Mistral OCR in {len(ranges)} shards")
+
+    def parse_mistral_shard(page_range: PageRange) -> str:
+        return get_mistral_ocr_response(file_url, pages=list(range(page_range.start, page_range.end)))
+
+    return merge_markdown(parse_shards(ranges, parse_mistral_shard))
@@ -1,54 +1,145 @@
 from typing import Dict, Optional
+import os
+import threading
+import time
 import uuid
+from collections import OrderedDict
 from enum import Enum
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
 
+from webapp.events import event_broker
+
+# Finished tasks are dropped after TASK_TTL seconds, or earlier once more than
+# TASK_MAX_ENTRIES tasks are tracked. Unfinished tasks are dropped
+# TASK_UNFINISHED_TTL seconds after they were created, or while over capacity
+# with no finished task left to drop: with standalone workers nothing in the web
+# process ever finishes them. /task/{id} then answers from the job queue.
+TASK_TTL = float(os.getenv("TASK_TTL", "3600"))
+TASK_UNFINISHED_TTL = float(os.getenv("TASK_UNFINISHED_TTL", "86400"))
+TASK_MAX_ENTRIES = int(os.getenv("TASK_MAX_ENTRIES", "10000"))
+
 class TaskStatus(Enum):
     PENDING = "pending"
     PROCESSING = "processing"
     COMPLETED = "completed"
     FAILED = "failed"
 
-@dataclass
+FINISHED_STATUSES = (TaskStatus.COMPLETED, TaskStatus.FAILED)
+
+class TaskStage:
+    UPLOADED = "uploaded"
+    PARSING = "parsing"
+    OCR = "ocr"
+    INDEXING = "indexing"
+    EXTRACTING = "extracting"
+    DONE = "done"
+
+@dataclass(slots=True)
 class Task:
     id: str
     status: TaskStatus
-    result: Optional[dict] = None
+    # The result lives on the documents row; tasks only keep a reference to it
+    document_id: Optional[str] = None
     error: Optional[str] = None
-    created_at: datetime = datetime.now()
-    updated_at: datetime = datetime.now()
+    stage: Optional[str] = None
+    created_at: datetime = field(default_factory=datetime.now)
+    updated_at: datetime = field(default_factory=datetime.now)
 
 class TaskManager:
-    def __init__(self):
+    def __init__(self, ttl: float = TASK_TTL, max_entries: int = TASK_MAX_ENTRIES, unfinished_ttl: float = TASK_UNFINISHED_TTL):
+        self.ttl = ttl
+        self.unfinished_ttl = unfinished_ttl
+        self.max_entries = max_entries
         self.tasks: Dict[str, Task] = {}
-    
-    def create_task(self) -> str:
+        # Finished task IDs in the order they finished, with the monotonic time they finished at
+        self._finished: "OrderedDict[str, float]" = OrderedDict()
+        # Unfinished task IDs in the order they were created, with the monotonic time they were created at
+        self._unfinished: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create_task(self, document_id: Optional[str] = None) -> str:
         """Create a new task and return its ID."""
         task_id = str(uuid.uuid4())
-        self.tasks[task_id] = Task(
-            id=task_id,
-            status=TaskStatus.PENDING
-        )
+        with self._lock:
+            self.tasks[task_id] = Task(
+                id=task_id,
+                status=TaskStatus.PENDING,
+                document_id=document_id
+            )
+            self._unfinished[task_id] = time.monotonic()
+            self._evict()
         return task_id
-    
+
     def get_task(self, task_id: str) -> Optional[Task]:
         """Get a task by its ID."""
-        return self.tasks.get(task_id)
-    
-    def update_task(self, task_id: str, status: TaskStatus, result: Optional[dict] = None, error: Optional[str] = None):
-        """Update a task's status and result."""
-        if task_id in self.tasks:
-            task = self.tasks[task_id]
+        with self._lock:
+            return self.tasks.get(task_id)
+
+    def update_task(self, task_id: str, status: TaskStatus, document_id: Optional[str] = None, error: Optional[str] = None):
+        """Update a task's status, the document holding its result, and its error."""
+        with self._lock:
+            task = self.tasks.get(task_id)
+            if task is None:
+                return
             task.status = status
-            task.result = result
+            if document_id is not None:
+                task.document_id = document_id
             task.error = error
             task.updated_at = datetime.now()
-    
+
+            if status in FINISHED_STATUSES:
+                self._unfinished.pop(task_id, None)
+                self._finished.pop(task_id, None)
+                self._finished[task_id] = time.monotonic()
+            elif task_id in self._finished:
+                # Back to running, e.g. a job retried after it was reported failed
+                del self._finished[task_id]
+                self._unfinished[task_id] = time.monotonic()
+            self._evict()
+
+        event_broker.publish(task_id, {
+            "type": "status",
+            "task_id": task_id,
+            "status": status.value,
+            "error": error
+        })
+
+    def set_stage(self, task_id: str, stage: str):
+        """Record which pipeline stage a task is in and notify subscribers."""
+        with self._lock:
+            task = self.tasks.get(task_id)
+            if task is None:
+                return
+            task.stage = stage
+            task.updated_at = datetime.now()
+
+        event_broker.publish(task_id, {
+            "type": "stage",
+            "task_id": task_id,
+            "stage": stage
+        })
+
     def delete_task(self, task_id: str):
         """Delete a task by its ID."""
-        if task_id in self.tasks:
-            del self.tasks[task_id]
+        with self._lock:
+            self.tasks.pop(task_id, None)
+            self._finished.pop(task_id, None)
+            self._unfinished.pop(task_id, None)
+
+    def _evict(self):
+        """
+        Drop expired tasks, then the oldest finished ones while over capacity,
+        then the oldest unfinished ones if that wasn't enough.
+        """
+        now = time.monotonic()
+        for order, ttl in ((self._finished, self.ttl), (self._unfinished, self.unfinished_ttl)):
+            while order:
+                task_id, since = next(iter(order.items()))
+                if since > now - ttl and len(self.tasks) <= self.max_entries:
+                    break
+                del order[task_id]
+                self.tasks.pop(task_id, None)
 
 # Create a global task manager instance
-task_manager = TaskManager() 
\ No newline at end of file
+task_manager = TaskManager()
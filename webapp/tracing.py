@@ -0,0 +1,379 @@
+"""
+Tracing of a document through the web request, the background job and the
+calls it makes to Supabase, the parsing engines and OpenAI.
+
+Spans are kept in a context variable, so nested `span()` blocks form a tree
+without passing anything around. The trace crosses boundaries as a W3C
+`traceparent` value: read from and returned in HTTP headers, stored in job
+payloads, and sent on outbound requests. Threads started from a traced block
+only join its trace when their callable is wrapped with `bind_context()`.
+
+Whether a trace is recorded is decided once, where it starts, with probability
+TRACE_SAMPLE_RATE; everything downstream follows that decision. With
+TRACE_EXPORTER set to "none" (the default) `span()` does nothing. Finished
+spans are exported in batches from a background thread, and dropped rather
+than queued without bound when the exporter falls behind.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional, TypeVar
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# none, console, file or otlp
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none").lower()
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+TRACE_FILE = os.getenv("TRACE_FILE", "agenticdoc-traces.jsonl")
+TRACE_EXPORT_INTERVAL = float(os.getenv("TRACE_EXPORT_INTERVAL", "5"))
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "2048"))
+OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "http://localhost:4318").rstrip("/")
+SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "agenticdoc")
+
+# Key of the trace context in job payloads; the worker removes it before calling the handler
+TRACEPARENT_PAYLOAD_KEY = "_traceparent"
+
+T = TypeVar("T")
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    sampled: bool
+    kind: str = "internal"
+    start_ns: int = 0
+    end_ns: int = 0
+    status: str = "ok"
+    error: Optional[str] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+    def set_attribute(self, key: str, value: Any):
+        if self.sampled:
+            self.attributes[key] = value
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "kind": self.kind,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": (self.end_ns - self.start_ns) / 1e6,
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes
+        }
+
+
+@dataclass(frozen=True)
+class SpanContext:
+    """The part of a span that crosses process boundaries."""
+    trace_id: str
+    span_id: str
+    sampled: bool
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[SpanContext]:
+    """Parse a W3C traceparent value, returning None when it is missing or malformed."""
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16)
+        int(parts[2], 16)
+        flags = int(parts[3], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return SpanContext(trace_id=parts[1], span_id=parts[2], sampled=bool(flags & 1))
+
+
+class SpanExporter:
+    """Interface of the span exporters."""
+
+    def export(self, spans: List[Span]):
+        raise NotImplementedError
+
+    def shutdown(self):
+        pass
+
+
+class ConsoleExporter(SpanExporter):
+    """Logs one line per span."""
+
+    def export(self, spans: List[Span]):
+        for span in spans:
+            parent = span.parent_id or "-"
+            logger.info(
+                f"span {span.name} trace={span.trace_id} id={span.span_id} parent={parent} "
+                f"{(span.end_ns - span.start_ns) / 1e6:.1f}ms {span.status} {span.attributes}"
+            )
+
+
+class FileExporter(SpanExporter):
+    """Appends spans to a file as JSON lines."""
+
+    def __init__(self, path: str = TRACE_FILE):
+        self.path = path
+
+    def export(self, spans: List[Span]):
+        with open(self.path, "a", encoding="utf-8") as handle:
+            for span in spans:
+                handle.write(json.dumps(span.to_dict(), default=str) + "\n")
+
+
+class OTLPExporter(SpanExporter):
+    """Sends spans to an OpenTelemetry collector with OTLP over HTTP, JSON encoded."""
+
+    KINDS = {"internal": 1, "server": 2, "client": 3, "producer": 4, "consumer": 5}
+
+    def __init__(self, endpoint: str = OTLP_ENDPOINT, service_name: str = SERVICE_NAME):
+        self.url = f"{endpoint}/v1/traces"
+        self.service_name = service_name
+        import requests
+        self._session = requests.Session()
+
+    @staticmethod
+    def _attribute(key: str, value: Any) -> Dict[str, Any]:
+        if isinstance(value, bool):
+            encoded = {"boolValue": value}
+        elif isinstance(value, int):
+            encoded = {"intValue": str(value)}
+        elif isinstance(value, float):
+            encoded = {"doubleValue": value}
+        else:
+            encoded = {"stringValue": str(value)}
+        return {"key": key, "value": encoded}
+
+    def _encode(self, span: Span) -> Dict[str, Any]:
+        encoded = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": self.KINDS.get(span.kind, 1),
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns),
+            "attributes": [self._attribute(key, value) for key, value in span.attributes.items()],
+            "status": {"code": 2, "message": span.error or ""} if span.status == "error" else {"code": 1}
+        }
+        if span.parent_id:
+            encoded["parentSpanId"] = span.parent_id
+        return encoded
+
+    def export(self, spans: List[Span]):
+        body = {
+            "resourceSpans": [{
+                "resource": {"attributes": [self._attribute("service.name", self.service_name)]},
+                "scopeSpans": [{"scope": {"name": "webapp.tracing"}, "spans": [self._encode(span) for span in spans]}]
+            }]
+        }
+        response = self._session.post(self.url, json=body, timeout=10)
+        response.raise_for_status()
+
+    def shutdown(self):
+        self._session.close()
+
+
+class BatchProcessor:
+    """Hands finished spans to the exporter in batches, from a background thread."""
+
+    def __init__(self, exporter: SpanExporter, interval: float = TRACE_EXPORT_INTERVAL, max_queue_size: int = TRACE_QUEUE_SIZE):
+        self.exporter = exporter
+        self.interval = interval
+        self.max_batch_size = max(1, max_queue_size // 4)
+        self.dropped = 0
+        self._queue: "queue.Queue[Span]" = queue.Queue(maxsize=max_queue_size)
+        self._flush_requested = threading.Event()
+        self._export_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._loop, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def on_end(self, span: Span):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self._queue.qsize() >= self.max_batch_size:
+            self._flush_requested.set()
+
+    def _drain(self) -> List[Span]:
+        spans = []
+        while len(spans) < self.max_batch_size:
+            try:
+                spans.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return spans
+
+    def flush(self):
+        with self._export_lock:
+            while True:
+                spans = self._drain()
+                if not spans:
+                    return
+                try:
+                    self.exporter.export(spans)
+                except Exception as e:
+                    logger.warning(f"Error exporting {len(spans)} spans: {str(e)}")
+
+    def _loop(self):
+        while True:
+            self._flush_requested.wait(self.interval)
+            self._flush_requested.clear()
+            self.flush()
+
+    def shutdown(self):
+        self.flush()
+        self.exporter.shutdown()
+
+
+EXPORTERS: Dict[str, Callable[[], SpanExporter]] = {
+    "console": ConsoleExporter,
+    "file": FileExporter,
+    "otlp": OTLPExporter
+}
+
+_processor: Optional[BatchProcessor] = None
+
+
+def set_exporter(exporter: Optional[SpanExporter]):
+    """Export spans with the given exporter from now on; None turns tracing off."""
+    global _processor
+    previous, _processor = _processor, BatchProcessor(exporter) if exporter is not None else None
+    if previous is not None:
+        previous.shutdown()
+
+
+def flush():
+    """Export every finished span now."""
+    if _processor is not None:
+        _processor.flush()
+
+
+def configure_from_env():
+    if TRACE_EXPORTER == "none":
+        return
+    factory = EXPORTERS.get(TRACE_EXPORTER)
+    if factory is None:
+        raise ValueError(f"Unknown TRACE_EXPORTER: {TRACE_EXPORTER}")
+    set_exporter(factory())
+
+
+def _new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+@contextmanager
+def span(name: str, kind: str = "internal", parent: Optional[str] = None, **attributes: Any) -> Iterator[Optional[Span]]:
+    """
+    Record a block as a span, a child of the current span if there is one.
+
+    Args:
+        name: Low-cardinality name of the operation
+        kind: internal, server, client, producer or consumer
+        parent: traceparent to continue when there is no current span, e.g. from a request or job
+        **attributes: Attributes of the span
+
+    Yields:
+        The span, or None when tracing is off
+    """
+    if _processor is None:
+        yield None
+        return
+
+    current = _current_span.get()
+    if current is not None:
+        trace_id, parent_id, sampled = current.trace_id, current.span_id, current.sampled
+    else:
+        remote = parse_traceparent(parent)
+        if remote is not None:
+            trace_id, parent_id, sampled = remote.trace_id, remote.span_id, remote.sampled
+        else:
+            trace_id, parent_id, sampled = _new_id(128), None, random.random() < TRACE_SAMPLE_RATE
+
+    new_span = Span(
+        name=name,
+        trace_id=trace_id,
+        span_id=_new_id(64),
+        parent_id=parent_id,
+        sampled=sampled,
+        kind=kind,
+        attributes=attributes if sampled else {}
+    )
+    token = _current_span.set(new_span)
+    new_span.start_ns = time.time_ns()
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.status = "error"
+        new_span.error = f"{type(e).__name__}: {str(e)[:200]}"
+        raise
+    finally:
+        new_span.end_ns = time.time_ns()
+        _current_span.reset(token)
+        if sampled:
+            _processor.on_end(new_span)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def current_traceparent() -> Optional[str]:
+    """traceparent of the current span, to hand the trace to another process."""
+    current = _current_span.get()
+    return current.traceparent if current is not None else None
+
+
+def inject_headers(headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """Add the traceparent header of the current span to a dict of outbound headers."""
+    headers = dict(headers or {})
+    traceparent = current_traceparent()
+    if traceparent is not None:
+        headers["traceparent"] = traceparent
+    return headers
+
+
+def inject_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of a job payload carrying the current trace, for the worker to continue."""
+    traceparent = current_traceparent()
+    if traceparent is None:
+        return payload
+    return {**payload, TRACEPARENT_PAYLOAD_KEY: traceparent}
+
+
+def bind_context(func: Callable[..., T]) -> Callable[..., T]:
+    """Wrap a callable so it runs in the caller's trace when handed to another thread."""
+    if _processor is None:
+        return func
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(func, *args, **kwargs)
+
+
+configure_from_env()
+atexit.register(lambda: _processor.shutdown() if _processor is not None else None)
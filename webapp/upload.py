@@ -1,12 +1,123 @@
 import os
 import uuid
+import shutil
+import hashlib
+import logging
+import tempfile
 import mimetypes
-from fastapi import HTTPException
+import requests
+from dataclasses import dataclass
+from typing import BinaryIO, Union
+from urllib.parse import urlparse
+from fastapi import HTTPException, UploadFile
 from .db import get_supabase_client
 
+logger = logging.getLogger(__name__)
+
+# Size of each read from the incoming upload; keeps peak memory flat per request
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE_MB", "50")) * 1024 * 1024
+
+
+@dataclass
+class SpooledUpload:
+    temp_dir: str
+    file_path: str
+    file_size: int
+    sha256: str
+
+
+async def spool_upload_to_disk(file: UploadFile, max_size: int = MAX_UPLOAD_SIZE) -> SpooledUpload:
+    """
+    Stream an uploaded file to a temporary directory chunk by chunk.
+    
+    Args:
+        file: The incoming upload
+        max_size: Maximum accepted size in bytes
+        
+    Returns:
+        SpooledUpload with the local path, size in bytes and SHA-256 hex digest
+        
+    Raises:
+        HTTPException: 413 if the upload is larger than max_size
+    """
+    if file.size is not None and file.size > max_size:
+        raise HTTPException(status_code=413, detail=f"File exceeds maximum size of {max_size} bytes")
+
+    temp_dir = tempfile.mkdtemp()
+    file_name = os.path.basename(file.filename or "") or "upload.bin"
+    file_path = os.path.join(temp_dir, file_name)
+    digest = hashlib.sha256()
+    file_size = 0
+
+    try:
+        with open(file_path, "wb") as buffer:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                file_size += len(chunk)
+                if file_size > max_size:
+                    raise HTTPException(status_code=413, detail=f"File exceeds maximum size of {max_size} bytes")
+                digest.update(chunk)
+                buffer.write(chunk)
+    except BaseException:
+        cleanup_temp_dir(temp_dir)
+        raise
+
+    return SpooledUpload(
+        temp_dir=temp_dir,
+        file_path=file_path,
+        file_size=file_size,
+        sha256=digest.hexdigest()
+    )
+
+
+def cleanup_temp_dir(temp_dir: str):
+    """Remove a temporary upload directory and everything in it."""
+    shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def remove_temp_file(file_path: str):
+    """Remove a spooled upload and its directory once the directory is empty."""
+    try:
+        os.unlink(file_path)
+    except FileNotFoundError:
+        pass
+    try:
+        os.rmdir(os.path.dirname(file_path))
+    except OSError as e:
+        logger.warning(f"Could not remove temporary directory for {file_path}: {str(e)}")
+
+
+def download_file_to_temp_dir(file_url: str) -> str:
+    """
+    Stream a stored document back into a new temporary directory.
+    
+    Args:
+        file_url: Public URL of the stored file
+        
+    Returns:
+        Path of the downloaded file
+    """
+    temp_dir = tempfile.mkdtemp()
+    file_name = os.path.basename(urlparse(file_url).path) or "download.bin"
+    file_path = os.path.join(temp_dir, file_name)
+    try:
+        with requests.get(file_url, stream=True, timeout=(10, 300)) as response:
+            response.raise_for_status()
+            with open(file_path, "wb") as buffer:
+                for chunk in response.iter_content(UPLOAD_CHUNK_SIZE):
+                    buffer.write(chunk)
+    except BaseException:
+        cleanup_temp_dir(temp_dir)
+        raise
+    return file_path
+
+
 def upload_file_to_storage(
     user_id: str,
-    file_content: bytes,
+    file_content: Union[bytes, BinaryIO],
     file_name: str,
     bucket_name: str = "documents",
 ) -> str:
@@ -15,7 +126,7 @@ def upload_file_to_storage(
     
     Args:
         user_id: The ID of the user uploading the file
-        file_content: The binary content of the file to upload
+        file_content: The binary content of the file, or an open binary file handle to stream from
         file_name: The original name of the file
         bucket_name: The name of the storage bucket (default: "documents")
         
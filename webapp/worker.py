@@ -0,0 +1,293 @@
+"""
+Workers that run document processing jobs from the job queue.
+
+Run standalone with `python -m webapp.worker`, or inside the web process when
+RUN_IN_PROCESS_WORKERS is enabled.
+
+The job handlers import agentic-doc, OpenAI and the PDF libraries, which make
+up most of the import time and memory of the app. Each job kind's module is
+loaded when the first job of that kind runs, so a web process that leaves jobs
+to standalone workers never loads them, and a reaper job doesn't load the
+document pipeline. STARTUP_WARMUP loads them, and creates the provider clients, in
+the background right after startup instead, so the first job and request
+don't wait for it.
+"""
+import argparse
+import importlib
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from webapp.jobqueue import Job, JobQueue, LeaseLost, get_job_queue
+from webapp.lifecycle import OPENAI_REAPER_SCHEDULER, REAPER_JOB_KIND, start_reaper_scheduler
+from webapp.executor import shutdown_cpu_executor
+from webapp.metrics import JOB_QUEUE_WAIT_SECONDS, JOB_SECONDS, JOBS_IN_FLIGHT, start_metrics_server
+from webapp import tracing
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "2"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+JOB_VISIBILITY_TIMEOUT = float(os.getenv("JOB_VISIBILITY_TIMEOUT", "120"))
+RUN_IN_PROCESS_WORKERS = os.getenv("RUN_IN_PROCESS_WORKERS", "true").lower() == "true"
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "false").lower() == "true"
+# Port standalone workers serve /metrics on; 0 disables it
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9100"))
+
+
+@dataclass
+class JobHandler:
+    run: Callable[..., Any]
+    # Called with the error and the job payload once every attempt has failed
+    on_failure: Callable[..., Any]
+
+
+# Module, run function and failure callback of each job kind
+JOB_HANDLER_PATHS: Dict[str, Tuple[str, str, str]] = {
+    "process_document": ("webapp.background", "process_document_in_background", "fail_document_processing"),
+    "reprocess_document": ("webapp.background", "reprocess_document_in_background", "fail_document_reprocessing"),
+    "process_batch": ("webapp.background", "process_document_batch_in_background", "fail_document_batch"),
+    REAPER_JOB_KIND: ("webapp.lifecycle", "reap_openai_resources", "fail_reaping"),
+}
+
+JOB_HANDLERS: Dict[str, JobHandler] = {}
+_handlers_lock = threading.Lock()
+
+
+def get_job_handler(kind: str) -> Optional[JobHandler]:
+    """Handler of a job kind, importing only the module that implements it on first use."""
+    with _handlers_lock:
+        handler = JOB_HANDLERS.get(kind)
+        if handler is None and kind in JOB_HANDLER_PATHS:
+            module_name, run_name, failure_name = JOB_HANDLER_PATHS[kind]
+            module = importlib.import_module(module_name)
+            handler = JOB_HANDLERS[kind] = JobHandler(run=getattr(module, run_name), on_failure=getattr(module, failure_name))
+        return handler
+
+
+def get_job_handlers() -> Dict[str, JobHandler]:
+    """Handlers of every job kind, importing all the modules that implement them."""
+    for kind in JOB_HANDLER_PATHS:
+        get_job_handler(kind)
+    return JOB_HANDLERS
+
+
+def warm_up():
+    """Load the job handlers and create the provider clients ahead of the first job and request."""
+    start = time.monotonic()
+    try:
+        get_job_handlers()
+        # Otherwise imported by the first parse, see webapp/landingai.py
+        import agentic_doc.parse  # noqa: F401
+        from webapp.db import get_supabase_client
+        from webapp.llm import get_openai_client
+        get_supabase_client()
+        get_openai_client()
+    except Exception as e:
+        logger.warning(f"Warm-up failed, loading on first use instead: {str(e)}")
+        return
+    logger.info(f"Warmed up in {time.monotonic() - start:.2f}s")
+
+
+def start_warm_up() -> Optional[threading.Thread]:
+    """Warm up in the background when STARTUP_WARMUP is enabled."""
+    if not STARTUP_WARMUP:
+        return None
+    thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+class Worker:
+    def __init__(
+        self,
+        queue: JobQueue,
+        concurrency: int = JOB_WORKER_CONCURRENCY,
+        poll_interval: float = JOB_POLL_INTERVAL,
+        visibility_timeout: float = JOB_VISIBILITY_TIMEOUT
+    ):
+        self.queue = queue
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.visibility_timeout = visibility_timeout
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._stopping = threading.Event()
+        self._wakeup = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        """Start the worker threads."""
+        for index in range(self.concurrency):
+            thread = threading.Thread(target=self._loop, name=f"job-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started job worker {self.worker_id} with {self.concurrency} threads")
+
+    def stop(self):
+        """Stop claiming jobs; running jobs are allowed to finish."""
+        self._stopping.set()
+        self._wakeup.set()
+
+    def join(self, timeout: Optional[float] = None):
+        """Wait for the worker threads to exit."""
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def wake(self):
+        """Check the queue now instead of at the next poll."""
+        self._wakeup.set()
+
+    def _loop(self):
+        while not self._stopping.is_set():
+            try:
+                job = self.queue.claim(self.worker_id, self.visibility_timeout)
+            except Exception as e:
+                logger.error(f"Error claiming job: {str(e)}")
+                job = None
+
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            try:
+                self.run_job(job)
+            except Exception as e:
+                logger.error(f"Error recording outcome of job {job.id}: {str(e)}")
+
+    def _heartbeat(self, job: Job, done: threading.Event):
+        while not done.wait(self.visibility_timeout / 3):
+            try:
+                self.queue.heartbeat(job.id, self.worker_id, self.visibility_timeout)
+            except Exception as e:
+                logger.warning(f"Error extending lease of job {job.id}: {str(e)}")
+
+    def _record_failure(self, job: Job, handler: JobHandler, error: str):
+        try:
+            handler.on_failure(error, **job.payload)
+        except Exception as e:
+            logger.error(f"Error recording failure of job {job.id}: {str(e)}")
+
+    def _give_up(self, job: Job, handler: JobHandler, error: str):
+        logger.error(f"Job {job.id} failed: {error}")
+        try:
+            self.queue.fail(job.id, self.worker_id, error)
+        except LeaseLost:
+            logger.warning(f"Lost the lease on job {job.id}, leaving it to the worker that holds it")
+            return
+        self._record_failure(job, handler, error)
+
+    def run_job(self, job: Job):
+        """Run one claimed job and record its outcome in the queue."""
+        if job.attempts == 1 and job.available_at is not None:
+            # Later attempts include the retry delay and lease expiry, which aren't queueing
+            JOB_QUEUE_WAIT_SECONDS.observe(max(time.time() - job.available_at, 0.0), kind=job.kind)
+        # Continue the trace of the request that enqueued the job
+        traceparent = job.payload.pop(tracing.TRACEPARENT_PAYLOAD_KEY, None)
+        with tracing.span(f"job {job.kind}", kind="consumer", parent=traceparent, attempt=job.attempts):
+            self._run_job(job)
+
+    def _run_job(self, job: Job):
+        handler = get_job_handler(job.kind)
+        if handler is None:
+            logger.error(f"No handler for job {job.id} of kind {job.kind}")
+            try:
+                self.queue.fail(job.id, self.worker_id, f"Unknown job kind: {job.kind}")
+            except LeaseLost:
+                pass
+            return
+
+        if job.attempts > job.max_attempts:
+            # The previous worker died while running the last attempt
+            self._give_up(job, handler, "Job lease expired on its final attempt")
+            return
+
+        logger.info(f"Running job {job.id} ({job.kind}), attempt {job.attempts} of {job.max_attempts}")
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job, done), daemon=True)
+        heartbeat.start()
+        start = time.monotonic()
+        try:
+            with JOBS_IN_FLIGHT.track_inprogress(kind=job.kind):
+                handler.run(**job.payload)
+        except Exception as e:
+            done.set()
+            try:
+                will_retry = self.queue.fail(job.id, self.worker_id, str(e))
+            except LeaseLost:
+                # Another worker claimed the job after our lease ran out and is still running it
+                JOB_SECONDS.observe(time.monotonic() - start, kind=job.kind, outcome="lease_lost")
+                logger.warning(f"Job {job.id} failed after its lease was lost, leaving it to the worker that holds it: {str(e)}")
+                return
+            JOB_SECONDS.observe(time.monotonic() - start, kind=job.kind, outcome="retried" if will_retry else "failed")
+            if will_retry:
+                logger.warning(f"Job {job.id} failed, will retry: {str(e)}")
+            else:
+                logger.error(f"Job {job.id} failed after {job.attempts} attempts: {str(e)}")
+                self._record_failure(job, handler, str(e))
+            return
+        finally:
+            done.set()
+
+        JOB_SECONDS.observe(time.monotonic() - start, kind=job.kind, outcome="completed")
+        self.queue.complete(job.id, self.worker_id)
+        logger.info(f"Job {job.id} completed")
+
+
+def start_in_process_workers() -> Optional[Worker]:
+    """Start workers inside the web process when RUN_IN_PROCESS_WORKERS is enabled."""
+    if not RUN_IN_PROCESS_WORKERS:
+        return None
+    worker = Worker(get_job_queue())
+    worker.start()
+    if OPENAI_REAPER_SCHEDULER:
+        start_reaper_scheduler()
+    return worker
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run document processing workers")
+    parser.add_argument("--concurrency", type=int, default=JOB_WORKER_CONCURRENCY, help="Number of jobs to run at once")
+    parser.add_argument("--schedule-reaper", action="store_true", help="Schedule the OpenAI resource reaper from this worker; pass it to one worker only")
+    parser.add_argument("--metrics-port", type=int, default=WORKER_METRICS_PORT, help="Port to serve /metrics on, 0 to disable")
+    args = parser.parse_args()
+
+    if args.metrics_port:
+        try:
+            start_metrics_server(args.metrics_port)
+            logger.info(f"Serving metrics on port {args.metrics_port}")
+        except OSError as e:
+            # Another worker on this machine may have the port; jobs matter more than metrics
+            logger.error(f"Could not serve metrics on port {args.metrics_port}: {str(e)}")
+
+    # A standalone worker is only there to run jobs; load the handlers before claiming any
+    get_job_handlers()
+    worker = Worker(get_job_queue(), concurrency=args.concurrency)
+    reaper_scheduler = start_reaper_scheduler() if args.schedule_reaper else None
+
+    def handle_signal(signum, frame):
+        logger.info("Stopping workers, waiting for running jobs to finish")
+        worker.stop()
+        if reaper_scheduler is not None:
+            reaper_scheduler.stop()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    worker.start()
+    worker.join()
+    shutdown_cpu_executor()
+
+
+if __name__ == "__main__":
+    main()